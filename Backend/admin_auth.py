@@ -0,0 +1,29 @@
+"""
+Proteção das rotas administrativas (/metrics e /admin/slow-queries).
+
+Sem ADMIN_TOKEN definido as rotas respondem 404, como se não existissem. Com ele,
+o token precisa vir no cabeçalho X-Admin-Token ou como `Authorization: Bearer`
+(o formato que o Prometheus envia com `authorization.credentials`).
+"""
+import hmac
+import os
+
+from flask import jsonify, request
+
+
+def _request_token():
+    token = request.headers.get('X-Admin-Token')
+    if token is not None:
+        return token
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return credentials.strip() if scheme.lower() == 'bearer' else ''
+
+
+def check():
+    """None se autorizado; senão a resposta de erro (404 sem ADMIN_TOKEN, 401 com token errado)."""
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'error': 'Não encontrado'}), 404
+    if not hmac.compare_digest(_request_token(), token):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return None
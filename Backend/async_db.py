@@ -0,0 +1,106 @@
+"""
+Acesso assíncrono ao PostgreSQL (asyncpg) para leituras que disparam várias
+consultas independentes ao mesmo tempo.
+
+As rotas do Flask rodam em threads síncronas e um pool do asyncpg fica preso ao
+event loop em que foi criado. Por isso cada processo mantém um único event loop
+em uma thread daemon, com o pool criado nele; as rotas entregam corrotinas com
+`run()` e esperam o resultado. Cada consulta concorrente usa a própria conexão
+do pool, então ASYNC_DB_POOL_MAX limita quantas rodam ao mesmo tempo no worker.
+asyncpg é opcional: sem ele, `available()` é falso e as rotas respondem 503.
+"""
+import asyncio
+import threading
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - depende do ambiente
+    asyncpg = None
+
+
+def available():
+    return asyncpg is not None
+
+
+class AsyncDatabase:
+    def __init__(self, db_config, min_size=1, max_size=10, timeout=30.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._connect_kwargs = {
+            'database': db_config.get('dbname'),
+            'user': db_config.get('user'),
+            'password': db_config.get('password'),
+            'host': db_config.get('host'),
+            'port': db_config.get('port'),
+        }
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self.pool = None
+
+    def _start(self):
+        # Chamado com o lock adquirido; o pool só é criado no processo que vai usá-lo
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name='async-db', daemon=True)
+        thread.start()
+        # create_pool devolve um Pool aguardável, não uma corrotina: run_coroutine_threadsafe
+        # só aceita corrotinas
+        async def create_pool():
+            return await asyncpg.create_pool(
+                min_size=self.min_size, max_size=self.max_size,
+                command_timeout=self.timeout, **self._connect_kwargs,
+            )
+
+        try:
+            self.pool = asyncio.run_coroutine_threadsafe(create_pool(), loop).result(self.timeout)
+        except BaseException:
+            loop.call_soon_threadsafe(loop.stop)
+            raise
+        self._loop, self._thread = loop, thread
+
+    def run(self, coro_fn, *args, timeout=None):
+        """
+        Executa `coro_fn(pool, *args)` no event loop do processo e devolve o resultado.
+        Lança concurrent.futures.TimeoutError se passar de `timeout` segundos.
+        """
+        if asyncpg is None:
+            raise RuntimeError('asyncpg não está instalado')
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    self._start()
+        future = asyncio.run_coroutine_threadsafe(coro_fn(self.pool, *args), self._loop)
+        try:
+            return future.result(timeout or self.timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+            try:
+                asyncio.run_coroutine_threadsafe(self.pool.close(), loop).result(self.timeout)
+            finally:
+                self.pool = None
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join(self.timeout)
+                loop.close()
+
+
+async def fetch(pool, query, *args):
+    """Executa uma consulta em uma conexão própria do pool."""
+    async with pool.acquire() as conn:
+        return await conn.fetch(query, *args)
+
+
+def init_app(app, db_config, min_size=1, max_size=10, timeout=30.0):
+    app.extensions['async_db'] = AsyncDatabase(db_config, min_size, max_size, timeout)
+
+
+def get_async_db(app):
+    return app.extensions['async_db']
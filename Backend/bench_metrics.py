@@ -0,0 +1,84 @@
+"""
+Benchmark do custo da instrumentação de metrics.py.
+
+Mede:
+  - latência de uma rota trivial com e sem os hooks de métricas (test_client,
+    sem rede, para que o custo dos hooks não se perca no ruído);
+  - custo de observe_query por consulta (o que cada execute() paga);
+  - tempo de renderizar /metrics com as séries criadas.
+
+Não precisa do banco. Uso:
+    python bench_metrics.py [--requests 20000] [--queries 200000]
+"""
+import argparse
+import time
+
+from flask import Flask
+
+import metrics
+
+
+class FakeCursor:
+    rowcount = 10
+
+
+def build_app(instrumented):
+    app = Flask(f"bench_{'metrics' if instrumented else 'plain'}")
+    app.extensions['db_pool'] = None
+    if instrumented:
+        metrics.init_app(app)
+
+    @app.route('/paciente/<cpf>')
+    def paciente(cpf):
+        return {'cpf': cpf}
+
+    return app
+
+
+def bench_requests(app, total):
+    client = app.test_client()
+    for i in range(200):
+        client.get(f'/paciente/{i:011d}')
+    start = time.perf_counter()
+    for i in range(total):
+        client.get(f'/paciente/{i:011d}')
+    return (time.perf_counter() - start) / total * 1e6
+
+
+def bench_queries(total):
+    cursor = FakeCursor()
+    queries = [
+        "SELECT nome, cpf FROM paciente WHERE cpf = %s",
+        "SELECT id, data_orcamento FROM orcamentos WHERE id_paciente = %s",
+        "SELECT * FROM pagamentos WHERE id_orcamento = ANY(%s)",
+    ]
+    start = time.perf_counter()
+    for i in range(total):
+        metrics.observe_query(cursor, queries[i % 3], None, 0.0012, None)
+    return (time.perf_counter() - start) / total * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200000)
+    args = parser.parse_args()
+
+    plain = bench_requests(build_app(False), args.requests)
+    instrumented = bench_requests(build_app(True), args.requests)
+    per_query = bench_queries(args.queries)
+
+    start = time.perf_counter()
+    body = metrics.registry.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{'medida':<36}{'valor':>12}")
+    print(f"{'requisição sem métricas (µs)':<36}{plain:>12.1f}")
+    print(f"{'requisição com métricas (µs)':<36}{instrumented:>12.1f}")
+    print(f"{'custo dos hooks por requisição (µs)':<36}{instrumented - plain:>12.1f}")
+    print(f"{'observe_query por consulta (µs)':<36}{per_query:>12.2f}")
+    print(f"{'render de /metrics (ms)':<36}{render_ms:>12.2f}  ({len(body.splitlines())} linhas)")
+
+
+if __name__ == '__main__':
+    main()
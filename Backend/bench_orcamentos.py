@@ -0,0 +1,149 @@
+"""
+Benchmark de GET /paciente/<cpf>/orcamentos: quantidade de consultas e latência
+em função do número de orçamentos, comparando a versão antiga (N+1) com
+fetch_orcamentos (consultas em lote).
+
+Cria um paciente sintético, mede e apaga tudo ao final (ON DELETE CASCADE).
+
+Uso (com o banco do docker-compose rodando):
+    python bench_orcamentos.py [--sizes 1,10,40,100] [--repeat 20]
+"""
+import argparse
+import statistics
+import time
+from datetime import date
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+from main import fetch_orcamentos, load_config
+
+BENCH_CPF = '99999999999'
+
+_query_count = 0
+_counting_classes = {}
+
+
+def _counting_cursor(base):
+    """Subclasse de `base` que conta cada execute()."""
+    if base not in _counting_classes:
+        class CountingCursor(base):
+            def execute(self, query, vars=None):
+                global _query_count
+                _query_count += 1
+                return super().execute(query, vars)
+        _counting_classes[base] = CountingCursor
+    return _counting_classes[base]
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _counting_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+
+def legacy_fetch_orcamentos(cursor, cpf):
+    """Implementação anterior: duas consultas extras por orçamento."""
+    cursor.execute("""
+        SELECT id, data_orcamento FROM orcamentos
+        WHERE id_paciente = %s ORDER BY data_orcamento DESC, id DESC
+    """, (cpf,))
+    resultado = []
+    for orcamento in cursor.fetchall() or []:
+        cursor.execute("""
+            SELECT id, data_item, preco, descricao FROM orcamento_itens
+            WHERE id_orcamento = %s ORDER BY id ASC
+        """, (orcamento['id'],))
+        itens = cursor.fetchall() or []
+        cursor.execute("""
+            SELECT id, data_pagamento, valor_parcela, meio_pagamento FROM pagamentos
+            WHERE id_orcamento = %s ORDER BY data_pagamento DESC
+        """, (orcamento['id'],))
+        pagamentos = cursor.fetchall() or []
+        resultado.append({
+            'id': orcamento['id'],
+            'data_orcamento': str(orcamento['data_orcamento']),
+            'itens': [
+                {
+                    'id': item['id'],
+                    'data_item': str(item['data_item']),
+                    'preco': float(item['preco']),
+                    'descricao': item['descricao'] or ''
+                }
+                for item in itens
+            ],
+            'total': float(sum(float(item['preco']) for item in itens)),
+            'pago': float(sum(float(p['valor_parcela']) for p in pagamentos)),
+            'saldo': float(sum(float(item['preco']) for item in itens))
+                     - float(sum(float(p['valor_parcela']) for p in pagamentos)),
+            'pagamentos': [dict(p) for p in pagamentos]
+        })
+    return resultado
+
+
+def seed(conn, n_orcamentos, itens_por_orcamento=3, pagamentos_por_orcamento=2):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM paciente WHERE cpf = %s", (BENCH_CPF,))
+    cursor.execute("""
+        INSERT INTO paciente (cpf, nome, data_nascimento)
+        VALUES (%s, 'Paciente Benchmark', '1980-01-01')
+    """, (BENCH_CPF,))
+    for i in range(n_orcamentos):
+        cursor.execute("""
+            INSERT INTO orcamentos (id_paciente, data_orcamento) VALUES (%s, %s) RETURNING id
+        """, (BENCH_CPF, date(2020, 1, 1)))
+        orcamento_id = cursor.fetchone()[0]
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO orcamento_itens (id_orcamento, data_item, preco, descricao) VALUES %s
+        """, [(orcamento_id, date(2020, 1, 1), 150 + j, f'Item {j}') for j in range(itens_por_orcamento)])
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO pagamentos (id_orcamento, data_pagamento, valor_parcela, meio_pagamento) VALUES %s
+        """, [(orcamento_id, date(2020, 2, j + 1), 100, 'Pix') for j in range(pagamentos_por_orcamento)])
+    conn.commit()
+    cursor.close()
+
+
+def measure(conn, fn, repeat):
+    global _query_count
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        _query_count = 0
+        start = time.perf_counter()
+        result = fn(cursor, BENCH_CPF)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries = _query_count
+        cursor.close()
+        conn.rollback()
+    return result, queries, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1,10,40,100')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(connection_factory=CountingConnection, **load_config()['DB_CONFIG'])
+    print(f"{'orçamentos':>10} | {'consultas N+1':>13} | {'ms N+1':>8} | {'consultas lote':>14} | {'ms lote':>8}")
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            seed(conn, size)
+            legacy, legacy_queries, legacy_ms = measure(conn, legacy_fetch_orcamentos, args.repeat)
+            batched, batched_queries, batched_ms = measure(conn, fetch_orcamentos, args.repeat)
+            if legacy != batched:
+                raise SystemExit(f'Resultados divergentes com {size} orçamentos')
+            print(f"{size:>10} | {legacy_queries:>13} | {legacy_ms:>8.2f} | {batched_queries:>14} | {batched_ms:>8.2f}")
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM paciente WHERE cpf = %s", (BENCH_CPF,))
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Verificação da tabela `orcamento_resumo` contra orcamento_itens e pagamentos.
+
+Os triggers mantêm o resumo de cada orçamento; aqui os totais são recalculados a
+partir das tabelas de origem e comparados com o que está gravado. Orçamentos sem
+linha de resumo também contam como divergentes. Com `fix`, as linhas divergentes
+são regravadas e a versão dos pacientes afetados é incrementada (ETags).
+"""
+
+COLUMNS = ('total_itens', 'quantidade_itens', 'total_pago', 'ultimo_pagamento')
+
+_DIVERGENCES_QUERY = """
+    SELECT o.id AS id_orcamento, o.id_paciente,
+           r.id_orcamento IS NULL AS ausente,
+           r.total_itens, r.quantidade_itens, r.total_pago, r.ultimo_pagamento,
+           COALESCE(i.total, 0) AS esperado_total_itens,
+           COALESCE(i.quantidade, 0) AS esperado_quantidade_itens,
+           COALESCE(p.pago, 0) AS esperado_total_pago,
+           p.ultimo AS esperado_ultimo_pagamento
+    FROM orcamentos o
+    LEFT JOIN orcamento_resumo r ON r.id_orcamento = o.id
+    LEFT JOIN (
+        SELECT id_orcamento, SUM(preco) AS total, COUNT(*) AS quantidade
+        FROM orcamento_itens GROUP BY id_orcamento
+    ) i ON i.id_orcamento = o.id
+    LEFT JOIN (
+        SELECT id_orcamento, SUM(valor_parcela) AS pago, MAX(data_pagamento) AS ultimo
+        FROM pagamentos GROUP BY id_orcamento
+    ) p ON p.id_orcamento = o.id
+    WHERE r.id_orcamento IS NULL
+       OR (r.total_itens, r.quantidade_itens, r.total_pago, r.ultimo_pagamento)
+          IS DISTINCT FROM (COALESCE(i.total, 0), COALESCE(i.quantidade, 0)::int,
+                            COALESCE(p.pago, 0), p.ultimo)
+    ORDER BY o.id
+"""
+
+
+def check(conn, fix=False):
+    """
+    Retorna a lista de orçamentos divergentes, cada um com os valores gravados e os
+    esperados. Com `fix`, corrige e faz commit; sem, apenas faz rollback.
+    """
+    cursor = conn.cursor()
+    try:
+        # REPEATABLE READ: resumo e tabelas de origem lidos no mesmo snapshot
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute(_DIVERGENCES_QUERY)
+        names = [column.name for column in cursor.description]
+        divergences = [dict(zip(names, row)) for row in cursor.fetchall()]
+
+        if fix and divergences:
+            ids = [row['id_orcamento'] for row in divergences]
+            cursor.execute("""
+                INSERT INTO orcamento_resumo
+                    (id_orcamento, total_itens, quantidade_itens, total_pago, ultimo_pagamento)
+                SELECT o.id,
+                       (SELECT COALESCE(SUM(preco), 0) FROM orcamento_itens WHERE id_orcamento = o.id),
+                       (SELECT COUNT(*) FROM orcamento_itens WHERE id_orcamento = o.id),
+                       (SELECT COALESCE(SUM(valor_parcela), 0) FROM pagamentos WHERE id_orcamento = o.id),
+                       (SELECT MAX(data_pagamento) FROM pagamentos WHERE id_orcamento = o.id)
+                FROM orcamentos o
+                WHERE o.id = ANY(%s)
+                ON CONFLICT (id_orcamento) DO UPDATE
+                SET total_itens = EXCLUDED.total_itens, quantidade_itens = EXCLUDED.quantidade_itens,
+                    total_pago = EXCLUDED.total_pago, ultimo_pagamento = EXCLUDED.ultimo_pagamento
+            """, (ids,))
+            cursor.execute(
+                "SELECT incrementa_versao_paciente(cpf) FROM unnest(%s::varchar[]) AS cpf",
+                (sorted({row['id_paciente'] for row in divergences}),))
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return divergences
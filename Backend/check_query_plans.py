@@ -0,0 +1,243 @@
+"""
+Regressão dos planos das consultas de leitura: falha se alguma cair em Seq Scan.
+
+Cria o esquema `plan_check` no banco configurado (DB_NAME, DB_HOST...), aplica
+Database/init_novo.sql nele, gera uma massa sintética grande e roda ANALYZE. Depois
+chama as rotas de leitura da aplicação (cliente de teste do Flask, com o search_path
+apontando para `plan_check`), captura cada consulta que elas executam e roda EXPLAIN
+em todas. Qualquer Seq Scan nas consultas das rotas quentes faz o script sair com
+código 1. O esquema é apagado no final; o esquema public não é tocado.
+
+O resumo do paciente (asyncpg) não passa por aqui: as consultas dele são as mesmas
+das rotas de detalhes, orçamentos e imagens.
+
+Uso (com o banco do docker-compose rodando):
+    python check_query_plans.py [--pacientes 5000] [--keep]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import psycopg2
+
+import db
+from main import create_app, encode_pacientes_cursor, load_config
+
+SCHEMA = 'plan_check'
+SCHEMA_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Database', 'init_novo.sql')
+
+# Paciente consultado pelas rotas (o do meio da massa)
+SAMPLE_INDEX = 2500
+
+# Rotas quentes: nenhuma consulta delas pode varrer uma tabela inteira.
+# {cpf}, {cursor} e {imagem} são preenchidos a partir da massa gerada.
+HOT_ROUTES = [
+    '/pacientes?limit=50',
+    '/pacientes?limit=50&cursor={cursor}',
+    '/pacientes/{cpf}',
+    '/paciente/{cpf}',
+    '/paciente/{cpf}/orcamentos',
+    '/paciente/{cpf}/orcamentos/descricoes',
+    '/paciente/{cpf}/imagens?limit=50',
+    '/paciente/{cpf}/imagens/{imagem}',
+    '/get_images?cpf={cpf}',
+    '/paciente/{cpf}/export',
+    '/paciente/{cpf}/odontograma',
+    '/anotacoes/busca?q=endodontia',
+    '/anotacoes/busca?q=endodontia&dente=11&de=2020-01-01',
+]
+
+# Tamanho da massa por paciente
+ANOTACOES_POR_PACIENTE = 20
+ORCAMENTOS_POR_PACIENTE = 3
+ITENS_POR_ORCAMENTO = 4
+PAGAMENTOS_POR_ORCAMENTO = 2
+IMAGENS_POR_PACIENTE = 5
+
+
+def create_schema(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+        cursor.execute(f"SET search_path TO {SCHEMA}, public")
+        with open(SCHEMA_SQL, encoding='utf-8') as f:
+            cursor.execute(f.read())
+    conn.commit()
+
+
+def seed(conn, pacientes):
+    params = {
+        'pacientes': pacientes,
+        'anotacoes': ANOTACOES_POR_PACIENTE,
+        'orcamentos': ORCAMENTOS_POR_PACIENTE,
+        'itens': ITENS_POR_ORCAMENTO,
+        'pagamentos': PAGAMENTOS_POR_ORCAMENTO,
+        'imagens': IMAGENS_POR_PACIENTE,
+    }
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO paciente (cpf, nome, telefone, data_nascimento, convenio)
+            SELECT lpad(g::text, 11, '0'), 'Paciente ' || lpad(g::text, 6, '0'), '11999990000',
+                   date '1950-01-01' + g %% 20000, (ARRAY['Unimed', 'Amil', NULL])[1 + g %% 3]
+            FROM generate_series(1, %(pacientes)s) g
+        """, params)
+        cursor.execute("""
+            INSERT INTO informacao_tratamentos
+                (id_paciente, epoch_criacao, numero_dente, data, anotacao, face_dente)
+            SELECT p.cpf, 1600000000000 + t, CASE WHEN t %% 10 = 0 THEN NULL ELSE 11 + t %% 8 END,
+                   date '2020-01-01' + t * 20,
+                   CASE WHEN t = 1 AND hashtext(p.cpf) & 63 = 0 THEN 'Endodontia concluída, canal obturado'
+                        ELSE (ARRAY['Restauração em resina', 'Limpeza e profilaxia', 'Extração simples',
+                                    'Coroa provisória'])[1 + t %% 4] END,
+                   'M, D'
+            FROM paciente p, generate_series(1, %(anotacoes)s) t
+        """, params)
+        cursor.execute("""
+            INSERT INTO orcamentos (id_paciente, data_orcamento)
+            SELECT p.cpf, date '2022-01-01' + (hashtext(p.cpf || o) & 1023) %% 1000
+            FROM paciente p, generate_series(1, %(orcamentos)s) o
+        """, params)
+        cursor.execute("""
+            INSERT INTO orcamento_itens (id_orcamento, data_item, preco, descricao)
+            SELECT o.id, o.data_orcamento, 100 + i * 25, 'Procedimento ' || i
+            FROM orcamentos o, generate_series(1, %(itens)s) i
+        """, params)
+        cursor.execute("""
+            INSERT INTO pagamentos (id_orcamento, data_pagamento, valor_parcela, meio_pagamento)
+            SELECT o.id, o.data_orcamento + i * 30, 80, 'Pix'
+            FROM orcamentos o, generate_series(1, %(pagamentos)s) i
+        """, params)
+        cursor.execute("""
+            INSERT INTO imagens (id_paciente, epoch_insercao, tipo_imagem, caminho_arquivo,
+                                 tamanho_bytes, largura, altura)
+            SELECT p.cpf, e.epoch, 'odontograma',
+                   'pacientes/00/' || p.cpf || '/'
+                   || to_char(to_timestamp(e.epoch / 1000.0) AT TIME ZONE 'UTC',
+                              'YYYY-MM-DD"T"HH24-MI-SS.MS"Z"') || '.png',
+                   150000, 1200, 800
+            FROM paciente p,
+                 LATERAL (SELECT 1700000000000 + i * 86400000::bigint AS epoch
+                          FROM generate_series(1, %(imagens)s) i) e
+        """, params)
+        cursor.execute("ANALYZE")
+    conn.commit()
+
+
+def sample_values(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT cpf, nome FROM paciente ORDER BY nome, cpf OFFSET %s LIMIT 1",
+                       (SAMPLE_INDEX - 1,))
+        cpf, nome = cursor.fetchone()
+        cursor.execute("""
+            SELECT caminho_arquivo FROM imagens WHERE id_paciente = %s
+            ORDER BY epoch_insercao LIMIT 1
+        """, (cpf,))
+        imagem = os.path.basename(cursor.fetchone()[0])[:-len('.png')]
+    conn.rollback()
+    return {'cpf': cpf, 'cursor': encode_pacientes_cursor(nome, cpf), 'imagem': imagem}
+
+
+def capture_queries(db_config, values):
+    """Chama cada rota quente e devolve {rota: [SQL com os parâmetros já substituídos]}."""
+    captured = defaultdict(list)
+    current = []
+
+    def observer(cursor, query, vars, duration, error):
+        if current and error is None and isinstance(query, str):
+            captured[current[0]].append(cursor.mogrify(query, vars).decode('utf-8'))
+
+    app = create_app({
+        'TESTING': True,
+        'DB_CONFIG': {**db_config, 'options': f'-c search_path={SCHEMA},public'},
+        'CACHE_OPTIONS': {'backend': 'none'},
+        'IMAGE_STORAGE_MIGRATION': False,
+        'IMAGE_BASE_FOLDER': tempfile.mkdtemp(prefix='plan_check_'),
+    })
+    db.add_query_observer(app, observer)
+    client = app.test_client()
+    try:
+        for route in HOT_ROUTES:
+            path = route.format(**values)
+            current[:] = [route]
+            response = client.get(path)
+            # O corpo do export é gerado em streaming; lê tudo para fechar a requisição
+            response.get_data()
+            if response.status_code >= 500:
+                raise SystemExit(f'{path} respondeu {response.status_code}')
+        current.clear()
+    finally:
+        pool = app.extensions.get('db_pool')
+        if pool is not None:
+            pool.closeall()
+    return captured
+
+
+def seq_scans(plan):
+    """Tabelas lidas com Seq Scan em algum nó do plano (formato JSON do EXPLAIN)."""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pacientes', type=int, default=5000)
+    parser.add_argument('--keep', action='store_true', help=f'Não apaga o esquema {SCHEMA} no final.')
+    args = parser.parse_args()
+    if args.pacientes < SAMPLE_INDEX:
+        parser.error(f'--pacientes precisa ser pelo menos {SAMPLE_INDEX}')
+
+    db_config = load_config()['DB_CONFIG']
+    conn = psycopg2.connect(**db_config)
+    failures = 0
+    try:
+        started = time.perf_counter()
+        create_schema(conn)
+        seed(conn, args.pacientes)
+        print(f'Massa gerada em {time.perf_counter() - started:.1f}s ({args.pacientes} pacientes)')
+
+        captured = capture_queries(db_config, sample_values(conn))
+        with conn.cursor() as cursor:
+            for route in HOT_ROUTES:
+                queries = [q for q in captured.get(route, [])
+                           if q.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH')]
+                if not queries:
+                    print(f'?    {route}: nenhuma consulta capturada')
+                    failures += 1
+                    continue
+                for query in queries:
+                    cursor.execute('EXPLAIN (FORMAT JSON) ' + query)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    tables = seq_scans(plan[0]['Plan'])
+                    summary = ' '.join(query.split())[:100]
+                    if tables:
+                        failures += 1
+                        print(f"FALHA {route}: Seq Scan em {', '.join(sorted(set(tables)))}\n      {summary}")
+                    else:
+                        print(f'ok   {route}: {summary}')
+        conn.rollback()
+    finally:
+        conn.rollback()
+        if not args.keep:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+    if failures:
+        print(f'{failures} consulta(s) com problema')
+        sys.exit(1)
+    print('Nenhuma consulta das rotas quentes usa Seq Scan')
+
+
+if __name__ == '__main__':
+    main()
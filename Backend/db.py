@@ -0,0 +1,297 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from flask import current_app, g
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo limite de espera."""
+
+
+_instrumented_cursors = {}
+
+
+def add_query_observer(app, observer):
+    """
+    Registra `observer(cursor, query, vars, duração em s, erro)`, chamado após cada
+    execute() nas conexões do pool da aplicação.
+    """
+    observers = app.extensions['db_query_observers']
+    if observer not in observers:
+        observers.append(observer)
+
+
+def clear_query_observers(app):
+    app.extensions['db_query_observers'].clear()
+
+
+def _instrumented_cursor(base):
+    """Subclasse de `base` (cursor, RealDictCursor...) que cronometra cada execute()."""
+    cls = _instrumented_cursors.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                observers = self.connection.query_observers
+                if not observers:
+                    return super().execute(query, vars)
+                error = None
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    duration = time.perf_counter() - start
+                    for observer in observers:
+                        observer(self, query, vars, duration, error)
+
+        InstrumentedCursor.__name__ = f"Instrumented{base.__name__}"
+        cls = _instrumented_cursors.setdefault(base, InstrumentedCursor)
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Conexão cujos cursores (de qualquer cursor_factory) avisam os observers de consultas."""
+
+    # Lista de observers do pool que abriu a conexão
+    query_observers = ()
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _instrumented_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    """
+    Pool de conexões PostgreSQL seguro para threads.
+
+    Mantém entre `minconn` e `maxconn` conexões abertas. Quando todas estão em
+    uso, `getconn` espera até `timeout` segundos por uma devolução em vez de
+    falhar imediatamente. Conexões ociosas há mais de `health_check_interval`
+    segundos são testadas com `SELECT 1` antes de serem entregues.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=10.0, health_check_interval=30.0,
+                 leak_timeout=300.0, query_observers=None, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Tamanhos de pool inválidos: min=%s max=%s' % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.leak_timeout = leak_timeout
+        self.query_observers = query_observers if query_observers is not None else []
+        connect_kwargs.setdefault('connection_factory', InstrumentedConnection)
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()        # (conexão, instante da devolução)
+        self._in_use = {}           # id(conexão) -> [conexão, instante do checkout, já contada como vazamento]
+        self._size = 0
+        self._closed = False
+        self._counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'leaks': 0,
+            'discarded': 0,
+            'created': 0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+            self._counters['created'] += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        if isinstance(conn, InstrumentedConnection):
+            conn.query_observers = self.query_observers
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._counters['discarded'] += 1
+
+    def _check_leaks(self):
+        # Chamado com o lock adquirido: conta uma única vez cada conexão presa além do limite
+        now = time.monotonic()
+        for entry in self._in_use.values():
+            if not entry[2] and now - entry[1] > self.leak_timeout:
+                entry[2] = True
+                self._counters['leaks'] += 1
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    raise psycopg2.pool.PoolError('pool fechado')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reserva a vaga antes de conectar para não ultrapassar maxconn
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                self._check_leaks()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout('Tempo esgotado aguardando conexão do pool (%ss)' % self.timeout)
+                if not waited:
+                    waited = True
+                    self._counters['waits'] += 1
+                self._cond.wait(remaining)
+
+        # Conectar e testar conexões fica fora do lock
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                with self._cond:
+                    self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    self._counters['created'] += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use[id(conn)] = [conn, time.monotonic(), False]
+            self._counters['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            if self._in_use.pop(id(conn), None) is None:
+                raise psycopg2.pool.PoolError('conexão não pertence a este pool')
+
+        # Nunca devolve ao pool uma conexão com transação aberta
+        if not conn.closed and not close:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            if self._closed or close or conn.closed or len(self._idle) >= self.maxconn:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão fora do ciclo da requisição (streams, comandos de CLI)."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            self._check_leaks()
+            stats = dict(self._counters)
+            stats.update({
+                'min': self.minconn,
+                'max': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+            })
+            return stats
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+            for conn, _, _ in self._in_use.values():
+                conn.close()
+            self._in_use.clear()
+            self._size = 0
+            self._cond.notify_all()
+
+
+_pool_lock = threading.Lock()
+
+
+def init_app(app, db_config, minconn=1, maxconn=10, timeout=10.0, health_check_interval=30.0,
+             leak_timeout=300.0):
+    """
+    Registra o pool na aplicação. O pool só é criado na primeira requisição,
+    de modo que cada worker (após o fork) abre as próprias conexões.
+    """
+    app.config['DB_POOL_OPTIONS'] = {
+        'minconn': minconn,
+        'maxconn': maxconn,
+        'timeout': timeout,
+        'health_check_interval': health_check_interval,
+        'leak_timeout': leak_timeout,
+    }
+    app.config['DB_CONFIG'] = dict(db_config)
+    app.extensions['db_pool'] = None
+    app.extensions['db_query_observers'] = []
+    app.teardown_appcontext(close_db_connection)
+
+
+def get_pool(app=None):
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get('db_pool')
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get('db_pool')
+            if pool is None:
+                pool = ConnectionPool(**app.config['DB_POOL_OPTIONS'], **app.config['DB_CONFIG'],
+                                      query_observers=app.extensions['db_query_observers'])
+                app.extensions['db_pool'] = pool
+    return pool
+
+
+def get_db_connection():
+    """
+    Retorna a conexão da requisição atual. Chamadas repetidas na mesma
+    requisição reutilizam a mesma conexão, devolvida ao pool no teardown.
+    """
+    if 'db_conn' not in g:
+        g.db_conn = get_pool().getconn()
+    return g.db_conn
+
+
+def close_db_connection(exc=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().putconn(conn)
@@ -0,0 +1,55 @@
+"""
+Configuração do Gunicorn (servidor de produção). Todos os valores podem ser
+ajustados por variáveis de ambiente:
+
+    HOST / PORT                 endereço de escuta (padrão 0.0.0.0:5000)
+    GUNICORN_WORKERS            processos (padrão 2 x CPUs + 1, no máximo 8)
+    GUNICORN_THREADS            threads por processo (padrão 4)
+    GUNICORN_TIMEOUT            segundos sem resposta do worker antes de reiniciá-lo (padrão 60)
+    GUNICORN_GRACEFUL_TIMEOUT   segundos para terminar as requisições em andamento ao parar (padrão 30)
+    GUNICORN_KEEPALIVE          segundos de keep-alive das conexões HTTP (padrão 5)
+    GUNICORN_MAX_REQUESTS       requisições até reciclar um worker (padrão 2000; 0 desativa)
+
+Cada thread usa no máximo uma conexão do banco por vez, então DB_POOL_MAX deve
+ser >= GUNICORN_THREADS; o total no PostgreSQL é GUNICORN_WORKERS x DB_POOL_MAX.
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+
+# gthread: cada worker atende várias requisições ao mesmo tempo (E/S no banco e em disco)
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recicla workers aos poucos para conter crescimento de memória
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# Sem preload: cada worker cria a aplicação (e o próprio pool) depois do fork
+preload_app = False
+
+# O log de acesso já é gerado pela aplicação (request_log)
+accesslog = None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Heartbeat dos workers em memória, não em disco
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def worker_exit(server, worker):
+    """Fecha o pool e espera as tarefas em segundo plano do worker que está saindo."""
+    app = getattr(worker, 'wsgi', None)
+    if app is None:
+        return
+    from main import shutdown_app
+    shutdown_app(app)
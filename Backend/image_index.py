@@ -0,0 +1,208 @@
+"""
+Índice das imagens dos pacientes na tabela `imagens`.
+
+Os arquivos continuam em BASE_FOLDER; a tabela guarda o caminho relativo e os
+metadados (tamanho e dimensões) para que listar e localizar imagens seja uma
+consulta pela chave primária (id_paciente, epoch_insercao), sem varrer pastas.
+
+Layout das pastas: pacientes/<2 primeiros hex do sha1 do CPF>/<cpf>/. Ele depende
+só do CPF, que nunca muda, então renomear um paciente não mexe em arquivos e
+resolver o caminho não consulta o banco. As pastas antigas "{nome} - {cpf}" e
+"{cpf}" são movidas para esse layout por storage_migration.
+"""
+import hashlib
+import os
+import re
+from datetime import datetime, timezone
+
+import psycopg2.extras
+
+import thumbnails
+
+TIPO_ODONTOGRAMA = 'odontograma'
+STORAGE_ROOT = 'pacientes'
+
+# Layout antigo: "{nome} - {cpf}" ou apenas "{cpf}"
+LEGACY_FOLDER_RE = re.compile(r'(?:^|.* - )(\d{11})$')
+_CPF_RE = re.compile(r'\d{11}$')
+
+# Namespace dos advisory locks por paciente (primeiro argumento de pg_advisory_xact_lock)
+IMAGE_LOCK_NAMESPACE = 7301
+
+
+def patient_dir(cpf):
+    """Pasta (relativa a BASE_FOLDER) das imagens do paciente."""
+    shard = hashlib.sha1(cpf.encode('utf-8')).hexdigest()[:2]
+    return os.path.join(STORAGE_ROOT, shard, cpf)
+
+
+def lock_patient_images(cursor, cpf):
+    """
+    Serializa, até o fim da transação, quem grava ou move as imagens do paciente.
+    Usado pelas rotas de escrita e pela migração de layout.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (IMAGE_LOCK_NAMESPACE, cpf))
+
+
+def iter_patient_folders(base_folder):
+    """
+    Gera (cpf, pasta relativa, layout_novo) para cada pasta de paciente em
+    `base_folder`, no layout novo e no antigo.
+    """
+    if not os.path.isdir(base_folder):
+        return
+    root = os.path.join(base_folder, STORAGE_ROOT)
+    if os.path.isdir(root):
+        for shard in os.scandir(root):
+            if not shard.is_dir():
+                continue
+            for folder in os.scandir(shard.path):
+                if folder.is_dir() and _CPF_RE.match(folder.name):
+                    yield folder.name, os.path.join(STORAGE_ROOT, shard.name, folder.name), True
+    for folder in os.scandir(base_folder):
+        if not folder.is_dir() or folder.name == STORAGE_ROOT:
+            continue
+        match = LEGACY_FOLDER_RE.match(folder.name)
+        if match:
+            yield match.group(1), folder.name, False
+
+
+def parse_image_timestamp(raw):
+    """
+    Converte o nome do arquivo (sem extensão), algo como "2025-02-28T16-26-29.545Z",
+    em datetime com fuso. Horários sem fuso são tratados como UTC.
+    Lança ValueError se o nome não estiver nesse formato.
+    """
+    # Separa a parte da data e do tempo
+    date_part, time_part = raw.split("T")
+    # Substitui somente os dois primeiros hífens da parte do tempo por dois pontos
+    time_part_fixed = time_part.replace("-", ":", 2)
+    # Ajusta para um formato ISO compatível com datetime.fromisoformat (substituindo 'Z' por '+00:00')
+    dt = datetime.fromisoformat(f"{date_part}T{time_part_fixed}".replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def image_epoch_ms(raw):
+    """Chave epoch_insercao (milissegundos) da imagem de nome `raw`."""
+    return round(parse_image_timestamp(raw).timestamp() * 1000)
+
+
+def read_png_dimensions(filepath):
+    """Lê largura e altura do cabeçalho IHDR do PNG sem decodificar a imagem."""
+    with open(filepath, "rb") as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        return None, None
+    return int.from_bytes(header[16:20], 'big'), int.from_bytes(header[20:24], 'big')
+
+
+def file_metadata(filepath):
+    """(tamanho em bytes, largura, altura) do arquivo."""
+    width, height = read_png_dimensions(filepath)
+    return os.path.getsize(filepath), width, height
+
+
+def upsert_image(cursor, cpf, raw, relative_path, filepath):
+    """Grava (ou atualiza) a linha da imagem. Não faz commit."""
+    size, width, height = file_metadata(filepath)
+    cursor.execute("""
+        INSERT INTO imagens (id_paciente, epoch_insercao, tipo_imagem, caminho_arquivo,
+                             tamanho_bytes, largura, altura)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (id_paciente, epoch_insercao) DO UPDATE
+        SET caminho_arquivo = EXCLUDED.caminho_arquivo,
+            tamanho_bytes = EXCLUDED.tamanho_bytes,
+            largura = EXCLUDED.largura,
+            altura = EXCLUDED.altura
+    """, (cpf, image_epoch_ms(raw), TIPO_ODONTOGRAMA, relative_path, size, width, height))
+
+
+def scan_folder(base_folder):
+    """
+    Percorre BASE_FOLDER e devolve {(cpf, epoch): (raw, caminho relativo)} para
+    cada PNG reconhecido, além da lista de arquivos ignorados.
+    """
+    found = {}
+    priority = {}
+    skipped = []
+    for cpf, relative_folder, new_layout in iter_patient_folders(base_folder):
+        # Se a mesma imagem existir em mais de uma pasta: layout novo > "{nome} - {cpf}" > "{cpf}"
+        folder_priority = 2 if new_layout else (0 if relative_folder == cpf else 1)
+        for entry in os.scandir(os.path.join(base_folder, relative_folder)):
+            if not entry.is_file() or not entry.name.endswith('.png') or thumbnails.is_thumbnail(entry.name):
+                continue
+            raw = entry.name[:-len('.png')]
+            try:
+                epoch = image_epoch_ms(raw)
+            except ValueError:
+                skipped.append(os.path.join(relative_folder, entry.name))
+                continue
+            key = (cpf, epoch)
+            if priority.get(key, -1) < folder_priority:
+                priority[key] = folder_priority
+                found[key] = (raw, os.path.join(relative_folder, entry.name))
+    return found, skipped
+
+
+def reconcile(conn, base_folder, dry_run=False):
+    """
+    Sincroniza a tabela `imagens` com os arquivos em `base_folder`: insere imagens
+    sem linha, corrige caminho/tamanho divergentes e remove linhas cujo arquivo
+    não existe mais. Tudo em uma transação. Retorna contadores do que foi feito.
+    """
+    found, skipped = scan_folder(base_folder)
+    cursor = conn.cursor()
+    cursor.execute("SELECT cpf FROM paciente")
+    pacientes = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT id_paciente, epoch_insercao, caminho_arquivo, tamanho_bytes FROM imagens")
+    indexed = {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+    stats = {'inserted': 0, 'updated': 0, 'removed': 0, 'orphans': 0, 'skipped': len(skipped)}
+    upserts = []
+    for (cpf, epoch), (raw, relative_path) in found.items():
+        if cpf not in pacientes:
+            # Pasta de um paciente que não existe mais no banco
+            stats['orphans'] += 1
+            continue
+        filepath = os.path.join(base_folder, relative_path)
+        current = indexed.get((cpf, epoch))
+        if current is None:
+            stats['inserted'] += 1
+        elif current[0] != relative_path or current[1] != os.path.getsize(filepath):
+            stats['updated'] += 1
+        else:
+            continue
+        size, width, height = file_metadata(filepath)
+        upserts.append((cpf, epoch, TIPO_ODONTOGRAMA, relative_path, size, width, height))
+
+    missing = [
+        key for key, (relative_path, _) in indexed.items()
+        if key not in found and not os.path.exists(os.path.join(base_folder, relative_path))
+    ]
+    stats['removed'] = len(missing)
+
+    if not dry_run:
+        if upserts:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO imagens (id_paciente, epoch_insercao, tipo_imagem, caminho_arquivo,
+                                     tamanho_bytes, largura, altura)
+                VALUES %s
+                ON CONFLICT (id_paciente, epoch_insercao) DO UPDATE
+                SET caminho_arquivo = EXCLUDED.caminho_arquivo,
+                    tamanho_bytes = EXCLUDED.tamanho_bytes,
+                    largura = EXCLUDED.largura,
+                    altura = EXCLUDED.altura
+            """, upserts)
+        if missing:
+            psycopg2.extras.execute_values(cursor, """
+                DELETE FROM imagens i
+                USING (VALUES %s) AS m (id_paciente, epoch_insercao)
+                WHERE i.id_paciente = m.id_paciente AND i.epoch_insercao = m.epoch_insercao
+            """, missing)
+        conn.commit()
+    else:
+        conn.rollback()
+    cursor.close()
+    return stats
@@ -1,54 +1,141 @@
+import asyncio
 import time
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify, Response, send_file, url_for
 from flask_cors import CORS
 import psycopg2
 from flask import jsonify
 import psycopg2.extras
+from werkzeug.security import safe_join
 
 
 import os
 import base64
-from datetime import datetime
+import csv
+import functools
+import io
+import json
+import uuid
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+
+import async_db
+import budget_summary
+import db
+import image_index
+import metrics
+import patient_import
+import read_cache
+import record_export
+import request_log
+import slow_queries
+import storage_migration
+import thumbnails
+from db import get_db_connection
+from read_cache import DESCRICOES, DETALHES, ORCAMENTOS, cached_patient_read, invalidate_all, invalidate_patient
+
+
+logger = request_log.logger
+
+# Rotas da API; registradas na aplicação por create_app
+bp = Blueprint('clinica', __name__, cli_group=None)
+
+
+def load_config():
+    """Configuração da aplicação a partir de variáveis de ambiente."""
+    return {
+        # Limite do corpo das requisições (uploads de imagem); Werkzeug responde 413 acima disso
+        'MAX_CONTENT_LENGTH': int(os.environ.get('MAX_UPLOAD_BYTES', 32 * 1024 * 1024)),
+        'DB_CONFIG': {
+            'dbname': os.environ.get('DB_NAME', 'clinica'),
+            'user': os.environ.get('DB_USER', 'admin'),
+            'password': os.environ.get('DB_PASSWORD', 'admin123'),
+            'host': os.environ.get('DB_HOST', 'localhost'),
+            'port': int(os.environ.get('DB_PORT', 5432)),
+        },
+        'DB_POOL_OPTIONS': {
+            'minconn': int(os.environ.get('DB_POOL_MIN', 1)),
+            'maxconn': int(os.environ.get('DB_POOL_MAX', 10)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'health_check_interval': float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', 30)),
+            'leak_timeout': float(os.environ.get('DB_POOL_LEAK_TIMEOUT', 300)),
+        },
+        # Pool asyncpg das leituras com consultas concorrentes (ver async_db)
+        'ASYNC_DB_POOL_OPTIONS': {
+            'min_size': int(os.environ.get('ASYNC_DB_POOL_MIN', 1)),
+            'max_size': int(os.environ.get('ASYNC_DB_POOL_MAX', 10)),
+            'timeout': float(os.environ.get('ASYNC_DB_TIMEOUT', 30)),
+        },
+        'IMAGE_BASE_FOLDER': os.environ.get('IMAGE_BASE_FOLDER', 'patient_images'),
+        # Tempo (segundos) que o navegador pode reutilizar uma imagem sem revalidar.
+        # O padrão 0 força revalidação a cada visualização, respondida com 304 se nada mudou;
+        # update_image sobrescreve o arquivo, o que troca o ETag.
+        'IMAGE_CACHE_MAX_AGE': int(os.environ.get('IMAGE_CACHE_MAX_AGE', 0)),
+        'IMAGE_STORAGE_MIGRATION': os.environ.get('IMAGE_STORAGE_MIGRATION', '1') == '1',
+        # Cache das leituras do paciente (ver read_cache)
+        'CACHE_OPTIONS': {
+            'backend': os.environ.get('CACHE_BACKEND', 'local'),
+            'max_entries': int(os.environ.get('CACHE_MAX_ENTRIES', 1024)),
+            'ttl': float(os.environ.get('CACHE_TTL', 60)),
+            'redis_url': os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+        },
+    }
+
+
+def create_app(config=None):
+    """
+    Cria a aplicação. `config` sobrescreve os valores de load_config().
+    Nada aqui abre conexões: o pool é criado na primeira requisição de cada worker.
+    """
+    app = Flask(__name__)
+    app.config.update(load_config())
+    app.config.update(config or {})
+    CORS(app, resources={r"/*": {"origins": "*"}})  # Permite requisições de qualquer origem
 
+    # Log estruturado: uma linha JSON por requisição, escrita fora da thread da requisição
+    request_log.init_app(app)
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  # Permite requisições de qualquer origem
+    # Pool de conexões: uma conexão por requisição, devolvida ao pool no teardown
+    db.init_app(app, app.config['DB_CONFIG'], **app.config['DB_POOL_OPTIONS'])
+    async_db.init_app(app, app.config['DB_CONFIG'], **app.config['ASYNC_DB_POOL_OPTIONS'])
 
-# Middleware para logging de requisições
-@app.before_request
-def log_request_info():
-    print(f"\n{'='*60}")
-    print(f"REQUEST RECEBIDA:")
-    print(f"  Método: {request.method}")
-    print(f"  URL: {request.url}")
-    print(f"  Origem: {request.remote_addr}")
-    print(f"  Headers: {dict(request.headers)}")
-    print(f"  Path: {request.path}")
-    print(f"{'='*60}\n")
+    # Métricas Prometheus (rotas, consultas SQL e pool) em GET /metrics
+    metrics.init_app(app)
 
-@app.after_request
-def log_response_info(response):
-    print(f"\n{'='*60}")
-    print(f"RESPOSTA ENVIADA:")
-    print(f"  Status: {response.status_code}")
-    print(f"  Headers: {dict(response.headers)}")
-    print(f"{'='*60}\n")
-    return response
+    # Cache das leituras do paciente, invalidado pelas rotas de escrita
+    read_cache.init_app(app, etag_getter=patient_etag, **app.config['CACHE_OPTIONS'])
 
-# Configuração do banco de dados
-DB_CONFIG = {
-    'dbname': 'clinica',
-    'user': 'admin',
-    'password': 'admin123',
-    'host': 'localhost',
-    'port': 5432
-}
+    # Consultas acima de SLOW_QUERY_MS vão para o log; amostras ganham EXPLAIN em /admin/slow-queries
+    slow_queries.init_app(app)
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    # Garante que a pasta base das imagens exista
+    os.makedirs(app.config['IMAGE_BASE_FOLDER'], exist_ok=True)
+
+    app.register_blueprint(bp)
+    return app
+
+
+def shutdown_app(app):
+    """
+    Encerramento gracioso de um worker: interrompe a migração de pastas, espera as
+    miniaturas pendentes, remove os observers de consultas, para o log (se for a última
+    aplicação do processo) e fecha as conexões do pool.
+    """
+    stop_event = app.extensions.get('storage_migration')
+    if stop_event is not None:
+        stop_event.set()
+    thumbnails.shutdown()
+    app.extensions['async_db'].close()
+    db.clear_query_observers(app)
+    request_log.shutdown(app)
+    pool = app.extensions.get('db_pool')
+    if pool is not None:
+        pool.closeall()
 
 # Endpoint para cadastrar um novo paciente
-@app.route('/pacientes', methods=['POST'])
+@bp.route('/pacientes', methods=['POST'])
 def add_paciente():
     data = request.json
     try:
@@ -65,40 +152,191 @@ def add_paciente():
         ))
         conn.commit()
         cursor.close()
-        conn.close()
+        invalidate_patient(data['cpf'])
         return jsonify({'message': 'Paciente cadastrado com sucesso!'}), 201
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao cadastrar paciente.')
         return jsonify({'error': 'Erro ao cadastrar paciente.'}), 500
 
-# Endpoint para listar todos os pacientes
-@app.route('/pacientes', methods=['GET'])
+# Campos que podem ser pedidos em GET /pacientes?fields=... (nome na resposta -> coluna)
+PACIENTE_FIELDS = {
+    'cpf': 'cpf',
+    'nome': 'nome',
+    'telefone': 'telefone',
+    'dataNascimento': 'data_nascimento',
+    'endereco': 'endereco',
+    'convenio': 'convenio',
+}
+PACIENTES_MAX_LIMIT = 500
+
+def encode_pacientes_cursor(nome, cpf):
+    raw = json.dumps([nome, cpf]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_pacientes_cursor(cursor_param):
+    """Decodifica o cursor opaco de paginação em (nome, cpf). Lança ValueError se inválido."""
+    try:
+        nome, cpf = json.loads(base64.urlsafe_b64decode(cursor_param.encode('ascii')))
+    except Exception:
+        raise ValueError('cursor inválido')
+    if not isinstance(nome, str) or not isinstance(cpf, str):
+        raise ValueError('cursor inválido')
+    return nome, cpf
+
+# Endpoint para listar os pacientes
+# Sem `limit`/`cursor` devolve a lista completa (formato antigo). Com eles, pagina por
+# (nome, cpf): cada página é uma varredura de intervalo no índice idx_paciente_nome_cpf.
+@bp.route('/pacientes', methods=['GET'])
 def get_pacientes():
+    fields_param = request.args.get('fields')
+    limit_param = request.args.get('limit')
+    cursor_param = request.args.get('cursor')
+
+    if fields_param:
+        fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+        invalid = [f for f in fields if f not in PACIENTE_FIELDS]
+        if invalid or not fields:
+            return jsonify({'error': f"Campos inválidos: {', '.join(invalid)}"}), 400
+    else:
+        fields = list(PACIENTE_FIELDS)
+
+    paginated = limit_param is not None or cursor_param is not None
+    after = None
+    if paginated:
+        try:
+            limit = int(limit_param) if limit_param is not None else 50
+            if limit < 1:
+                raise ValueError
+            limit = min(limit, PACIENTES_MAX_LIMIT)
+            if cursor_param:
+                after = decode_pacientes_cursor(cursor_param)
+        except ValueError:
+            return jsonify({'error': 'Parâmetros de paginação inválidos.'}), 400
+
+    # nome e cpf sempre são lidos: são a chave de ordenação e do cursor
+    columns = ['nome', 'cpf'] + [PACIENTE_FIELDS[f] for f in fields if f not in ('nome', 'cpf')]
+    query = f"SELECT {', '.join(columns)} FROM paciente"
+    params = []
+    if paginated:
+        if after:
+            query += " WHERE (nome, cpf) > (%s, %s)"
+            params.extend(after)
+        query += " ORDER BY nome, cpf LIMIT %s"
+        # Busca um registro a mais para saber se existe próxima página
+        params.append(limit + 1)
+
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        query = "SELECT cpf, nome, telefone, data_nascimento, endereco, convenio FROM paciente"
-        cursor.execute(query)
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(query, params)
         rows = cursor.fetchall()
-        pacientes = [
-            {
-                'cpf': row[0],
-                'nome': row[1],
-                'telefone': row[2],
-                'dataNascimento': row[3],
-                'endereco': row[4],
-                'convenio': row[5]
-            } for row in rows
-        ]
         cursor.close()
-        conn.close()
-        return jsonify(pacientes), 200
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao buscar pacientes.')
         return jsonify({'error': 'Erro ao buscar pacientes.'}), 500
 
+    if not paginated:
+        return jsonify([{f: row[PACIENTE_FIELDS[f]] for f in fields} for row in rows]), 200
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_pacientes_cursor(rows[-1]['nome'], rows[-1]['cpf'])
+    return jsonify({
+        'pacientes': [{f: row[PACIENTE_FIELDS[f]] for f in fields} for row in rows],
+        'next_cursor': next_cursor,
+    }), 200
+
+# Linhas lidas do cursor de servidor a cada ida ao banco durante a exportação
+EXPORT_BATCH_SIZE = 2000
+
+def _export_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+# Endpoint para exportar a tabela inteira de pacientes (NDJSON ou CSV) em streaming.
+# Lê por um cursor nomeado (do lado do servidor), em lotes, então a memória não
+# cresce com o tamanho da tabela e o primeiro lote é enviado assim que lido.
+@bp.route('/pacientes/export', methods=['GET'])
+def export_pacientes():
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Formato inválido. Use ndjson ou csv.'}), 400
+
+    # A conexão é emprestada do pool pelo próprio gerador, que roda depois do
+    # fim da função e precisa dela até o último lote
+    pool = db.get_pool()
+    fields = list(PACIENTE_FIELDS)
+    columns = [PACIENTE_FIELDS[f] for f in fields]
+
+    def generate():
+        with pool.connection() as conn:
+            cursor = conn.cursor(name='export_pacientes')
+            cursor.itersize = EXPORT_BATCH_SIZE
+            cursor.execute(f"SELECT {', '.join(columns)} FROM paciente ORDER BY cpf")
+            try:
+                if export_format == 'csv':
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerow(fields)
+                    yield buffer.getvalue()
+                while True:
+                    rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    if export_format == 'csv':
+                        buffer = io.StringIO()
+                        writer = csv.writer(buffer)
+                        writer.writerows([_export_value(v) for v in row] for row in rows)
+                        yield buffer.getvalue()
+                    else:
+                        yield ''.join(
+                            json.dumps(dict(zip(fields, map(_export_value, row))), ensure_ascii=False) + '\n'
+                            for row in rows
+                        )
+            finally:
+                cursor.close()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"pacientes.{export_format}"
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# Máximo de erros por linha devolvidos na resposta da importação (o total vem em 'invalid')
+IMPORT_MAX_ERRORS = 1000
+
+# Endpoint para importar pacientes em lote (CSV ou NDJSON), via COPY. Aceita o arquivo
+# no campo "file" (multipart) ou no corpo, com ?format=csv|ndjson, ?on_conflict=update|skip
+# e ?dry_run=1 (apenas valida). Linhas inválidas voltam em 'errors' sem impedir as demais.
+@bp.route('/pacientes/import', methods=['POST'])
+def import_pacientes():
+    upload = request.files.get('file')
+    source = upload.stream if upload else request.stream
+    filename = (upload.filename or '') if upload else ''
+    content_type = (upload.mimetype if upload else request.mimetype) or ''
+    default_format = 'ndjson' if filename.endswith('.ndjson') or 'ndjson' in content_type else 'csv'
+    import_format = request.args.get('format', default_format).lower()
+    on_conflict = request.args.get('on_conflict', 'update').lower()
+    dry_run = request.args.get('dry_run') == '1'
+
+    try:
+        text = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+        result = patient_import.import_patients(
+            get_db_connection(), text, import_format, on_conflict, dry_run)
+    except (patient_import.ImportFormatError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        logger.exception('Erro ao importar pacientes.')
+        return jsonify({'error': 'Erro ao importar pacientes.'}), 500
+
+    if not dry_run and (result['inserted'] or result['updated']):
+        invalidate_all()
+    result['errors_truncated'] = len(result['errors']) > IMPORT_MAX_ERRORS
+    result['errors'] = result['errors'][:IMPORT_MAX_ERRORS]
+    result['dry_run'] = dry_run
+    return jsonify(result), 200
+
 # Endpoint para buscar um paciente específico pelo CPF
-@app.route('/pacientes/<cpf>', methods=['GET'])
+@bp.route('/pacientes/<cpf>', methods=['GET'])
 def get_paciente(cpf):
     try:
         conn = get_db_connection()
@@ -107,7 +345,6 @@ def get_paciente(cpf):
         cursor.execute(query, (cpf,))
         row = cursor.fetchone()
         cursor.close()
-        conn.close()
         if row:
             paciente = {
                 'cpf': row[0],
@@ -120,24 +357,20 @@ def get_paciente(cpf):
             return jsonify(paciente), 200
         else:
             return jsonify({'message': 'Paciente não encontrado.'}), 404
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao buscar paciente.')
         return jsonify({'error': 'Erro ao buscar paciente.'}), 500
 
 # Endpoint para atualizar os dados de um paciente
-@app.route('/pacientes/<cpf>', methods=['PUT'])
+@bp.route('/pacientes/<cpf>', methods=['PUT'])
 def update_paciente(cpf):
     data = request.json
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Busca o nome antigo antes de atualizar
-        cursor.execute("SELECT nome FROM paciente WHERE cpf = %s", (cpf,))
-        old_row = cursor.fetchone()
-        old_nome = old_row[0] if old_row else None
-        
-        # Atualiza os dados do paciente
+        # Atualiza os dados do paciente. As imagens ficam em uma pasta derivada só
+        # do CPF (image_index.patient_dir), então mudar o nome não mexe em arquivos.
         query = """
             UPDATE paciente
             SET nome = %s, telefone = %s, data_nascimento = %s, endereco = %s, convenio = %s
@@ -149,54 +382,16 @@ def update_paciente(cpf):
             data.get('convenio'), cpf
         ))
         conn.commit()
-        
-        # Se o nome mudou, renomeia a pasta de imagens
-        new_nome = data['nome']
-        if old_nome and old_nome.strip() != new_nome.strip():
-            import shutil
-            # Remove caracteres inválidos do nome antigo e novo
-            def sanitize_name(name):
-                return name.replace('/', '-').replace('\\', '-').replace(':', '-').replace('*', '-').replace('?', '-').replace('"', '-').replace('<', '-').replace('>', '-').replace('|', '-').strip()
-            
-            old_nome_safe = sanitize_name(old_nome)
-            new_nome_safe = sanitize_name(new_nome)
-            
-            old_folder_name = f"{old_nome_safe} - {cpf}"
-            new_folder_name = f"{new_nome_safe} - {cpf}"
-            
-            old_folder_path = os.path.join(BASE_FOLDER, old_folder_name)
-            new_folder_path = os.path.join(BASE_FOLDER, new_folder_name)
-            
-            # Se a pasta antiga existe e é diferente da nova, renomeia
-            if os.path.exists(old_folder_path) and old_folder_path != new_folder_path:
-                try:
-                    # Se a pasta nova já existe, move os arquivos para dentro dela
-                    if os.path.exists(new_folder_path):
-                        for filename in os.listdir(old_folder_path):
-                            old_file = os.path.join(old_folder_path, filename)
-                            new_file = os.path.join(new_folder_path, filename)
-                            if not os.path.exists(new_file):
-                                shutil.move(old_file, new_file)
-                        # Remove a pasta antiga se estiver vazia
-                        if not os.listdir(old_folder_path):
-                            os.rmdir(old_folder_path)
-                    else:
-                        # Renomeia a pasta inteira
-                        shutil.move(old_folder_path, new_folder_path)
-                    print(f"Pasta renomeada de '{old_folder_name}' para '{new_folder_name}'")
-                except Exception as e:
-                    print(f"Erro ao renomear pasta de imagens: {e}")
-                    # Não falha a atualização do paciente se houver erro ao renomear pasta
+        invalidate_patient(cpf, DETALHES)
         
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Paciente atualizado com sucesso!'}), 200
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao atualizar paciente.')
         return jsonify({'error': 'Erro ao atualizar paciente.'}), 500
 
 # Endpoint para deletar um paciente
-@app.route('/pacientes/<cpf>', methods=['DELETE'])
+@bp.route('/pacientes/<cpf>', methods=['DELETE'])
 def delete_paciente(cpf):
     try:
         conn = get_db_connection()
@@ -205,15 +400,75 @@ def delete_paciente(cpf):
         cursor.execute(query, (cpf,))
         conn.commit()
         cursor.close()
-        conn.close()
+        invalidate_patient(cpf)
         return jsonify({'message': 'Paciente deletado com sucesso!'}), 200
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao deletar paciente.')
         return jsonify({'error': 'Erro ao deletar paciente.'}), 500
     
 
 
-@app.route('/paciente/<cpf>', methods=['GET'])
+def patient_etag(cpf):
+    """
+    ETag forte das leituras do paciente, a partir de paciente_versao (incrementada
+    por triggers a cada escrita). None se o paciente não tiver versão.
+    """
+    cursor = get_db_connection().cursor()
+    cursor.execute("SELECT versao FROM paciente_versao WHERE id_paciente = %s", (cpf,))
+    row = cursor.fetchone()
+    cursor.close()
+    return f"v{row[0]}" if row else None
+
+def conditional_on_patient_version(view):
+    """
+    Responde 304 quando If-None-Match bate com a versão atual do paciente, sem executar
+    a rota. A versão é lida antes dos dados: se uma escrita acontecer no meio, o ETag
+    enviado fica mais antigo que os dados e o próximo GET apenas busca de novo.
+    """
+    @functools.wraps(view)
+    def wrapper(cpf, *args, **kwargs):
+        try:
+            etag = patient_etag(cpf.replace('.', '').replace('-', ''))
+        except Exception:
+            # Ex.: migration_add_paciente_versao.sql ainda não aplicada; segue sem ETag
+            logger.exception('Erro ao buscar versão do paciente.')
+            get_db_connection().rollback()
+            etag = None
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(cpf, *args, **kwargs))
+            if etag is None or response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Sempre revalida (com If-None-Match); nunca em caches compartilhados
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def format_patient(row):
+    return {
+        'cpf': row['cpf'],
+        'name': row['nome'],
+        'phone': row['telefone'],
+        'birthdate': row['data_nascimento'],
+        'address': row['endereco'],
+        'convenio': row['convenio'],
+    }
+
+def format_treatment(row):
+    return {
+        'tooth': 'boca_inteira' if row['numero_dente'] is None else row['numero_dente'],
+        'date': row['data'],
+        'note': row['anotacao'],
+        'epoch': row['epoch_criacao'],
+        'face': row.get('face_dente', 'Não se aplica')
+    }
+
+@bp.route('/paciente/<cpf>', methods=['GET'])
+@cached_patient_read(DETALHES)
+@conditional_on_patient_version
 def get_patient_details(cpf):
     try:
         conn = get_db_connection()
@@ -238,37 +493,52 @@ def get_patient_details(cpf):
         cursor.execute(treatments_query, (cpf,))
         treatments = cursor.fetchall() or []
         # Monta a resposta
-        patient_details = {
-            'cpf': patient['cpf'],
-            'name': patient['nome'],
-            'phone': patient['telefone'],
-            'birthdate': patient['data_nascimento'],
-            'address': patient['endereco'],
-            'convenio': patient['convenio'],
-            'treatments': [
-                {
-                    'tooth': 'boca_inteira' if row['numero_dente'] is None else row['numero_dente'],
-                    'date': row['data'],
-                    'note': row['anotacao'],
-                    'epoch': row['epoch_criacao'],
-                    'face': row.get('face_dente', 'Não se aplica')
-                }
-                for row in treatments
-            ]
-        }
+        patient_details = format_patient(patient)
+        patient_details['treatments'] = [format_treatment(row) for row in treatments]
 
 
+        cursor.close()
         return jsonify(patient_details), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao buscar detalhes do paciente.')
         return jsonify({'error': 'Erro ao buscar detalhes do paciente.'}), 500
-    finally:
-        # Garantir que recursos sejam fechados
-        cursor.close()
-        conn.close()
 
     
-@app.route('/paciente/<cpf>/anotacoes', methods=['POST'])
+# Endpoint com o estado atual do odontograma: a anotação mais recente de cada
+# (dente, face), com boca_inteira como mais um "dente". Anotações com várias faces
+# ("M, D") valem para cada uma delas. O DISTINCT ON roda no banco: o índice
+# idx_informacao_tratamentos_odontograma só filtra as linhas do paciente; como as
+# faces são expandidas pelo LATERAL, o Postgres ordena essas linhas expandidas por
+# inteiro. A ordenação fica pequena (só o histórico de um paciente) e a resposta
+# tem no máximo ~32 dentes x 5 faces.
+@bp.route('/paciente/<cpf>/odontograma', methods=['GET'])
+@conditional_on_patient_version
+def get_odontogram(cpf):
+    try:
+        cpf_clean = cpf.replace('.', '').replace('-', '')
+        cursor = get_db_connection().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute("SELECT 1 FROM paciente WHERE cpf = %s", (cpf_clean,))
+        if not cursor.fetchone():
+            cursor.close()
+            return jsonify({'error': 'Paciente não encontrado.'}), 404
+
+        cursor.execute(r"""
+            SELECT DISTINCT ON (t.numero_dente, f.face)
+                   t.numero_dente, f.face AS face_dente, t.data, t.anotacao, t.epoch_criacao
+            FROM informacao_tratamentos t
+            CROSS JOIN LATERAL regexp_split_to_table(
+                coalesce(nullif(btrim(t.face_dente), ''), 'Não se aplica'), '\s*,\s*') AS f(face)
+            WHERE t.id_paciente = %s
+            ORDER BY t.numero_dente, f.face, t.data DESC, t.epoch_criacao DESC
+        """, (cpf_clean,))
+        rows = cursor.fetchall()
+        cursor.close()
+        return jsonify([format_treatment(row) for row in rows]), 200
+    except Exception:
+        logger.exception('Erro ao buscar odontograma.')
+        return jsonify({'error': 'Erro ao buscar odontograma.'}), 500
+
+@bp.route('/paciente/<cpf>/anotacoes', methods=['POST'])
 def add_annotation(cpf):
     try:
         data = request.json
@@ -301,15 +571,125 @@ def add_annotation(cpf):
         """
         cursor.execute(insert_query, (cpf, epoch_criacao, numero_dente, data_tratamento, anotacao, face_dente))
         conn.commit()
-        conn.close()
+        invalidate_patient(cpf, DETALHES)
 
         return jsonify({'message': 'Anotação adicionada com sucesso.'}), 201
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao adicionar anotação.')
         return jsonify({'error': 'Erro ao adicionar anotação.'}), 500
+
+ANOTACOES_LOTE_MAX = 500
+
+def parse_batch_annotation(item, default_epoch):
+    """
+    Valida uma anotação do lote (mesmos campos de add_annotation). Retorna a tupla
+    (epoch, numero_dente, data, anotacao, face_dente) ou lança ValueError com o motivo.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Anotação inválida.')
+    numero_dente = item.get('tooth')
+    data_tratamento = item.get('date')
+    anotacao = item.get('note')
+    if not numero_dente or not data_tratamento or not anotacao:
+        raise ValueError('Campos obrigatórios não preenchidos.')
+
+    # "boca_inteira" vira NULL no banco
+    if numero_dente == 'boca_inteira':
+        numero_dente = None
+    else:
+        try:
+            numero_dente = int(numero_dente)
+        except (TypeError, ValueError):
+            raise ValueError('Número do dente inválido.')
+    try:
+        date.fromisoformat(str(data_tratamento)[:10])
+    except ValueError:
+        raise ValueError('Data inválida.')
+
+    # Várias faces chegam como lista (["M", "D"]) e são gravadas como "M, D"
+    face_dente = item.get('face') or 'Não se aplica'
+    if isinstance(face_dente, list):
+        face_dente = ', '.join(str(face) for face in face_dente) or 'Não se aplica'
+    if len(face_dente) > 50:
+        raise ValueError('Faces do dente com mais de 50 caracteres.')
+
+    epoch_criacao = item.get('epoch')
+    if epoch_criacao is None:
+        epoch_criacao = default_epoch
+    try:
+        epoch_criacao = int(epoch_criacao)
+    except (TypeError, ValueError):
+        raise ValueError('epoch inválido.')
+    return epoch_criacao, numero_dente, str(data_tratamento), anotacao, face_dente
+
+# Endpoint para adicionar várias anotações de uma vez: uma consulta de paciente, um
+# INSERT com todas as linhas e um commit. Anotações inválidas ou cujo epoch já existe
+# são informadas item a item, sem impedir a gravação das demais.
+@bp.route('/paciente/<cpf>/anotacoes/lote', methods=['POST'])
+def add_annotations_batch(cpf):
+    data = request.get_json(silent=True)
+    items = data.get('anotacoes') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Envie uma lista de anotações.'}), 400
+    if len(items) > ANOTACOES_LOTE_MAX:
+        return jsonify({'error': f'Máximo de {ANOTACOES_LOTE_MAX} anotações por lote.'}), 400
+
+    # Anotações sem epoch recebem um sequencial a partir do horário atual
+    base_epoch = int(time.time() * 1000)
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        try:
+            values = parse_batch_annotation(item, base_epoch + index)
+        except ValueError as e:
+            results.append({'index': index, 'epoch': None, 'status': 'invalid', 'error': str(e)})
+            continue
+        results.append({'index': index, 'epoch': values[0], 'status': None})
+        rows.append((cpf,) + values)
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT 1 FROM paciente WHERE cpf = %s", (cpf,))
+        if not cursor.fetchone():
+            cursor.close()
+            return jsonify({'error': 'Paciente não encontrado.'}), 404
+
+        inserted = set()
+        if rows:
+            returned = psycopg2.extras.execute_values(cursor, """
+                INSERT INTO informacao_tratamentos (id_paciente, epoch_criacao, numero_dente, data, anotacao, face_dente)
+                VALUES %s
+                ON CONFLICT (id_paciente, epoch_criacao) DO NOTHING
+                RETURNING epoch_criacao
+            """, rows, page_size=len(rows), fetch=True)
+            inserted = {row[0] for row in returned}
+        conn.commit()
+        cursor.close()
+    except Exception:
+        logger.exception('Erro ao adicionar anotações em lote.')
+        return jsonify({'error': 'Erro ao adicionar anotações em lote.'}), 500
+
+    # Com epochs repetidos no próprio lote, só a primeira ocorrência é gravada
+    for result in results:
+        if result['status'] is not None:
+            continue
+        if result['epoch'] in inserted:
+            result['status'] = 'inserted'
+            inserted.discard(result['epoch'])
+        else:
+            result['status'] = 'conflict'
+            result['error'] = 'Já existe uma anotação com este epoch.'
+
+    counts = {status: sum(1 for r in results if r['status'] == status)
+              for status in ('inserted', 'conflict', 'invalid')}
+    if counts['inserted']:
+        invalidate_patient(cpf, DETALHES)
+    return jsonify({**counts, 'results': results}), 201 if counts['inserted'] else 200
     
 
-@app.route('/paciente/<cpf>/anotacoes/<int:annotation_id>', methods=['PUT'])
+@bp.route('/paciente/<cpf>/anotacoes/<int:annotation_id>', methods=['PUT'])
 def update_annotation(cpf, annotation_id):
     data = request.json
     try:
@@ -335,15 +715,15 @@ def update_annotation(cpf, annotation_id):
         face_dente = data.get('face_dente', 'Não se aplica')
         cursor.execute(query, (data['data'], numero_dente, data['anotacao'], face_dente, cpf, annotation_id))
         conn.commit()
+        invalidate_patient(cpf, DETALHES)
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Anotação atualizada com sucesso!'}), 200
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao atualizar anotação.')
         return jsonify({'error': 'Erro ao atualizar anotação.'}), 500
 
 
-@app.route('/paciente/<cpf>/anotacoes/<int:annotation_id>', methods=['DELETE'])
+@bp.route('/paciente/<cpf>/anotacoes/<int:annotation_id>', methods=['DELETE'])
 def delete_annotation(cpf, annotation_id):
     try:
         conn = get_db_connection()
@@ -366,204 +746,580 @@ def delete_annotation(cpf, annotation_id):
         """
         cursor.execute(query_delete, (cpf, annotation_id))
         conn.commit()
+        invalidate_patient(cpf, DETALHES)
 
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Anotação deletada com sucesso!'}), 200
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('Erro ao deletar anotação.')
         return jsonify({'error': 'Erro ao deletar anotação.'}), 500
+
+BUSCA_ANOTACOES_MAX_LIMIT = 100
+
+# Endpoint de busca textual nas anotações de todos os pacientes, por relevância.
+# ?q= aceita a sintaxe de busca web ("canal -provisório", "coroa OR faceta", "frase exata").
+# Filtros opcionais: dente (número ou boca_inteira), face (M, D, V, O, P...), de/ate (AAAA-MM-DD).
+# Paginação por limit/offset; o trecho destacado só é gerado para as linhas da página.
+@bp.route('/anotacoes/busca', methods=['GET'])
+def search_annotations():
+    termo = (request.args.get('q') or '').strip()
+    if not termo:
+        return jsonify({'error': 'O parâmetro q é obrigatório.'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+        if limit < 1 or offset < 0:
+            raise ValueError
+        limit = min(limit, BUSCA_ANOTACOES_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos.'}), 400
+
+    filtros = []
+    params = {'q': termo, 'limit': limit + 1, 'offset': offset}
+    dente = request.args.get('dente')
+    if dente == 'boca_inteira':
+        filtros.append("t.numero_dente IS NULL")
+    elif dente:
+        if not dente.isdigit():
+            return jsonify({'error': 'Número do dente inválido.'}), 400
+        filtros.append("t.numero_dente = %(dente)s")
+        params['dente'] = int(dente)
+    face = request.args.get('face')
+    if face:
+        # Várias faces são gravadas como "M, D"
+        filtros.append("%(face)s = ANY(string_to_array(replace(t.face_dente, ' ', ''), ','))")
+        params['face'] = face.strip().upper()
+    try:
+        for name, op in (('de', '>='), ('ate', '<=')):
+            if request.args.get(name):
+                params[name] = date.fromisoformat(request.args[name])
+                filtros.append(f"t.data {op} %({name})s")
+    except ValueError:
+        return jsonify({'error': 'Datas inválidas. Use AAAA-MM-DD.'}), 400
+
+    query = f"""
+        WITH consulta AS (SELECT websearch_to_tsquery('pt_unaccent', %(q)s) AS q)
+        SELECT t.id_paciente,
+               -- Subconsulta pela chave primária, só para as linhas da página (um join
+               -- pode virar hash join sobre a tabela paciente inteira)
+               (SELECT nome FROM paciente WHERE cpf = t.id_paciente) AS nome,
+               t.numero_dente, t.face_dente, t.data, t.epoch_criacao,
+               t.anotacao, t.rank,
+               ts_headline('pt_unaccent', t.anotacao, c.q,
+                           'MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<b>, StopSel=</b>') AS trecho
+        FROM (
+            SELECT t.id_paciente, t.numero_dente, t.face_dente, t.data, t.epoch_criacao, t.anotacao,
+                   ts_rank_cd(t.anotacao_tsv, c.q) AS rank
+            FROM informacao_tratamentos t, consulta c
+            WHERE t.anotacao_tsv @@ c.q
+            {''.join(' AND ' + filtro for filtro in filtros)}
+            ORDER BY rank DESC, t.data DESC, t.id_paciente, t.epoch_criacao
+            LIMIT %(limit)s OFFSET %(offset)s
+        ) t
+        CROSS JOIN consulta c
+        ORDER BY t.rank DESC, t.data DESC, t.id_paciente, t.epoch_criacao
+    """
+    try:
+        cursor = get_db_connection().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    except Exception:
+        logger.exception('Erro na busca de anotações.')
+        return jsonify({'error': 'Erro na busca de anotações.'}), 500
+
+    return jsonify({
+        'resultados': [
+            {
+                'cpf': row['id_paciente'],
+                'nome': row['nome'],
+                **format_treatment(row),
+                'rank': round(row['rank'], 6),
+                'trecho': row['trecho'],
+            }
+            for row in rows[:limit]
+        ],
+        'next_offset': offset + limit if len(rows) > limit else None,
+    }), 200
     
 
 
-BASE_FOLDER = 'patient_images'
+def image_base_folder():
+    """Pasta base das imagens dos pacientes (IMAGE_BASE_FOLDER)."""
+    return current_app.config['IMAGE_BASE_FOLDER']
 
-# Garante que a pasta base exista
-if not os.path.exists(BASE_FOLDER):
-    os.makedirs(BASE_FOLDER)
+# Move em segundo plano as pastas do layout antigo para o layout por CPF. Começa na
+# primeira requisição (não em comandos de CLI); entre workers, um advisory lock
+# garante que só um migra.
+@bp.before_app_request
+def start_storage_migration():
+    app = current_app._get_current_object()
+    if 'storage_migration' in app.extensions or not app.config['IMAGE_STORAGE_MIGRATION']:
+        return
+    app.extensions['storage_migration'] = storage_migration.start_background(
+        app.config['DB_CONFIG'], app.config['IMAGE_BASE_FOLDER'])
 
-# Função auxiliar para obter o nome da pasta do paciente no formato "{nome} - {cpf}"
-def get_patient_folder_name(cpf):
+def decode_image_data(image_data):
+    # Remove o cabeçalho (data:image/png;base64,) se existir
+    if "," in image_data:
+        header, encoded = image_data.split(',', 1)
+    else:
+        encoded = image_data
+    return base64.b64decode(encoded)
+
+def lookup_image(cursor, cpf, timestamp_iso):
     """
-    Busca o nome do paciente no banco e retorna o nome da pasta no formato "{nome} - {cpf}".
-    Se o paciente não for encontrado, retorna apenas o CPF.
+    Localiza a imagem pela chave primária de `imagens`. Retorna (raw, caminho relativo)
+    ou None se o timestamp for inválido ou a imagem não estiver indexada.
     """
+    # O timestamp_iso vem no formato "2025-12-24T15-11-48.329Z" (ou com ":" no lugar dos "-")
+    raw = timestamp_iso.replace(":", "-")
     try:
-        conn = get_db_connection()
+        epoch = image_index.image_epoch_ms(raw)
+    except ValueError:
+        return None
+    cursor.execute(
+        "SELECT caminho_arquivo FROM imagens WHERE id_paciente = %s AND epoch_insercao = %s",
+        (cpf, epoch)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return os.path.basename(row[0])[:-len('.png')], row[0]
+
+def store_image(conn, cpf, raw, relative_path, write_content):
+    """
+    Grava o arquivo da imagem e a linha em `imagens` na mesma transação: o conteúdo
+    vai para um arquivo temporário e a linha é inserida/atualizada. O arquivo anterior
+    (se houver) é renomeado para o lado, o temporário vai para o lugar definitivo e a
+    transação é confirmada. Se algo falhar, o arquivo anterior volta ao lugar (ou o
+    novo é apagado); ele só é removido depois do commit.
+    `write_content(f)` escreve os bytes da imagem no arquivo aberto.
+    Por fim agenda a (re)geração da miniatura em segundo plano.
+    """
+    filepath = os.path.join(image_base_folder(), relative_path)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    suffix = uuid.uuid4().hex
+    tmp_path = f"{filepath}.{suffix}.tmp"
+    previous_path = f"{filepath}.{suffix}.anterior.tmp"
+    installed = False
+    try:
+        with open(tmp_path, "wb") as f:
+            write_content(f)
         cursor = conn.cursor()
-        query = "SELECT nome FROM paciente WHERE cpf = %s"
-        cursor.execute(query, (cpf,))
-        row = cursor.fetchone()
+        image_index.upsert_image(cursor, cpf, raw, relative_path, tmp_path)
         cursor.close()
-        conn.close()
-        
-        if row and row[0]:
-            nome = row[0].strip()
-            # Remove caracteres inválidos para nome de pasta (Windows/Linux)
-            nome_safe = nome.replace('/', '-').replace('\\', '-').replace(':', '-').replace('*', '-').replace('?', '-').replace('"', '-').replace('<', '-').replace('>', '-').replace('|', '-')
-            return f"{nome_safe} - {cpf}"
-        else:
-            return cpf
-    except Exception as e:
-        print(f"Erro ao buscar nome do paciente: {e}")
-        return cpf
+        try:
+            os.replace(filepath, previous_path)
+        except FileNotFoundError:
+            previous_path = None
+        os.replace(tmp_path, filepath)
+        installed = True
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if previous_path and os.path.exists(previous_path):
+            os.replace(previous_path, filepath)
+        elif installed:
+            os.remove(filepath)
+        raise
+    if previous_path:
+        os.remove(previous_path)
+    thumbnails.schedule(filepath)
+
+# Tamanho dos blocos copiados do corpo da requisição para o disco nos uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class InvalidImageUpload(ValueError):
+    pass
+
+def copy_image_stream(source, f):
+    """Copia o PNG de `source` para o arquivo `f` em blocos, sem carregá-lo inteiro na memória."""
+    first_chunk = True
+    while True:
+        chunk = source.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if first_chunk and not chunk.startswith(PNG_SIGNATURE):
+            raise InvalidImageUpload('O conteúdo enviado não é um PNG.')
+        first_chunk = False
+        f.write(chunk)
+    if first_chunk:
+        raise InvalidImageUpload('Imagem vazia.')
+
+def read_image_upload():
+    """
+    Interpreta um upload de imagem em qualquer um dos formatos aceitos:
+    - multipart/form-data: arquivo no campo `image` e demais campos no formulário;
+    - corpo image/png bruto: demais campos na query string;
+    - JSON com a imagem como data URL base64 (formato antigo, mantido por compatibilidade).
+    Retorna (campos, write_content), onde write_content(f) grava a imagem em `f`,
+    ou None se a imagem não foi enviada.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        write_content = (lambda f: copy_image_stream(upload.stream, f)) if upload else None
+        return request.form, write_content
+    if request.mimetype == 'image/png':
+        write_content = lambda f: copy_image_stream(request.stream, f)
+        return request.args, write_content
+    data = request.get_json(silent=True) or {}
+    image_data = data.get('image')
+    write_content = (lambda f: f.write(decode_image_data(image_data))) if image_data else None
+    return data, write_content
 
-@app.route('/save_image', methods=['POST'])
+@bp.route('/save_image', methods=['POST'])
 def save_image():
-    data = request.get_json()
+    data, write_content = read_image_upload()
     cpf = data.get('cpf')
-    image_data = data.get('image')
     # Caso não seja fornecido, usa o timestamp atual
-    timestamp = data.get('timestamp', datetime.utcnow().isoformat())
+    timestamp = data.get('timestamp') or datetime.utcnow().isoformat()
 
-    if not cpf or not image_data:
+    if not cpf or write_content is None:
         return jsonify({'error': 'cpf e image são obrigatórios'}), 400
 
-    # Obtém o nome da pasta no formato "{nome} - {cpf}"
-    folder_name = get_patient_folder_name(cpf)
-    
-    # Cria uma pasta para o paciente, se não existir
-    patient_folder = os.path.join(BASE_FOLDER, folder_name)
-    if not os.path.exists(patient_folder):
-        os.makedirs(patient_folder)
-        
-        # Se existir uma pasta antiga com apenas o CPF, migra as imagens
-        old_folder = os.path.join(BASE_FOLDER, cpf)
-        if os.path.exists(old_folder) and old_folder != patient_folder:
-            import shutil
-            try:
-                # Move todos os arquivos da pasta antiga para a nova
-                for filename in os.listdir(old_folder):
-                    old_file = os.path.join(old_folder, filename)
-                    new_file = os.path.join(patient_folder, filename)
-                    shutil.move(old_file, new_file)
-                # Remove a pasta antiga se estiver vazia
-                if not os.listdir(old_folder):
-                    os.rmdir(old_folder)
-                print(f"Migradas imagens de {old_folder} para {patient_folder}")
-            except Exception as e:
-                print(f"Erro ao migrar pasta antiga: {e}")
-
-    # Remove o cabeçalho (data:image/png;base64,) se existir
-    if "," in image_data:
-        header, encoded = image_data.split(',', 1)
-    else:
-        encoded = image_data
-
-    image_bytes = base64.b64decode(encoded)
-    
-    # Salva a imagem com o timestamp como nome de arquivo
     # Substitui os ":" por "-" para evitar problemas no nome do arquivo
     safe_timestamp = timestamp.replace(":", "-")
-    filename = f"{safe_timestamp}.png"
-    filepath = os.path.join(patient_folder, filename)
-    with open(filepath, "wb") as f:
-        f.write(image_bytes)
-    
-    # Aqui você pode inserir no banco de dados as informações da imagem, se necessário
-    # Exemplo: db.insert_image(cpf=cpf, filename=filename, timestamp=timestamp)
+    try:
+        image_index.image_epoch_ms(safe_timestamp)
+    except ValueError:
+        return jsonify({'error': 'timestamp inválido'}), 400
 
-    return jsonify({'message': 'Imagem salva com sucesso', 'filename': filename}), 200
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1 FROM paciente WHERE cpf = %s", (cpf,))
+            if not cursor.fetchone():
+                return jsonify({'error': 'Paciente não encontrado.'}), 404
+        finally:
+            cursor.close()
 
-@app.route('/update_image', methods=['PUT'])
+        # Salva a imagem com o timestamp como nome de arquivo, na pasta do paciente
+        filename = f"{safe_timestamp}.png"
+        relative_path = os.path.join(image_index.patient_dir(cpf), filename)
+        store_image(conn, cpf, safe_timestamp, relative_path, write_content)
+
+        return jsonify({'message': 'Imagem salva com sucesso', 'filename': filename}), 200
+    except InvalidImageUpload as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        logger.exception('Erro ao salvar imagem')
+        return jsonify({'error': 'Erro ao salvar imagem'}), 500
+
+@bp.route('/update_image', methods=['PUT'])
 def update_image():
-    data = request.get_json()
+    data, write_content = read_image_upload()
     cpf = data.get('cpf')
-    image_data = data.get('image')
     timestamp_iso = data.get('timestamp_iso')  # Timestamp da imagem original a ser atualizada
 
-    if not cpf or not image_data or not timestamp_iso:
+    if not cpf or write_content is None or not timestamp_iso:
         return jsonify({'error': 'cpf, image e timestamp_iso são obrigatórios'}), 400
 
     try:
-        # Obtém o nome da pasta no formato "{nome} - {cpf}"
-        folder_name = get_patient_folder_name(cpf)
-        patient_folder = os.path.join(BASE_FOLDER, folder_name)
-        
-        # Se a pasta nova não existir, tenta a pasta antiga (apenas CPF)
-        if not os.path.exists(patient_folder):
-            old_folder = os.path.join(BASE_FOLDER, cpf)
-            if os.path.exists(old_folder):
-                patient_folder = old_folder
-            else:
-                return jsonify({'error': 'Pasta do paciente não encontrada'}), 404
-
-        # Reconstrói o nome do arquivo a partir do timestamp_iso
-        safe_timestamp = timestamp_iso.replace(":", "-")
-        filename = f"{safe_timestamp}.png"
-        filepath = os.path.join(patient_folder, filename)
-
-        if not os.path.exists(filepath):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Impede que a migração de layout mova a imagem enquanto ela é regravada
+            image_index.lock_patient_images(cursor, cpf)
+            image = lookup_image(cursor, cpf, timestamp_iso)
+        finally:
+            cursor.close()
+        if image is None:
             return jsonify({'error': 'Imagem não encontrada'}), 404
+        raw, relative_path = image
 
-        # Remove o cabeçalho (data:image/png;base64,) se existir
-        if "," in image_data:
-            header, encoded = image_data.split(',', 1)
-        else:
-            encoded = image_data
-
-        image_bytes = base64.b64decode(encoded)
-        
         # Substitui o arquivo existente
-        with open(filepath, "wb") as f:
-            f.write(image_bytes)
+        store_image(conn, cpf, raw, relative_path, write_content)
 
-        return jsonify({'message': 'Imagem atualizada com sucesso', 'filename': filename}), 200
-    except Exception as e:
-        print(f"Erro ao atualizar imagem: {e}")
+        return jsonify({'message': 'Imagem atualizada com sucesso', 'filename': f"{raw}.png"}), 200
+    except InvalidImageUpload as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        logger.exception('Erro ao atualizar imagem')
         return jsonify({'error': 'Erro ao atualizar imagem'}), 500
 
-@app.route('/get_images', methods=['GET'])
+def format_image_timestamp(raw):
+    """
+    Converte o nome do arquivo (sem extensão), algo como "2025-02-28T16-26-29.545Z",
+    para o formato amigável "28/02/2025 16:26:29". Em caso de erro, retorna o valor bruto.
+    """
+    try:
+        return image_index.parse_image_timestamp(raw).strftime("%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return raw
+
+@bp.route('/get_images', methods=['GET'])
 def get_images():
     cpf = request.args.get('cpf')
     if not cpf:
         return jsonify({'error': 'cpf é obrigatório'}), 400
 
-    # Obtém o nome da pasta no formato "{nome} - {cpf}"
-    folder_name = get_patient_folder_name(cpf)
-    patient_folder = os.path.join(BASE_FOLDER, folder_name)
-    
-    # Se a pasta nova não existir, tenta a pasta antiga (apenas CPF)
-    if not os.path.exists(patient_folder):
-        old_folder = os.path.join(BASE_FOLDER, cpf)
-        if os.path.exists(old_folder):
-            patient_folder = old_folder
-    
+    # Modo manifesto: só metadados, paginado (ver get_image_manifest)
+    if request.args.get('manifest') in ('1', 'true'):
+        return get_image_manifest(cpf)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT caminho_arquivo
+        FROM imagens
+        WHERE id_paciente = %s
+        ORDER BY epoch_insercao DESC
+    """, (cpf,))
+    rows = cursor.fetchall()
+    cursor.close()
+
     images = []
-    if os.path.exists(patient_folder):
-        for filename in os.listdir(patient_folder):
-            filepath = os.path.join(patient_folder, filename)
+    for (relative_path,) in rows:
+        filepath = os.path.join(image_base_folder(), relative_path)
+        try:
             with open(filepath, "rb") as f:
                 image_bytes = f.read()
-                encoded = base64.b64encode(image_bytes).decode('utf-8')
-                data_url = f"data:image/png;base64,{encoded}"
-                
-                # Processa o nome do arquivo para extrair o timestamp e formatá-lo de forma amigável
-                # O nome esperado é algo como "2025-02-28T16-26-29.545Z.png"
-                raw = filename.replace(".png", "")
-                try:
-                    # Separa a parte da data e do tempo
-                    date_part, time_part = raw.split("T")
-                    # Substitui somente os dois primeiros hífens da parte do tempo por dois pontos
-                    time_part_fixed = time_part.replace("-", ":", 2)
-                    iso_timestamp = f"{date_part}T{time_part_fixed}"
-                    # Ajusta para um formato ISO compatível com datetime.fromisoformat (substituindo 'Z' por '+00:00')
-                    iso_timestamp_fixed = iso_timestamp.replace("Z", "+00:00")
-                    dt = datetime.fromisoformat(iso_timestamp_fixed)
-                    # Formata a data de forma amigável
-                    friendly_timestamp = dt.strftime("%d/%m/%Y %H:%M:%S")
-                except Exception as e:
-                    # Em caso de erro, retorna o valor bruto
-                    friendly_timestamp = raw
-
-                images.append({
-                    'image': data_url,
-                    'timestamp': friendly_timestamp,
-                    'timestamp_iso': raw  # Timestamp original para ordenação
-                })
+        except FileNotFoundError:
+            # Índice desatualizado; o comando reconcile-images corrige
+            continue
+        encoded = base64.b64encode(image_bytes).decode('utf-8')
+        raw = os.path.basename(relative_path)[:-len('.png')]
+        images.append({
+            'image': f"data:image/png;base64,{encoded}",
+            'timestamp': format_image_timestamp(raw),
+            'timestamp_iso': raw  # Timestamp original para ordenação
+        })
     return jsonify({'images': images}), 200
 
-@app.route('/delete_image', methods=['DELETE'])
+def send_image_file(filepath):
+    """
+    Envia um PNG do disco com ETag forte (mtime em ns + tamanho), Last-Modified,
+    suporte a Range e respostas 304 para If-None-Match/If-Modified-Since.
+    """
+    max_age = current_app.config['IMAGE_CACHE_MAX_AGE']
+    stat = os.stat(filepath)
+    response = send_file(
+        os.path.abspath(filepath),
+        mimetype='image/png',
+        conditional=True,
+        etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+        last_modified=stat.st_mtime,
+        max_age=max_age,
+    )
+    # Imagens de pacientes nunca devem ficar em caches compartilhados
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if max_age == 0:
+        response.cache_control.no_cache = True
+    return response
+
+# Endpoint para servir uma imagem em binário (sem base64), com cache HTTP
+@bp.route('/paciente/<cpf>/imagens/<timestamp_iso>', methods=['GET'])
+def get_image_file(cpf, timestamp_iso):
+    cursor = get_db_connection().cursor()
+    image = lookup_image(cursor, cpf, timestamp_iso)
+    cursor.close()
+    if image is None:
+        return jsonify({'error': 'Imagem não encontrada'}), 404
+
+    filepath = safe_join(image_base_folder(), image[1])
+    if filepath is None or not os.path.isfile(filepath):
+        return jsonify({'error': 'Imagem não encontrada'}), 404
+
+    return send_image_file(filepath)
+
+# Endpoint para a miniatura de uma imagem. Enquanto a miniatura não existir
+# (geração em andamento ou Pillow ausente) devolve a imagem original.
+@bp.route('/paciente/<cpf>/imagens/<timestamp_iso>/thumb', methods=['GET'])
+def get_image_thumbnail(cpf, timestamp_iso):
+    cursor = get_db_connection().cursor()
+    image = lookup_image(cursor, cpf, timestamp_iso)
+    cursor.close()
+    if image is None:
+        return jsonify({'error': 'Imagem não encontrada'}), 404
+
+    filepath = safe_join(image_base_folder(), image[1])
+    if filepath is None or not os.path.isfile(filepath):
+        return jsonify({'error': 'Imagem não encontrada'}), 404
+
+    thumb_path = thumbnails.thumbnail_path(filepath)
+    if os.path.isfile(thumb_path):
+        return send_image_file(thumb_path)
+    thumbnails.schedule(filepath)
+    return send_image_file(filepath)
+
+IMAGE_MANIFEST_MAX_LIMIT = 200
+
+# Endpoint com o manifesto das imagens do paciente: apenas metadados, da mais recente
+# para a mais antiga, paginado pelo timestamp. Os bytes são buscados por imagem em
+# /paciente/<cpf>/imagens/<timestamp_iso>, conforme o frontend precisar.
+@bp.route('/paciente/<cpf>/imagens', methods=['GET'])
+def get_image_manifest(cpf):
+    try:
+        limit = int(request.args.get('limit', 50))
+        if limit < 1:
+            raise ValueError
+        limit = min(limit, IMAGE_MANIFEST_MAX_LIMIT)
+        # Cursor: timestamp_iso da última imagem da página anterior
+        before = request.args.get('cursor')
+        before_epoch = image_index.image_epoch_ms(before.replace(":", "-")) if before else None
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos.'}), 400
+
+    query = """
+        SELECT epoch_insercao, caminho_arquivo, tamanho_bytes, largura, altura
+        FROM imagens
+        WHERE id_paciente = %s
+    """
+    params = [cpf]
+    if before_epoch is not None:
+        query += " AND epoch_insercao < %s"
+        params.append(before_epoch)
+    query += " ORDER BY epoch_insercao DESC LIMIT %s"
+    params.append(limit + 1)
+
+    cursor = get_db_connection().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    return jsonify(format_image_manifest(cpf, rows, limit)), 200
+
+def format_image_manifest(cpf, rows, limit):
+    """Página do manifesto a partir de até `limit + 1` linhas de `imagens`."""
+    images = []
+    for row in rows[:limit]:
+        raw = os.path.basename(row['caminho_arquivo'])[:-len('.png')]
+        images.append({
+            'timestamp_iso': raw,
+            'timestamp': format_image_timestamp(raw),
+            'size': row['tamanho_bytes'],
+            'width': row['largura'],
+            'height': row['altura'],
+            'url': url_for('.get_image_file', cpf=cpf, timestamp_iso=raw),
+            'thumbnail_url': url_for('.get_image_thumbnail', cpf=cpf, timestamp_iso=raw),
+        })
+    next_cursor = images[-1]['timestamp_iso'] if len(rows) > limit else None
+    return {'images': images, 'next_cursor': next_cursor}
+
+async def fetch_patient_summary(pool, cpf, image_limit):
+    """
+    Consultas do resumo do paciente, todas ao mesmo tempo (uma conexão cada):
+    a latência é a da mais lenta, não a soma.
+    """
+    return await asyncio.gather(
+        async_db.fetch(pool, """
+            SELECT cpf, nome, telefone, data_nascimento, endereco, convenio
+            FROM paciente WHERE cpf = $1
+        """, cpf),
+        async_db.fetch(pool, """
+            SELECT numero_dente, data, anotacao, epoch_criacao, face_dente
+            FROM informacao_tratamentos
+            WHERE id_paciente = $1
+            ORDER BY data DESC
+        """, cpf),
+        async_db.fetch(pool, """
+            SELECT o.id, o.data_orcamento,
+                   COALESCE(r.total_itens, 0) AS total, COALESCE(r.quantidade_itens, 0) AS quantidade_itens,
+                   COALESCE(r.total_pago, 0) AS pago
+            FROM orcamentos o
+            LEFT JOIN orcamento_resumo r ON r.id_orcamento = o.id
+            WHERE o.id_paciente = $1
+            ORDER BY o.data_orcamento DESC, o.id DESC
+        """, cpf),
+        async_db.fetch(pool, """
+            SELECT epoch_insercao, caminho_arquivo, tamanho_bytes, largura, altura
+            FROM imagens
+            WHERE id_paciente = $1
+            ORDER BY epoch_insercao DESC LIMIT $2
+        """, cpf, image_limit + 1),
+    )
+
+# Endpoint com tudo que a página do paciente precisa em uma única requisição:
+# dados, anotações, resumo dos orçamentos e a primeira página do manifesto de imagens
+@bp.route('/paciente/<cpf>/resumo', methods=['GET'])
+def get_patient_summary(cpf):
+    try:
+        image_limit = int(request.args.get('images_limit', 50))
+        if image_limit < 1:
+            raise ValueError
+        image_limit = min(image_limit, IMAGE_MANIFEST_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos.'}), 400
+    if not async_db.available():
+        return jsonify({'error': 'asyncpg não está instalado.'}), 503
+
+    try:
+        cpf_clean = cpf.replace('.', '').replace('-', '')
+        patient, treatments, orcamentos, images = async_db.get_async_db(current_app).run(
+            fetch_patient_summary, cpf_clean, image_limit)
+        if not patient:
+            return jsonify({'error': 'Paciente não encontrado.'}), 404
+
+        return jsonify({
+            'paciente': format_patient(patient[0]),
+            'treatments': [format_treatment(row) for row in treatments],
+            'orcamentos': [
+                {
+                    'id': row['id'],
+                    'data_orcamento': str(row['data_orcamento']),
+                    'quantidade_itens': row['quantidade_itens'],
+                    'total': float(row['total']),
+                    'pago': float(row['pago']),
+                    'saldo': float(row['total'] - row['pago']),
+                }
+                for row in orcamentos
+            ],
+            'images': format_image_manifest(cpf_clean, images, image_limit),
+        }), 200
+    except Exception:
+        logger.exception('Erro ao buscar resumo do paciente.')
+        return jsonify({'error': 'Erro ao buscar resumo do paciente.'}), 500
+
+# Endpoint que exporta o prontuário completo do paciente em um ZIP gerado em streaming:
+# dados, anotações, orçamentos com itens e pagamentos e todas as imagens do disco.
+# As consultas terminam antes da resposta começar; o corpo só lê os arquivos.
+@bp.route('/paciente/<cpf>/export', methods=['GET'])
+def export_patient_record(cpf):
+    try:
+        cpf_clean = cpf.replace('.', '').replace('-', '')
+        cursor = get_db_connection().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute("SELECT * FROM paciente WHERE cpf = %s", (cpf_clean,))
+        patient = cursor.fetchone()
+        if not patient:
+            cursor.close()
+            return jsonify({'error': 'Paciente não encontrado.'}), 404
+
+        cursor.execute("""
+            SELECT numero_dente, data, anotacao, epoch_criacao, face_dente
+            FROM informacao_tratamentos
+            WHERE id_paciente = %s
+            ORDER BY data DESC
+        """, (cpf_clean,))
+        treatments = cursor.fetchall()
+        orcamentos = fetch_orcamentos(cursor, cpf_clean)
+        cursor.execute("""
+            SELECT caminho_arquivo
+            FROM imagens
+            WHERE id_paciente = %s
+            ORDER BY epoch_insercao
+        """, (cpf_clean,))
+        images = [
+            (os.path.basename(row['caminho_arquivo'])[:-len('.png')], row['caminho_arquivo'])
+            for row in cursor.fetchall()
+        ]
+        cursor.close()
+    except Exception:
+        logger.exception('Erro ao exportar prontuário do paciente.')
+        return jsonify({'error': 'Erro ao exportar prontuário do paciente.'}), 500
+
+    stream = record_export.generate_zip(dict(patient), treatments, orcamentos, images, image_base_folder())
+    return Response(stream, mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="paciente_{cpf_clean}.zip"',
+        'Cache-Control': 'private, no-store',
+    })
+
+@bp.route('/delete_image', methods=['DELETE'])
 def delete_image():
     cpf = request.args.get('cpf')
     timestamp_iso = request.args.get('timestamp_iso')
@@ -572,47 +1328,216 @@ def delete_image():
         return jsonify({'error': 'cpf e timestamp_iso são obrigatórios'}), 400
     
     try:
-        # Obtém o nome da pasta no formato "{nome} - {cpf}"
-        folder_name = get_patient_folder_name(cpf)
-        patient_folder = os.path.join(BASE_FOLDER, folder_name)
-        
-        # Se a pasta nova não existir, tenta a pasta antiga (apenas CPF)
-        if not os.path.exists(patient_folder):
-            old_folder = os.path.join(BASE_FOLDER, cpf)
-            if os.path.exists(old_folder):
-                patient_folder = old_folder
-            else:
-                return jsonify({'error': 'Pasta do paciente não encontrada'}), 404
-        
-        # Reconstrói o nome do arquivo a partir do timestamp_iso
-        # O timestamp_iso vem no formato "2025-12-24T15-11-48.329Z"
-        # Precisamos garantir que está no formato correto para o nome do arquivo
-        safe_timestamp = timestamp_iso.replace(":", "-")
-        filename = f"{safe_timestamp}.png"
-        filepath = os.path.join(patient_folder, filename)
-        
-        if not os.path.exists(filepath):
-            return jsonify({'error': 'Imagem não encontrada'}), 404
-        
-        # Deleta o arquivo
-        os.remove(filepath)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            image_index.lock_patient_images(cursor, cpf)
+            image = lookup_image(cursor, cpf, timestamp_iso)
+            if image is None:
+                return jsonify({'error': 'Imagem não encontrada'}), 404
+            raw, relative_path = image
+            cursor.execute(
+                "DELETE FROM imagens WHERE id_paciente = %s AND epoch_insercao = %s",
+                (cpf, image_index.image_epoch_ms(raw))
+            )
+        finally:
+            cursor.close()
+
+        # O arquivo é renomeado antes do commit e volta ao lugar se o commit falhar;
+        # só é apagado depois que a linha deixou de existir
+        filepath = os.path.join(image_base_folder(), relative_path)
+        removed_path = f"{filepath}.excluida.tmp"
+        try:
+            os.replace(filepath, removed_path)
+        except FileNotFoundError:
+            removed_path = None
+        try:
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if removed_path:
+                os.replace(removed_path, filepath)
+            raise
+        if removed_path:
+            os.remove(removed_path)
+        thumbnails.remove(filepath)
         
         return jsonify({'message': 'Imagem deletada com sucesso'}), 200
-    except Exception as e:
-        print(f"Erro ao deletar imagem: {e}")
+    except Exception:
+        logger.exception('Erro ao deletar imagem')
         return jsonify({'error': 'Erro ao deletar imagem'}), 500
 
 
+@bp.cli.command('reconcile-images')
+@click.option('--dry-run', is_flag=True, help='Apenas mostra o que seria alterado.')
+def reconcile_images_command(dry_run):
+    """Reconstrói/corrige a tabela imagens a partir dos arquivos da pasta de imagens."""
+    with db.get_pool().connection() as conn:
+        stats = image_index.reconcile(conn, image_base_folder(), dry_run=dry_run)
+    click.echo(
+        f"Inseridas: {stats['inserted']}  Atualizadas: {stats['updated']}  "
+        f"Removidas: {stats['removed']}  Pacientes inexistentes: {stats['orphans']}  "
+        f"Ignoradas: {stats['skipped']}" + ("  (dry-run)" if dry_run else "")
+    )
+
+@bp.cli.command('generate-thumbnails')
+@click.option('--force', is_flag=True, help='Regenera também as miniaturas que já existem.')
+@click.option('--workers', type=int, default=None, help='Threads usadas na geração.')
+def generate_thumbnails_command(force, workers):
+    """Gera as miniaturas das imagens já existentes na pasta de imagens."""
+    if not thumbnails.available():
+        raise click.ClickException('Pillow não está instalado (pip install -r requirements.txt).')
+    generated, failed = thumbnails.generate_all(image_base_folder(), force=force, workers=workers)
+    click.echo(f"Miniaturas geradas: {generated}  Com erro: {failed}")
+
+@bp.cli.command('migrate-image-storage')
+def migrate_image_storage_command():
+    """Move as pastas "{nome} - {cpf}" e "{cpf}" para o layout por CPF."""
+    result = storage_migration.run_exclusive(current_app.config['DB_CONFIG'], image_base_folder())
+    if result is None:
+        raise click.ClickException('Outra migração está em andamento.')
+    click.echo(f"Pastas migradas: {result[0]}  Arquivos: {result[1]}")
+
+@bp.cli.command('import-patients')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(patient_import.FORMATS), default=None,
+              help='Formato do arquivo (padrão: pela extensão, csv se não for .ndjson).')
+@click.option('--on-conflict', type=click.Choice(patient_import.ON_CONFLICT), default='update',
+              help='O que fazer com CPFs já cadastrados.')
+@click.option('--dry-run', is_flag=True, help='Apenas valida, sem gravar.')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Grava as linhas com erro neste CSV.')
+def import_patients_command(path, import_format, on_conflict, dry_run, report):
+    """Importa pacientes em lote de um arquivo CSV ou NDJSON."""
+    import_format = import_format or ('ndjson' if path.endswith('.ndjson') else 'csv')
+    started = time.perf_counter()
+    with open(path, encoding='utf-8-sig', newline='') as f, db.get_pool().connection() as conn:
+        try:
+            result = patient_import.import_patients(conn, f, import_format, on_conflict, dry_run)
+        except (patient_import.ImportFormatError, UnicodeDecodeError) as e:
+            raise click.ClickException(str(e))
+    if not dry_run and (result['inserted'] or result['updated']):
+        invalidate_all()
+    if report:
+        with open(report, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['linha', 'cpf', 'erro'])
+            writer.writerows((e['linha'], e['cpf'], e['erro']) for e in result['errors'])
+    for error in result['errors'][:20]:
+        click.echo(f"  linha {error['linha']}: {error['erro']} ({error['cpf']})")
+    if len(result['errors']) > 20:
+        click.echo(f"  ... mais {len(result['errors']) - 20} erros" + ("" if report else " (use --report)"))
+    click.echo(
+        f"Linhas: {result['total']}  Inseridos: {result['inserted']}  Atualizados: {result['updated']}  "
+        f"Ignorados: {result['skipped']}  Com erro: {result['invalid']}  "
+        f"Tempo: {time.perf_counter() - started:.1f}s" + ("  (dry-run)" if dry_run else "")
+    )
+
+@bp.cli.command('check-budget-summary')
+@click.option('--fix', is_flag=True, help='Regrava os resumos divergentes.')
+def check_budget_summary_command(fix):
+    """Confere a tabela orcamento_resumo contra os itens e pagamentos."""
+    with db.get_pool().connection() as conn:
+        divergences = budget_summary.check(conn, fix=fix)
+    for row in divergences[:20]:
+        if row['ausente']:
+            click.echo(f"  orçamento {row['id_orcamento']}: sem resumo")
+            continue
+        diffs = ', '.join(
+            f"{column} {row[column]} (esperado {row['esperado_' + column]})"
+            for column in budget_summary.COLUMNS
+            if row[column] != row['esperado_' + column]
+        )
+        click.echo(f"  orçamento {row['id_orcamento']}: {diffs}")
+    if len(divergences) > 20:
+        click.echo(f"  ... mais {len(divergences) - 20} orçamentos")
+    if fix and divergences:
+        invalidate_all()
+    click.echo(f"Orçamentos divergentes: {len(divergences)}" + ("  (corrigidos)" if fix and divergences else ""))
+    if divergences and not fix:
+        raise SystemExit(1)
+
+
 # ========== ROTAS DE ORÇAMENTOS E PAGAMENTOS ==========
 
+def fetch_orcamentos(cursor, cpf):
+    """
+    Busca os orçamentos do paciente com seus itens e pagamentos.
+    Usa sempre três consultas (orçamentos, itens e pagamentos em lote com ANY),
+    qualquer que seja a quantidade de orçamentos. Os totais vêm de orcamento_resumo.
+    `cursor` deve ser um RealDictCursor.
+    """
+    orcamentos_query = """
+        SELECT o.id, o.data_orcamento,
+               COALESCE(r.total_itens, 0) AS total, COALESCE(r.total_pago, 0) AS pago
+        FROM orcamentos o
+        LEFT JOIN orcamento_resumo r ON r.id_orcamento = o.id
+        WHERE o.id_paciente = %s
+        ORDER BY o.data_orcamento DESC, o.id DESC
+    """
+    cursor.execute(orcamentos_query, (cpf,))
+    orcamentos = cursor.fetchall() or []
+    if not orcamentos:
+        return []
+
+    orcamento_ids = [orcamento['id'] for orcamento in orcamentos]
+
+    # Busca os itens de todos os orçamentos de uma vez
+    itens_query = """
+        SELECT id_orcamento, id, data_item, preco, descricao
+        FROM orcamento_itens
+        WHERE id_orcamento = ANY(%s)
+        ORDER BY id_orcamento, id ASC
+    """
+    cursor.execute(itens_query, (orcamento_ids,))
+    itens_por_orcamento = defaultdict(list)
+    for item in cursor.fetchall():
+        itens_por_orcamento[item['id_orcamento']].append(item)
+
+    # Busca os pagamentos de todos os orçamentos de uma vez
+    pagamentos_query = """
+        SELECT id_orcamento, id, data_pagamento, valor_parcela, meio_pagamento
+        FROM pagamentos
+        WHERE id_orcamento = ANY(%s)
+        ORDER BY id_orcamento, data_pagamento DESC
+    """
+    cursor.execute(pagamentos_query, (orcamento_ids,))
+    pagamentos_por_orcamento = defaultdict(list)
+    for pagamento in cursor.fetchall():
+        pagamento = dict(pagamento)
+        pagamentos_por_orcamento[pagamento.pop('id_orcamento')].append(pagamento)
+
+    resultado = []
+    for orcamento in orcamentos:
+        itens = itens_por_orcamento[orcamento['id']]
+        resultado.append({
+            'id': orcamento['id'],
+            'data_orcamento': str(orcamento['data_orcamento']),
+            'itens': [
+                {
+                    'id': item['id'],
+                    'data_item': str(item['data_item']),
+                    'preco': float(item['preco']),
+                    'descricao': item['descricao'] or ''
+                }
+                for item in itens
+            ],
+            'total': float(orcamento['total']),
+            'pago': float(orcamento['pago']),
+            'saldo': float(orcamento['total'] - orcamento['pago']),
+            'pagamentos': pagamentos_por_orcamento[orcamento['id']]
+        })
+    return resultado
+
 # Endpoint para buscar todos os orçamentos de um paciente com seus itens e pagamentos
-@app.route('/paciente/<cpf>/orcamentos', methods=['GET'])
+@bp.route('/paciente/<cpf>/orcamentos', methods=['GET'])
+@cached_patient_read(ORCAMENTOS)
+@conditional_on_patient_version
 def get_orcamentos(cpf):
     try:
-        print(f"[DEBUG] GET /paciente/{cpf}/orcamentos - Requisição recebida de {request.remote_addr}")
         # Remove formatação do CPF (pontos e traços)
         cpf_clean = cpf.replace('.', '').replace('-', '')
-        print(f"[DEBUG] CPF limpo: {cpf_clean}")
+        logger.debug('CPF limpo: %s', cpf_clean)
         
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -622,76 +1547,19 @@ def get_orcamentos(cpf):
         cursor.execute(patient_query, (cpf_clean,))
         if not cursor.fetchone():
             cursor.close()
-            conn.close()
             return jsonify({'error': 'Paciente não encontrado.'}), 404
         
-        # Busca todos os orçamentos
-        orcamentos_query = """
-            SELECT id, data_orcamento
-            FROM orcamentos
-            WHERE id_paciente = %s
-            ORDER BY data_orcamento DESC, id DESC
-        """
-        cursor.execute(orcamentos_query, (cpf_clean,))
-        orcamentos = cursor.fetchall() or []
-        
-        # Para cada orçamento, busca os itens e pagamentos
-        resultado = []
-        for orcamento in orcamentos:
-            # Busca os itens do orçamento
-            itens_query = """
-                SELECT id, data_item, preco, descricao
-                FROM orcamento_itens
-                WHERE id_orcamento = %s
-                ORDER BY id ASC
-            """
-            cursor.execute(itens_query, (orcamento['id'],))
-            itens = cursor.fetchall() or []
-            
-            # Calcula o total dos itens
-            total_orcamento = sum(float(item['preco']) for item in itens)
-            
-            # Busca os pagamentos
-            pagamentos_query = """
-                SELECT id, data_pagamento, valor_parcela, meio_pagamento
-                FROM pagamentos
-                WHERE id_orcamento = %s
-                ORDER BY data_pagamento DESC
-            """
-            cursor.execute(pagamentos_query, (orcamento['id'],))
-            pagamentos = cursor.fetchall() or []
-            
-            # Converte itens para dicionários com campos formatados
-            itens_formatados = []
-            for item in itens:
-                itens_formatados.append({
-                    'id': item['id'],
-                    'data_item': str(item['data_item']),
-                    'preco': float(item['preco']),
-                    'descricao': item['descricao'] or ''
-                })
-            
-            resultado.append({
-                'id': orcamento['id'],
-                'data_orcamento': str(orcamento['data_orcamento']),
-                'itens': itens_formatados,
-                'total': float(total_orcamento),
-                'pagamentos': [dict(p) for p in pagamentos]
-            })
-        
+        resultado = fetch_orcamentos(cursor, cpf_clean)
         cursor.close()
-        conn.close()
         
-        print(f"[DEBUG] Retornando {len(resultado)} orçamentos")
+        logger.debug('Retornando %d orçamentos', len(resultado))
         return jsonify(resultado), 200
-    except Exception as e:
-        print(f"[ERROR] Erro ao buscar orçamentos: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception('Erro ao buscar orçamentos.')
         return jsonify({'error': 'Erro ao buscar orçamentos.'}), 500
 
 # Endpoint para adicionar um orçamento
-@app.route('/paciente/<cpf>/orcamentos', methods=['POST'])
+@bp.route('/paciente/<cpf>/orcamentos', methods=['POST'])
 def add_orcamento(cpf):
     try:
         # Remove formatação do CPF (pontos e traços)
@@ -734,7 +1602,6 @@ def add_orcamento(cpf):
             if not item_preco:
                 conn.rollback()
                 cursor.close()
-                conn.close()
                 return jsonify({'error': 'Todos os itens devem ter um preço.'}), 400
             
             insert_item_query = """
@@ -745,15 +1612,15 @@ def add_orcamento(cpf):
         
         conn.commit()
         cursor.close()
-        conn.close()
+        invalidate_patient(cpf_clean, ORCAMENTOS, DESCRICOES)
         
         return jsonify({'message': 'Orçamento adicionado com sucesso.', 'id': orcamento_id}), 201
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao adicionar orçamento.')
         return jsonify({'error': 'Erro ao adicionar orçamento.'}), 500
 
 # Endpoint para atualizar um orçamento
-@app.route('/paciente/<cpf>/orcamentos/<int:orcamento_id>', methods=['PUT'])
+@bp.route('/paciente/<cpf>/orcamentos/<int:orcamento_id>', methods=['PUT'])
 def update_orcamento(cpf, orcamento_id):
     try:
         # Remove formatação do CPF (pontos e traços)
@@ -784,15 +1651,15 @@ def update_orcamento(cpf, orcamento_id):
         
         conn.commit()
         cursor.close()
-        conn.close()
+        invalidate_patient(cpf_clean, ORCAMENTOS)
         
         return jsonify({'message': 'Orçamento atualizado com sucesso.'}), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao atualizar orçamento.')
         return jsonify({'error': 'Erro ao atualizar orçamento.'}), 500
 
 # Endpoint para deletar um orçamento
-@app.route('/paciente/<cpf>/orcamentos/<int:orcamento_id>', methods=['DELETE'])
+@bp.route('/paciente/<cpf>/orcamentos/<int:orcamento_id>', methods=['DELETE'])
 def delete_orcamento(cpf, orcamento_id):
     try:
         # Remove formatação do CPF (pontos e traços)
@@ -812,15 +1679,15 @@ def delete_orcamento(cpf, orcamento_id):
         
         conn.commit()
         cursor.close()
-        conn.close()
+        invalidate_patient(cpf_clean, ORCAMENTOS, DESCRICOES)
         
         return jsonify({'message': 'Orçamento deletado com sucesso.'}), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao deletar orçamento.')
         return jsonify({'error': 'Erro ao deletar orçamento.'}), 500
 
 # Endpoint para adicionar um pagamento a um orçamento
-@app.route('/orcamentos/<int:orcamento_id>/pagamentos', methods=['POST'])
+@bp.route('/orcamentos/<int:orcamento_id>/pagamentos', methods=['POST'])
 def add_pagamento(orcamento_id):
     try:
         data = request.json
@@ -835,9 +1702,10 @@ def add_pagamento(orcamento_id):
         cursor = conn.cursor()
         
         # Verifica se o orçamento existe
-        check_query = "SELECT 1 FROM orcamentos WHERE id = %s"
+        check_query = "SELECT id_paciente FROM orcamentos WHERE id = %s"
         cursor.execute(check_query, (orcamento_id,))
-        if not cursor.fetchone():
+        orcamento = cursor.fetchone()
+        if not orcamento:
             return jsonify({'error': 'Orçamento não encontrado.'}), 404
         
         # Insere o pagamento
@@ -847,17 +1715,17 @@ def add_pagamento(orcamento_id):
         """
         cursor.execute(insert_query, (orcamento_id, data_pagamento, valor_parcela, meio_pagamento))
         conn.commit()
+        invalidate_patient(orcamento[0], ORCAMENTOS)
         
         cursor.close()
-        conn.close()
         
         return jsonify({'message': 'Pagamento adicionado com sucesso.'}), 201
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao adicionar pagamento.')
         return jsonify({'error': 'Erro ao adicionar pagamento.'}), 500
 
 # Endpoint para atualizar um pagamento
-@app.route('/orcamentos/<int:orcamento_id>/pagamentos/<int:pagamento_id>', methods=['PUT'])
+@bp.route('/orcamentos/<int:orcamento_id>/pagamentos/<int:pagamento_id>', methods=['PUT'])
 def update_pagamento(orcamento_id, pagamento_id):
     try:
         data = request.json
@@ -875,6 +1743,7 @@ def update_pagamento(orcamento_id, pagamento_id):
             UPDATE pagamentos
             SET data_pagamento = %s, valor_parcela = %s, meio_pagamento = %s
             WHERE id = %s AND id_orcamento = %s
+            RETURNING (SELECT id_paciente FROM orcamentos WHERE id = id_orcamento)
         """
         cursor.execute(query, (data_pagamento, valor_parcela, meio_pagamento, pagamento_id, orcamento_id))
         
@@ -882,16 +1751,16 @@ def update_pagamento(orcamento_id, pagamento_id):
             return jsonify({'error': 'Pagamento não encontrado.'}), 404
         
         conn.commit()
+        invalidate_patient(cursor.fetchone()[0], ORCAMENTOS)
         cursor.close()
-        conn.close()
         
         return jsonify({'message': 'Pagamento atualizado com sucesso.'}), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao atualizar pagamento.')
         return jsonify({'error': 'Erro ao atualizar pagamento.'}), 500
 
 # Endpoint para deletar um pagamento
-@app.route('/orcamentos/<int:orcamento_id>/pagamentos/<int:pagamento_id>', methods=['DELETE'])
+@bp.route('/orcamentos/<int:orcamento_id>/pagamentos/<int:pagamento_id>', methods=['DELETE'])
 def delete_pagamento(orcamento_id, pagamento_id):
     try:
         conn = get_db_connection()
@@ -900,6 +1769,7 @@ def delete_pagamento(orcamento_id, pagamento_id):
         query = """
             DELETE FROM pagamentos
             WHERE id = %s AND id_orcamento = %s
+            RETURNING (SELECT id_paciente FROM orcamentos WHERE id = id_orcamento)
         """
         cursor.execute(query, (pagamento_id, orcamento_id))
         
@@ -907,16 +1777,16 @@ def delete_pagamento(orcamento_id, pagamento_id):
             return jsonify({'error': 'Pagamento não encontrado.'}), 404
         
         conn.commit()
+        invalidate_patient(cursor.fetchone()[0], ORCAMENTOS)
         cursor.close()
-        conn.close()
         
         return jsonify({'message': 'Pagamento deletado com sucesso.'}), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao deletar pagamento.')
         return jsonify({'error': 'Erro ao deletar pagamento.'}), 500
 
 # Endpoint para adicionar um item a um orçamento
-@app.route('/orcamentos/<int:orcamento_id>/itens', methods=['POST'])
+@bp.route('/orcamentos/<int:orcamento_id>/itens', methods=['POST'])
 def add_item_orcamento(orcamento_id):
     try:
         data = request.json
@@ -931,9 +1801,10 @@ def add_item_orcamento(orcamento_id):
         cursor = conn.cursor()
         
         # Verifica se o orçamento existe
-        check_query = "SELECT 1 FROM orcamentos WHERE id = %s"
+        check_query = "SELECT id_paciente FROM orcamentos WHERE id = %s"
         cursor.execute(check_query, (orcamento_id,))
-        if not cursor.fetchone():
+        orcamento = cursor.fetchone()
+        if not orcamento:
             return jsonify({'error': 'Orçamento não encontrado.'}), 404
         
         # Insere o item
@@ -945,17 +1816,17 @@ def add_item_orcamento(orcamento_id):
         cursor.execute(insert_query, (orcamento_id, data_item, preco, descricao))
         item_id = cursor.fetchone()[0]
         conn.commit()
+        invalidate_patient(orcamento[0], ORCAMENTOS, DESCRICOES)
         
         cursor.close()
-        conn.close()
         
         return jsonify({'message': 'Item adicionado com sucesso.', 'id': item_id}), 201
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao adicionar item.')
         return jsonify({'error': 'Erro ao adicionar item.'}), 500
 
 # Endpoint para atualizar um item de orçamento
-@app.route('/orcamentos/<int:orcamento_id>/itens/<int:item_id>', methods=['PUT'])
+@bp.route('/orcamentos/<int:orcamento_id>/itens/<int:item_id>', methods=['PUT'])
 def update_item_orcamento(orcamento_id, item_id):
     try:
         data = request.json
@@ -973,6 +1844,7 @@ def update_item_orcamento(orcamento_id, item_id):
             UPDATE orcamento_itens
             SET data_item = %s, preco = %s, descricao = %s
             WHERE id = %s AND id_orcamento = %s
+            RETURNING (SELECT id_paciente FROM orcamentos WHERE id = id_orcamento)
         """
         cursor.execute(query, (data_item, preco, descricao, item_id, orcamento_id))
         
@@ -980,16 +1852,16 @@ def update_item_orcamento(orcamento_id, item_id):
             return jsonify({'error': 'Item não encontrado.'}), 404
         
         conn.commit()
+        invalidate_patient(cursor.fetchone()[0], ORCAMENTOS, DESCRICOES)
         cursor.close()
-        conn.close()
         
         return jsonify({'message': 'Item atualizado com sucesso.'}), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao atualizar item.')
         return jsonify({'error': 'Erro ao atualizar item.'}), 500
 
 # Endpoint para deletar um item de orçamento
-@app.route('/orcamentos/<int:orcamento_id>/itens/<int:item_id>', methods=['DELETE'])
+@bp.route('/orcamentos/<int:orcamento_id>/itens/<int:item_id>', methods=['DELETE'])
 def delete_item_orcamento(orcamento_id, item_id):
     try:
         conn = get_db_connection()
@@ -998,6 +1870,7 @@ def delete_item_orcamento(orcamento_id, item_id):
         query = """
             DELETE FROM orcamento_itens
             WHERE id = %s AND id_orcamento = %s
+            RETURNING (SELECT id_paciente FROM orcamentos WHERE id = id_orcamento)
         """
         cursor.execute(query, (item_id, orcamento_id))
         
@@ -1005,16 +1878,18 @@ def delete_item_orcamento(orcamento_id, item_id):
             return jsonify({'error': 'Item não encontrado.'}), 404
         
         conn.commit()
+        invalidate_patient(cursor.fetchone()[0], ORCAMENTOS, DESCRICOES)
         cursor.close()
-        conn.close()
         
         return jsonify({'message': 'Item deletado com sucesso.'}), 200
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Erro ao deletar item.')
         return jsonify({'error': 'Erro ao deletar item.'}), 500
 
 # Endpoint para buscar descrições únicas dos itens de orçamentos de um paciente
-@app.route('/paciente/<cpf>/orcamentos/descricoes', methods=['GET'])
+@bp.route('/paciente/<cpf>/orcamentos/descricoes', methods=['GET'])
+@cached_patient_read(DESCRICOES)
+@conditional_on_patient_version
 def get_descricoes_orcamentos(cpf):
     try:
         # Remove formatação do CPF (pontos e traços)
@@ -1028,7 +1903,6 @@ def get_descricoes_orcamentos(cpf):
         cursor.execute(patient_query, (cpf_clean,))
         if not cursor.fetchone():
             cursor.close()
-            conn.close()
             return jsonify({'error': 'Paciente não encontrado.'}), 404
         
         # Busca descrições únicas e não vazias dos itens de orçamentos do paciente
@@ -1048,16 +1922,105 @@ def get_descricoes_orcamentos(cpf):
         descricoes_list = [row[0] for row in descricoes]
         
         cursor.close()
-        conn.close()
         
         return jsonify(descricoes_list), 200
-    except Exception as e:
-        print(f"Erro ao buscar descrições de orçamentos: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception('Erro ao buscar descrições de orçamentos.')
         return jsonify({'error': 'Erro ao buscar descrições de orçamentos.'}), 500
 
 
+# ========== RELATÓRIOS ==========
+
+def fetch_recebiveis(cursor, de=None, ate=None, convenio=None, somente_em_aberto=False):
+    """
+    Contas a receber da clínica: total orçado, pago, saldo e dias desde o último
+    pagamento por orçamento, por paciente e no geral, filtrando os orçamentos por
+    data_orcamento (de/ate, inclusivos) e pelo convênio do paciente.
+    Os totais de cada orçamento vêm de orcamento_resumo e as somas por paciente e
+    gerais são feitas no banco em NUMERIC: os valores chegam como Decimal.
+    As linhas dos três níveis vêm de um único GROUPING SETS, já ordenadas com cada
+    paciente antes dos seus orçamentos. `cursor` deve ser um RealDictCursor.
+    """
+    cursor.execute("""
+        WITH por_orcamento AS (
+            SELECT o.id, o.id_paciente, o.data_orcamento, p.nome, p.convenio,
+                   coalesce(r.total_itens, 0) AS total, coalesce(r.total_pago, 0) AS pago,
+                   r.ultimo_pagamento
+            FROM orcamentos o
+            JOIN paciente p ON p.cpf = o.id_paciente
+            LEFT JOIN orcamento_resumo r ON r.id_orcamento = o.id
+            WHERE (%(de)s::date IS NULL OR o.data_orcamento >= %(de)s::date)
+              AND (%(ate)s::date IS NULL OR o.data_orcamento <= %(ate)s::date)
+              AND (%(convenio)s::text IS NULL OR p.convenio = %(convenio)s::text)
+        )
+        SELECT
+            GROUPING(id_paciente, id) AS nivel,
+            id_paciente, id,
+            min(nome) AS nome, min(convenio) AS convenio, min(data_orcamento) AS data_orcamento,
+            count(*) AS quantidade_orcamentos,
+            sum(total) AS total, sum(pago) AS pago, sum(total - pago) AS saldo,
+            max(ultimo_pagamento) AS ultimo_pagamento,
+            current_date - max(ultimo_pagamento) AS dias_desde_ultimo_pagamento
+        FROM por_orcamento
+        WHERE NOT %(somente_em_aberto)s OR total - pago <> 0
+        GROUP BY GROUPING SETS ((id_paciente, id), (id_paciente), ())
+        ORDER BY GROUPING(id_paciente), min(nome), id_paciente, GROUPING(id) DESC,
+                 min(data_orcamento), id
+    """, {'de': de, 'ate': ate, 'convenio': convenio, 'somente_em_aberto': somente_em_aberto})
+
+    pacientes = []
+    totais = None
+    for row in cursor.fetchall():
+        valores = {
+            'total': row['total'] or Decimal('0.00'),
+            'pago': row['pago'] or Decimal('0.00'),
+            'saldo': row['saldo'] or Decimal('0.00'),
+            'ultimo_pagamento': row['ultimo_pagamento'] and row['ultimo_pagamento'].isoformat(),
+            'dias_desde_ultimo_pagamento': row['dias_desde_ultimo_pagamento'],
+        }
+        if row['nivel'] == 0:
+            pacientes[-1]['orcamentos'].append(
+                {'id': row['id'], 'data_orcamento': row['data_orcamento'].isoformat(), **valores})
+        elif row['nivel'] == 1:
+            pacientes.append({'cpf': row['id_paciente'], 'nome': row['nome'],
+                              'convenio': row['convenio'],
+                              'quantidade_orcamentos': row['quantidade_orcamentos'],
+                              **valores, 'orcamentos': []})
+        else:
+            # O conjunto vazio () sempre gera a linha geral, mesmo sem orçamentos no filtro
+            totais = {'quantidade_orcamentos': row['quantidade_orcamentos'], **valores}
+    return pacientes, totais
+
+# Endpoint do relatório de contas a receber. Filtros opcionais: ?de=AAAA-MM-DD&ate=AAAA-MM-DD
+# (data do orçamento), ?convenio= e ?em_aberto=1 (apenas orçamentos com saldo).
+# Valores monetários vêm como strings decimais exatas ("1234.50").
+@bp.route('/relatorios/recebiveis', methods=['GET'])
+def get_recebiveis():
+    try:
+        de = request.args.get('de')
+        ate = request.args.get('ate')
+        de = date.fromisoformat(de) if de else None
+        ate = date.fromisoformat(ate) if ate else None
+    except ValueError:
+        return jsonify({'error': 'Datas inválidas. Use AAAA-MM-DD.'}), 400
+    convenio = request.args.get('convenio') or None
+    somente_em_aberto = request.args.get('em_aberto', '').lower() in ('1', 'true', 'sim')
+
+    try:
+        cursor = get_db_connection().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        pacientes, totais = fetch_recebiveis(cursor, de, ate, convenio, somente_em_aberto)
+        cursor.close()
+        return jsonify({
+            'filtros': {'de': de and de.isoformat(), 'ate': ate and ate.isoformat(),
+                        'convenio': convenio, 'em_aberto': somente_em_aberto},
+            'totais': totais,
+            'pacientes': pacientes,
+        }), 200
+    except Exception:
+        logger.exception('Erro ao gerar relatório de recebíveis.')
+        return jsonify({'error': 'Erro ao gerar relatório de recebíveis.'}), 500
+
+
 if __name__ == '__main__':
     import socket
     hostname = socket.gethostname()
@@ -1088,5 +2051,5 @@ if __name__ == '__main__':
     if network_ip != "N/A":
         print(f"  Ou em: http://{network_ip}:5000")
     print(f"{'='*60}\n")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
 
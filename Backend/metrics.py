@@ -0,0 +1,244 @@
+"""
+Métricas da aplicação no formato texto do Prometheus, expostas em /metrics.
+
+- requisições por rota/método/status e histograma de latência por rota;
+- tempo e linhas de cada consulta SQL (via db.add_query_observer), identificada
+  por um hash curto do SQL normalizado; db_query_info mapeia o hash para o texto;
+- estado do pool de conexões.
+
+Cada processo (worker) mantém os próprios contadores. O custo por requisição é
+um lock e uma busca binária por métrica (ver bench_metrics.py).
+
+Como db_query_info publica o texto das consultas, /metrics só existe com
+ADMIN_TOKEN definido e exige o token (ver admin_auth).
+"""
+import bisect
+import hashlib
+import re
+import threading
+import time
+
+from flask import Response, g, request
+
+import admin_auth
+import db
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+# execute_values() envia os valores já embutidos no SQL: literais viram "?" e
+# listas de tuplas viram uma só, para que o lote não gere um query_id por chamada
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\bNULL\b", re.IGNORECASE)
+_VALUES_LIST_RE = re.compile(r'(\([^()]*\))(?:\s*,\s*\([^()]*\))+')
+QUERY_ID_CACHE_SIZE = 2000
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}')
+        return lines
+
+
+class Gauge:
+    """
+    Métrica cujo valor é lido na hora da coleta. Com metric_type='counter', expõe
+    contadores mantidos por outro módulo.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), collect=None, metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for labels, value in self.collect() or ():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [contagem por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_number(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            inf = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, inf)} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(float(series[-2]))}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Requisições HTTP atendidas.', ('method', 'route', 'status')))
+http_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Latência das requisições HTTP.', ('method', 'route')))
+db_query_duration = registry.register(Histogram(
+    'db_query_duration_seconds', 'Tempo de execução das consultas SQL.', ('query_id',)))
+db_query_rows = registry.register(Histogram(
+    'db_query_rows', 'Linhas retornadas/afetadas por consulta SQL.', ('query_id',), buckets=ROW_BUCKETS))
+db_query_errors = registry.register(Counter(
+    'db_query_errors_total', 'Consultas SQL que falharam.', ('query_id',)))
+
+# query_id -> SQL normalizado (exposto em db_query_info)
+_query_texts = {}
+_query_ids = {}
+
+
+def normalize_query(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _LITERAL_RE.sub('?', query)
+    query = _VALUES_LIST_RE.sub(r'\1', query)
+    return _WHITESPACE_RE.sub(' ', query).strip()
+
+
+def query_id(query):
+    """Hash curto e estável do SQL normalizado."""
+    qid = _query_ids.get(query)
+    if qid is None:
+        normalized = normalize_query(query)
+        qid = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:10]
+        _query_texts[qid] = normalized[:500]
+        if len(_query_ids) >= QUERY_ID_CACHE_SIZE:
+            _query_ids.clear()
+        _query_ids[query] = qid
+    return qid
+
+
+registry.register(Gauge(
+    'db_query_info', 'Texto normalizado de cada query_id.', ('query_id', 'sql'),
+    collect=lambda: [((qid, text), 1) for qid, text in list(_query_texts.items())]))
+
+
+def observe_query(cursor, query, vars, duration, error):
+    qid = query_id(query)
+    labels = (qid,)
+    db_query_duration.observe(duration, labels)
+    if error is not None:
+        db_query_errors.inc(labels)
+    elif cursor.rowcount >= 0:
+        db_query_rows.observe(cursor.rowcount, labels)
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_duration.observe(time.perf_counter() - start, (request.method, route))
+        http_requests.inc((request.method, route, str(response.status_code)))
+    return response
+
+
+# Aplicações instrumentadas; o gauge do pool lê a mais recente
+_apps = []
+
+
+def _pool_stats():
+    pool = _apps[-1].extensions.get('db_pool') if _apps else None
+    if pool is None:
+        return []
+    return [((key,), value) for key, value in pool.stats().items()]
+
+
+registry.register(Gauge(
+    'db_pool', 'Estado e contadores do pool de conexões.', ('stat',), collect=_pool_stats))
+
+
+def init_app(app):
+    """Instrumenta a aplicação e registra a rota /metrics."""
+    db.add_query_observer(app, observe_query)
+    _apps.append(app)
+
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        denied = admin_auth.check()
+        if denied:
+            return denied
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,251 @@
+"""
+Importação de pacientes em lote (CSV ou NDJSON).
+
+As linhas são lidas em streaming e enviadas com COPY para uma tabela temporária.
+A validação (CPF, nome, datas, tamanhos, CPFs repetidos no arquivo) roda em SQL
+sobre o conjunto inteiro, e as linhas válidas entram em `paciente` com um único
+INSERT ... ON CONFLICT, tudo na mesma transação. Linhas inválidas não impedem a
+importação das demais e voltam no relatório com o número da linha e o motivo.
+
+Colunas aceitas (cabeçalho do CSV ou chaves do NDJSON): cpf, nome, telefone,
+data_nascimento (ou dataNascimento), endereco, convenio. Datas em AAAA-MM-DD ou
+DD/MM/AAAA; CPF com ou sem pontuação. Requer PostgreSQL 16+ (pg_input_is_valid).
+"""
+import csv
+import io
+import json
+
+FORMATS = ('csv', 'ndjson')
+ON_CONFLICT = ('update', 'skip')
+
+# Nome aceito no arquivo -> coluna da tabela temporária
+COLUMN_ALIASES = {
+    'cpf': 'cpf',
+    'nome': 'nome',
+    'telefone': 'telefone',
+    'data_nascimento': 'data_nascimento',
+    'datanascimento': 'data_nascimento',
+    'endereco': 'endereco',
+    'convenio': 'convenio',
+}
+COLUMNS = ('cpf', 'nome', 'telefone', 'data_nascimento', 'endereco', 'convenio')
+REQUIRED_COLUMNS = ('cpf', 'nome', 'data_nascimento')
+
+# Linhas acumuladas antes de entregar um bloco ao COPY e tamanho de cada leitura do COPY
+COPY_CHUNK_ROWS = 1000
+COPY_READ_SIZE = 256 * 1024
+
+
+class ImportFormatError(ValueError):
+    """O arquivo inteiro é inválido (formato desconhecido, cabeçalho sem colunas obrigatórias)."""
+
+
+def _csv_reader(text):
+    """
+    Lê o cabeçalho e confere as colunas obrigatórias antes do COPY: exceções lançadas
+    dentro do COPY chegam como QueryCanceled.
+    """
+    reader = csv.DictReader(text)
+    header = {COLUMN_ALIASES.get((name or '').strip().lower()) for name in reader.fieldnames or []}
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ImportFormatError(f"Colunas obrigatórias ausentes no CSV: {', '.join(missing)}")
+    return reader
+
+
+def _csv_rows(reader, errors):
+    for record in reader:
+        if None in record:
+            # DictReader guarda em None os campos além do cabeçalho
+            errors.append({'linha': reader.line_num, 'cpf': record.get('cpf'),
+                           'erro': 'Colunas a mais na linha'})
+            continue
+        row = {}
+        for name, value in record.items():
+            column = COLUMN_ALIASES.get(name.strip().lower())
+            if column is not None:
+                row[column] = value
+        yield reader.line_num, row
+
+
+def _ndjson_rows(text, errors):
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError
+        except ValueError:
+            errors.append({'linha': number, 'cpf': None, 'erro': 'JSON inválido'})
+            continue
+        row = {}
+        for name, value in record.items():
+            column = COLUMN_ALIASES.get(name.lower())
+            if column is not None and value is not None:
+                row[column] = value if isinstance(value, str) else str(value)
+        yield number, row
+
+
+class CopyStream:
+    """
+    Arquivo somente leitura que gera o CSV do COPY sob demanda, em blocos.
+    O psycopg2 troca qualquer exceção de read() por QueryCanceled; a original fica
+    em `error` para ser relançada.
+    """
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ''
+        self.count = 0
+        self.error = None
+
+    def _next_chunk(self):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        for number, row in self._rows:
+            writer.writerow([number] + [row.get(column) for column in COLUMNS])
+            self.count += 1
+            if self.count % COPY_CHUNK_ROWS == 0:
+                break
+        return out.getvalue()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                chunk = self._next_chunk()
+            except Exception as e:
+                self.error = e
+                raise
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def import_patients(conn, text, fmt='csv', on_conflict='update', dry_run=False):
+    """
+    Importa pacientes de `text` (arquivo texto aberto). Faz commit, ou rollback com
+    `dry_run`. Retorna {'total', 'inserted', 'updated', 'skipped', 'invalid', 'errors'},
+    com `errors` ordenado pela linha.
+    """
+    if fmt not in FORMATS:
+        raise ImportFormatError(f'Formato inválido: {fmt}')
+    if on_conflict not in ON_CONFLICT:
+        raise ImportFormatError(f'on_conflict inválido: {on_conflict}')
+
+    parse_errors = []
+    if fmt == 'csv':
+        rows = _csv_rows(_csv_reader(text), parse_errors)
+    else:
+        rows = _ndjson_rows(text, parse_errors)
+    stream = CopyStream(rows)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE paciente_import (
+                linha INT,
+                cpf TEXT,
+                nome TEXT,
+                telefone TEXT,
+                data_nascimento TEXT,
+                endereco TEXT,
+                convenio TEXT,
+                cpf_norm TEXT,
+                data_norm TEXT,
+                erro TEXT
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert("""
+            COPY paciente_import (linha, cpf, nome, telefone, data_nascimento, endereco, convenio)
+            FROM STDIN WITH (FORMAT csv)
+        """, stream, size=COPY_READ_SIZE)
+
+        # Normalização: CPF só com dígitos, DD/MM/AAAA -> AAAA-MM-DD, textos vazios -> NULL
+        cursor.execute(r"""
+            UPDATE paciente_import SET
+                cpf_norm = regexp_replace(coalesce(cpf, ''), '\D', '', 'g'),
+                data_norm = regexp_replace(btrim(coalesce(data_nascimento, '')),
+                                           '^(\d{2})/(\d{2})/(\d{4})$', '\3-\2-\1'),
+                nome = nullif(btrim(nome), ''),
+                telefone = nullif(btrim(telefone), ''),
+                endereco = nullif(btrim(endereco), ''),
+                convenio = nullif(btrim(convenio), '')
+        """)
+        cursor.execute(r"""
+            UPDATE paciente_import SET erro = CASE
+                WHEN length(cpf_norm) <> 11 THEN 'CPF inválido'
+                WHEN nome IS NULL THEN 'Nome é obrigatório'
+                WHEN length(nome) > 200 THEN 'Nome com mais de 200 caracteres'
+                WHEN data_norm !~ '^\d{4}-\d{2}-\d{2}$' OR NOT pg_input_is_valid(data_norm, 'date')
+                    THEN 'Data de nascimento inválida'
+                WHEN data_norm::date > current_date THEN 'Data de nascimento no futuro'
+                WHEN length(telefone) > 20 THEN 'Telefone com mais de 20 caracteres'
+                WHEN length(convenio) > 50 THEN 'Convênio com mais de 50 caracteres'
+            END
+        """)
+        # CPF repetido no arquivo: vale a última ocorrência válida
+        cursor.execute("""
+            UPDATE paciente_import i
+            SET erro = 'CPF repetido no arquivo (vale a linha ' || d.ultima || ')'
+            FROM (
+                SELECT linha, max(linha) OVER (PARTITION BY cpf_norm) AS ultima
+                FROM paciente_import
+                WHERE erro IS NULL
+            ) d
+            WHERE i.linha = d.linha AND d.linha <> d.ultima
+        """)
+
+        conflict = """
+            DO UPDATE SET nome = EXCLUDED.nome, telefone = EXCLUDED.telefone,
+                          data_nascimento = EXCLUDED.data_nascimento,
+                          endereco = EXCLUDED.endereco, convenio = EXCLUDED.convenio
+        """ if on_conflict == 'update' else "DO NOTHING"
+        cursor.execute(f"""
+            WITH gravados AS (
+                INSERT INTO paciente (cpf, nome, telefone, data_nascimento, endereco, convenio)
+                SELECT cpf_norm, nome, telefone, data_norm::date, endereco, convenio
+                FROM paciente_import
+                WHERE erro IS NULL
+                ON CONFLICT (cpf) {conflict}
+                RETURNING (xmax = 0) AS inserido
+            )
+            SELECT count(*) FILTER (WHERE inserido), count(*) FILTER (WHERE NOT inserido)
+            FROM gravados
+        """)
+        inserted, updated = cursor.fetchone()
+
+        cursor.execute("SELECT count(*) FILTER (WHERE erro IS NULL) FROM paciente_import")
+        valid = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT linha, cpf, erro FROM paciente_import
+            WHERE erro IS NOT NULL
+            ORDER BY linha
+        """)
+        errors = [{'linha': linha, 'cpf': cpf, 'erro': erro} for linha, cpf, erro in cursor.fetchall()]
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        if stream.error is not None:
+            raise stream.error from None
+        raise
+    finally:
+        cursor.close()
+
+    errors = sorted(errors + parse_errors, key=lambda error: error['linha'])
+    return {
+        'total': stream.count + len(parse_errors),
+        'inserted': inserted,
+        'updated': updated,
+        'skipped': valid - inserted - updated,
+        'invalid': len(errors),
+        'errors': errors,
+    }
@@ -0,0 +1,302 @@
+"""
+Cache de leitura das rotas do paciente (detalhes, orçamentos, descrições).
+
+A resposta 200 de cada rota é guardada por (rota, CPF) e devolvida sem consultar
+o banco até expirar (CACHE_TTL) ou ser invalidada pelas rotas de escrita com
+`invalidate_patient(cpf, rota...)`, chamada depois do commit.
+
+Cada (rota, CPF) tem um número de geração que faz parte da chave (junto com uma
+geração global, incrementada por `invalidate_all`). Invalidar
+incrementa a geração em vez de apagar a entrada, e uma leitura só grava no cache
+sob a geração que viu antes de consultar o banco. Assim, uma leitura que começou
+antes de uma escrita nunca publica dados antigos na chave atual.
+
+Antes de devolver uma entrada, o ETag guardado é comparado com a versão atual do
+paciente (`etag_getter`, uma leitura por chave primária em paciente_versao); se
+não bater, a entrada é tratada como ausente. Isso cobre as escritas feitas por
+outros workers, que não invalidam o cache local deste.
+
+Backends (CACHE_BACKEND):
+    local   LRU em memória por processo (padrão), limitado a CACHE_MAX_ENTRIES.
+    redis   compartilhado entre workers (CACHE_REDIS_URL; requer `pip install redis`).
+    none    desativado.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.http import unquote_etag
+
+import metrics
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - depende do ambiente
+    redis = None
+
+logger = logging.getLogger('clinica.read_cache')
+
+DETALHES = 'detalhes'
+ORCAMENTOS = 'orcamentos'
+DESCRICOES = 'descricoes'
+ALL_READS = (DETALHES, ORCAMENTOS, DESCRICOES)
+# Geração global (invalidate_all)
+GLOBAL_GENERATION = '*'
+
+# Cabeçalhos da resposta original guardados junto com o corpo
+CACHED_HEADERS = ('ETag', 'Cache-Control')
+
+
+class LocalBackend:
+    """
+    As gerações vêm de um contador único e só as max_entries mais recentes são
+    guardadas. Um nome descartado passa a valer o piso (o maior valor descartado),
+    que nunca é menor que a última geração dele: no pior caso vira um miss.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # chave -> (expira_em, valor)
+        self._generations = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+                         'expirations': 0, 'invalidations': 0, 'stale': 0}
+
+    def generations(self, names):
+        with self._lock:
+            return [self._generations.get(name, self._floor) for name in names]
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.counters['misses'] += 1
+                return None
+            if item[0] <= time.monotonic():
+                del self._entries[key]
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self.counters['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._clock += 1
+                self._generations[name] = self._clock
+                self._generations.move_to_end(name)
+            while len(self._generations) > self.max_entries:
+                _, generation = self._generations.popitem(last=False)
+                self._floor = max(self._floor, generation)
+            self.counters['invalidations'] += len(names)
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Entradas em JSON com expiração do próprio Redis; gerações com INCR."""
+
+    def __init__(self, url, ttl=60.0, prefix='clinica:cache:'):
+        if redis is None:
+            raise RuntimeError('redis não está instalado (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+                         'expirations': 0, 'invalidations': 0, 'errors': 0, 'stale': 0}
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def generations(self, names):
+        values = self.client.mget([f'{self.prefix}gen:{name}' for name in names])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        self._count('misses' if raw is None else 'hits')
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+        self._count('stores')
+
+    def bump(self, names):
+        pipe = self.client.pipeline(transaction=False)
+        for name in names:
+            pipe.incr(f'{self.prefix}gen:{name}')
+        pipe.execute()
+        self._count('invalidations', len(names))
+
+    def size(self):
+        return None
+
+
+def _normalize_cpf(cpf):
+    return cpf.replace('.', '').replace('-', '')
+
+
+def _generation_name(read, cpf):
+    return f'{read}:{cpf}'
+
+
+def _backend():
+    return current_app.extensions.get('read_cache')
+
+
+def _record_error(backend):
+    logger.warning('Falha no cache de leitura', exc_info=True)
+    backend._count('errors')
+
+
+def _cached_response(entry):
+    response = current_app.response_class(entry['body'], status=200, mimetype=entry['mimetype'])
+    for name, value in entry['headers'].items():
+        response.headers[name] = value
+    response.headers['X-Cache'] = 'HIT'
+    etag = entry['headers'].get('ETag')
+    if etag and request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+        response.status_code = 304
+        response.set_data(b'')
+    return response
+
+
+def _is_current(backend, entry, cpf_clean):
+    """Se o ETag da entrada ainda é a versão atual do paciente (escritas de outros workers)."""
+    etag_getter = current_app.extensions.get('read_cache_etag')
+    if etag_getter is None:
+        return True
+    cached = entry['headers'].get('ETag')
+    try:
+        current = etag_getter(cpf_clean)
+    except Exception:
+        _record_error(backend)
+        return False
+    if (unquote_etag(cached)[0] if cached else None) == current:
+        return True
+    backend._count('stale')
+    return False
+
+
+def cached_patient_read(read):
+    """Decorador das rotas de leitura `read` (DETALHES, ORCAMENTOS...) de /paciente/<cpf>."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(cpf, *args, **kwargs):
+            backend = _backend()
+            if backend is None:
+                return view(cpf, *args, **kwargs)
+            cpf_clean = _normalize_cpf(cpf)
+            try:
+                global_generation, generation = backend.generations(
+                    [GLOBAL_GENERATION, _generation_name(read, cpf_clean)])
+                key = f'{read}:{cpf_clean}:{global_generation}.{generation}'
+                entry = backend.get(key)
+            except Exception:
+                _record_error(backend)
+                return view(cpf, *args, **kwargs)
+            if entry is not None and _is_current(backend, entry, cpf_clean):
+                return _cached_response(entry)
+
+            response = current_app.make_response(view(cpf, *args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                try:
+                    backend.set(key, {
+                        'body': response.get_data(as_text=True),
+                        'mimetype': response.mimetype,
+                        'headers': {name: response.headers[name] for name in CACHED_HEADERS
+                                    if name in response.headers},
+                    })
+                except Exception:
+                    _record_error(backend)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_patient(cpf, *reads):
+    """Invalida as leituras `reads` (todas, se vazio) do paciente. Chamar após o commit."""
+    backend = _backend()
+    if backend is None or cpf is None:
+        return
+    cpf_clean = _normalize_cpf(cpf)
+    try:
+        backend.bump([_generation_name(read, cpf_clean) for read in (reads or ALL_READS)])
+    except Exception:
+        _record_error(backend)
+
+
+def invalidate_all():
+    """Invalida todas as leituras de todos os pacientes (ex.: após uma importação em lote)."""
+    backend = _backend()
+    if backend is None:
+        return
+    try:
+        backend.bump([GLOBAL_GENERATION])
+    except Exception:
+        _record_error(backend)
+
+
+# Backend da aplicação mais recente, lido pelas métricas
+_active = []
+
+
+def _collect_events():
+    if not _active or _active[-1] is None:
+        return []
+    with _active[-1]._lock:
+        counters = dict(_active[-1].counters)
+    return [((event,), value) for event, value in counters.items()]
+
+
+def _collect_size():
+    size = _active[-1].size() if _active and _active[-1] is not None else None
+    return [((), size)] if size is not None else []
+
+
+metrics.registry.register(metrics.Gauge(
+    'read_cache_events_total', 'Eventos do cache de leitura (hits, misses, evictions...).',
+    ('event',), collect=_collect_events, metric_type='counter'))
+metrics.registry.register(metrics.Gauge(
+    'read_cache_entries', 'Entradas no cache de leitura local.', collect=_collect_size))
+
+
+def init_app(app, backend='local', max_entries=1024, ttl=60.0, redis_url=None, etag_getter=None):
+    """`etag_getter(cpf)` devolve o ETag atual do paciente (sem aspas) ou None."""
+    if backend == 'none':
+        cache = None
+    elif backend == 'redis':
+        cache = RedisBackend(redis_url, ttl)
+    elif backend == 'local':
+        cache = LocalBackend(max_entries, ttl)
+    else:
+        raise ValueError(f'CACHE_BACKEND inválido: {backend}')
+    app.extensions['read_cache'] = cache
+    app.extensions['read_cache_etag'] = etag_getter
+    _active.append(cache)
@@ -0,0 +1,97 @@
+"""
+Exportação do prontuário completo de um paciente em ZIP, gerado em streaming.
+
+O ZipFile escreve em um destino não posicionável (ZipSink), que só acumula os
+bytes até o gerador entregá-los à resposta. Sem seek, o zipfile grava tamanhos e
+CRC em data descriptors depois de cada arquivo, então nada precisa ser
+reescrito. As imagens são copiadas do disco em blocos: a memória usada é a de
+um bloco, qualquer que seja a quantidade de imagens, e nenhum arquivo temporário
+é criado.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ZipSink(io.RawIOBase):
+    """Destino somente escrita e sem seek; `drain()` devolve o que foi escrito desde a última chamada."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _csv_bytes(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8-sig')
+
+
+def generate_zip(patient, treatments, orcamentos, images, base_folder):
+    """
+    Gera os bytes do ZIP com:
+        paciente.json, tratamentos.csv, orcamentos.json (itens e pagamentos),
+        imagens/<timestamp>.png e imagens.csv (índice, inclusive das imagens ausentes do disco).
+    `images` é uma lista de (raw, caminho relativo a base_folder).
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('paciente.json', json.dumps(
+            patient, ensure_ascii=False, indent=2, default=_json_default))
+        yield sink.drain()
+
+        archive.writestr('tratamentos.csv', _csv_bytes(
+            ['data', 'dente', 'faces', 'anotacao', 'epoch_criacao'],
+            ([row['data'], 'boca_inteira' if row['numero_dente'] is None else row['numero_dente'],
+              row['face_dente'], row['anotacao'], row['epoch_criacao']] for row in treatments)))
+        yield sink.drain()
+
+        archive.writestr('orcamentos.json', json.dumps(
+            orcamentos, ensure_ascii=False, indent=2, default=_json_default))
+        yield sink.drain()
+
+        index = []
+        for raw, relative_path in images:
+            name = f'imagens/{raw}.png'
+            try:
+                source = open(os.path.join(base_folder, relative_path), 'rb')
+            except FileNotFoundError:
+                index.append((raw, '', 'não'))
+                continue
+            with source:
+                # PNG já é comprimido: armazenado sem recompressão
+                info = zipfile.ZipInfo.from_file(source.name, name)
+                info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, mode='w') as target:
+                    while True:
+                        chunk = source.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        yield sink.drain()
+            index.append((raw, name, 'sim'))
+            yield sink.drain()
+
+        archive.writestr('imagens.csv', _csv_bytes(['timestamp', 'arquivo', 'incluida'], index))
+    yield sink.drain()
@@ -0,0 +1,192 @@
+"""
+Log estruturado da aplicação.
+
+Cada requisição gera uma linha JSON (método, rota, status, duração, id da
+requisição e cabeçalhos permitidos). As mensagens dos handlers usam o logger
+`clinica` e saem no mesmo formato, com o id da requisição. A escrita em
+stdout/arquivo acontece em uma thread própria (QueueHandler + QueueListener),
+então a requisição só enfileira o registro. O listener é único no processo e
+compartilhado pelas aplicações criadas nele; ele para quando a última delas é
+encerrada com `shutdown(app)`.
+
+Configuração por variáveis de ambiente:
+    LOG_LEVEL          nível mínimo (padrão INFO)
+    LOG_FILE           arquivo de saída (padrão stdout)
+    LOG_SAMPLE_RATE    fração das requisições bem-sucedidas registradas (padrão 1.0)
+    LOG_ROUTES         JSON por rota, ex.: {"/get_images": {"sample_rate": 0.1, "level": "DEBUG"}}
+    LOG_HEADERS        cabeçalhos registrados, separados por vírgula
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from flask import current_app, g, has_request_context, request
+
+logger = logging.getLogger('clinica')
+access_logger = logging.getLogger('clinica.request')
+
+DEFAULT_LOG_HEADERS = 'User-Agent,Content-Type,Content-Length,Origin,Referer'
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Listener e handler instalados no logger `clinica`, e as aplicações que os usam
+_install_lock = threading.Lock()
+_installed = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Anexa o id da requisição atual ao registro (roda na thread da requisição)."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+def _route_rules():
+    try:
+        return json.loads(os.environ.get('LOG_ROUTES', '{}'))
+    except ValueError:
+        return {}
+
+
+def _install():
+    """Instala o QueueHandler no logger e inicia o listener, se ainda não estiverem rodando."""
+    global _installed
+    if _installed is not None:
+        return _installed
+    log_file = os.environ.get('LOG_FILE')
+    output = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stdout)
+    # O registro já chega formatado pelo QueueHandler
+    output.setFormatter(logging.Formatter('%(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(JsonFormatter())
+    queue_handler.addFilter(RequestIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+
+    logger.handlers[:] = [queue_handler]
+    logger.propagate = False
+    _installed = {'listener': listener, 'handler': queue_handler, 'output': output, 'apps': set()}
+    return _installed
+
+
+def _uninstall():
+    global _installed
+    installed, _installed = _installed, None
+    if installed is not None:
+        logger.removeHandler(installed['handler'])
+        installed['listener'].stop()
+        installed['output'].close()
+
+
+def shutdown(app):
+    """Desliga o log da aplicação; a última a sair para o listener e remove o handler."""
+    with _install_lock:
+        if _installed is None or id(app) not in _installed['apps']:
+            return
+        _installed['apps'].discard(id(app))
+        if not _installed['apps']:
+            _uninstall()
+
+
+# Esvazia a fila na saída do processo, mesmo sem shutdown_app
+atexit.register(_uninstall)
+
+
+def init_app(app):
+    level = logging.getLevelName(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+
+    with _install_lock:
+        installed = _install()
+        installed['apps'].add(id(app))
+    listener = installed['listener']
+    logger.setLevel(level)
+
+    app.config['LOG_SAMPLE_RATE'] = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+    app.config['LOG_ROUTES'] = _route_rules()
+    app.config['LOG_HEADERS'] = [
+        h.strip() for h in os.environ.get('LOG_HEADERS', DEFAULT_LOG_HEADERS).split(',') if h.strip()
+    ]
+    app.extensions['request_log_listener'] = listener
+
+    app.before_request(_start_request)
+    app.after_request(_log_request)
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+
+
+def _log_request(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+
+    route = request.url_rule.rule if request.url_rule else None
+    rule = current_app.config['LOG_ROUTES'].get(route or request.path, {})
+    status = response.status_code
+
+    if status >= 500:
+        level = logging.ERROR
+    else:
+        # Erros de servidor são sempre registrados; o resto passa pela amostragem
+        sample_rate = rule.get('sample_rate', current_app.config['LOG_SAMPLE_RATE'])
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return response
+        level = logging.getLevelName(str(rule.get('level', 'INFO')).upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+        if status >= 400:
+            level = max(level, logging.WARNING)
+
+    if not access_logger.isEnabledFor(level):
+        return response
+
+    duration_ms = (time.perf_counter() - g.request_start) * 1000 if 'request_start' in g else None
+    fields = {
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'status': status,
+        'duration_ms': round(duration_ms, 2) if duration_ms is not None else None,
+        'remote_addr': request.remote_addr,
+        'response_bytes': response.content_length,
+        'headers': {
+            name: request.headers[name]
+            for name in current_app.config['LOG_HEADERS'] if name in request.headers
+        },
+    }
+    access_logger.log(level, 'request', extra={'fields': fields})
+    return response
@@ -0,0 +1,225 @@
+"""
+Log de consultas lentas.
+
+Toda consulta que passa de SLOW_QUERY_MS é registrada no logger
+`clinica.slow_query` com o SQL normalizado (literais trocados por "?") e os
+parâmetros reduzidos aos tipos, nunca aos valores. Uma fração amostrada dessas
+consultas (apenas SELECT/WITH) ganha um `EXPLAIN (ANALYZE, BUFFERS)`, executado
+em segundo plano em outra conexão do pool, em transação somente leitura e com
+statement_timeout. O EXPLAIN roda sobre a consulta preparada com plano genérico,
+então o plano mostra $1, $2... no lugar dos parâmetros; literais entre aspas que
+restarem no texto do plano também são trocados por '?'. As últimas ocorrências
+ficam num buffer circular consultado em GET /admin/slow-queries, que só existe
+com ADMIN_TOKEN definido.
+
+Configuração por variáveis de ambiente:
+    SLOW_QUERY_MS                  limite em milissegundos (padrão 200; 0 desativa)
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE fração das consultas lentas com EXPLAIN (padrão 0.1)
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS  statement_timeout do EXPLAIN (padrão 10000)
+    SLOW_QUERY_BUFFER_SIZE         ocorrências mantidas no buffer (padrão 100)
+    ADMIN_TOKEN                    exigido nas rotas (ver admin_auth); sem ele respondem 404
+"""
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, has_request_context, jsonify, request
+
+import admin_auth
+import db
+import metrics
+
+logger = logging.getLogger('clinica.slow_query')
+
+_EXPLAINABLE = ('SELECT', 'WITH')
+# Marcadores do psycopg2: %%, %s e %(nome)s
+_PLACEHOLDER_RE = re.compile(r'%(?:%|s|\((\w+)\)s)')
+_QUOTED_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_statement_ids = itertools.count()
+# Marca as threads que estão rodando EXPLAIN, para não observar as próprias consultas
+_local = threading.local()
+
+
+def redact_params(vars):
+    """Substitui cada parâmetro pelo seu tipo (listas e tuplas mantêm o tamanho)."""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: redact_params(value) for key, value in vars.items()}
+    if isinstance(vars, (list, tuple)):
+        return [_redact_value(value) for value in vars]
+    return _redact_value(vars)
+
+
+def _redact_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return f'<{type(value).__name__}[{len(value)}]>'
+    return f'<{type(value).__name__}>'
+
+
+def to_prepared(query, vars):
+    """
+    Converte os marcadores do psycopg2 em $1, $2... Retorna (sql, argumentos na ordem
+    dos $n). Parâmetros nomeados repetidos reaproveitam o mesmo $n.
+    """
+    if vars is None:
+        return query, []
+    args = []
+    names = {}
+    positional = iter(vars) if not isinstance(vars, dict) else None
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1) is None:
+            args.append(next(positional))
+            return f'${len(args)}'
+        name = match.group(1)
+        if name not in names:
+            args.append(vars[name])
+            names[name] = len(args)
+        return f'${names[name]}'
+
+    return _PLACEHOLDER_RE.sub(replace, query), args
+
+
+def scrub_plan(plan):
+    """Troca por '?' os literais entre aspas que ainda estejam no texto do plano."""
+    return _QUOTED_LITERAL_RE.sub("'?'", plan)
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=200.0, sample_rate=0.1, explain_timeout_ms=10000,
+                 buffer_size=100, pool_getter=None):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.explain_timeout_ms = explain_timeout_ms
+        self.pool_getter = pool_getter
+        self._entries = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        # Um único worker: EXPLAINs extras são descartados em vez de enfileirados
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+        self._explain_pending = threading.BoundedSemaphore(4)
+
+    def observe(self, cursor, query, vars, duration, error):
+        duration_ms = duration * 1000
+        if error is not None or duration_ms < self.threshold_ms or getattr(_local, 'explaining', False):
+            return
+        sql = metrics.normalize_query(query)
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'query_id': metrics.query_id(query),
+            'sql': sql,
+            'params': redact_params(vars),
+            'duration_ms': round(duration_ms, 2),
+            'rows': cursor.rowcount,
+            'request_id': None,
+            'route': None,
+            'plan': None,
+            'explain_error': None,
+        }
+        if has_request_context():
+            entry['request_id'] = g.get('request_id')
+            entry['route'] = request.url_rule.rule if request.url_rule else request.path
+        with self._lock:
+            self._entries.append(entry)
+        logger.warning('slow query', extra={'fields': {
+            key: entry[key] for key in ('query_id', 'sql', 'params', 'duration_ms', 'rows', 'route')
+        }})
+
+        if (self.pool_getter is not None and cursor.name is None
+                and sql.upper().startswith(_EXPLAINABLE)
+                and random.random() < self.sample_rate
+                and self._explain_pending.acquire(blocking=False)):
+            future = self._executor.submit(self._explain, entry, query, vars)
+            future.add_done_callback(lambda _: self._explain_pending.release())
+
+    def _explain(self, entry, query, vars):
+        if isinstance(query, bytes):
+            query = query.decode('utf-8')
+        sql, args = to_prepared(query, vars)
+        name = f'slow_query_explain_{next(_statement_ids)}'
+        _local.explaining = True
+        try:
+            with self.pool_getter().connection() as conn:
+                cursor = conn.cursor()
+                prepared = False
+                try:
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                    cursor.execute("SET LOCAL statement_timeout = %s", (int(self.explain_timeout_ms),))
+                    # Plano genérico: os valores dos parâmetros não aparecem no plano
+                    cursor.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                    cursor.execute(f"PREPARE {name} AS {sql}")
+                    prepared = True
+                    execute = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * len(args))})" if args else '')
+                    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {execute}", args)
+                    plan = scrub_plan('\n'.join(row[0] for row in cursor.fetchall()))
+                finally:
+                    conn.rollback()
+                    if prepared:
+                        # PREPARE não é desfeito pelo rollback
+                        cursor.execute(f"DEALLOCATE {name}")
+                        conn.rollback()
+                    cursor.close()
+            with self._lock:
+                entry['plan'] = plan
+        except Exception as e:
+            with self._lock:
+                entry['explain_error'] = str(e).strip()
+            logger.info('EXPLAIN falhou para %s', entry['query_id'], exc_info=True)
+        finally:
+            _local.explaining = False
+
+    def entries(self, limit=None):
+        with self._lock:
+            items = [dict(entry) for entry in self._entries]
+        items.reverse()
+        return items[:limit] if limit else items
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def init_app(app):
+    """Registra o observer de consultas lentas e as rotas de administração."""
+    slow_log = SlowQueryLog(
+        threshold_ms=float(os.environ.get('SLOW_QUERY_MS', 200)),
+        sample_rate=float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1)),
+        explain_timeout_ms=int(os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 10000)),
+        buffer_size=int(os.environ.get('SLOW_QUERY_BUFFER_SIZE', 100)),
+        pool_getter=lambda: db.get_pool(app),
+    )
+    app.extensions['slow_query_log'] = slow_log
+    if slow_log.threshold_ms > 0:
+        db.add_query_observer(app, slow_log.observe)
+
+    @app.route('/admin/slow-queries', methods=['GET'])
+    def get_slow_queries():
+        denied = admin_auth.check()
+        if denied:
+            return denied
+        limit = request.args.get('limit', type=int)
+        return jsonify({
+            'threshold_ms': slow_log.threshold_ms,
+            'explain_sample_rate': slow_log.sample_rate,
+            'entries': slow_log.entries(limit),
+        })
+
+    @app.route('/admin/slow-queries', methods=['DELETE'])
+    def clear_slow_queries():
+        denied = admin_auth.check()
+        if denied:
+            return denied
+        slow_log.clear()
+        return jsonify({'message': 'Buffer de consultas lentas limpo'})
+
+    return slow_log
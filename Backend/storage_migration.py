@@ -0,0 +1,155 @@
+"""
+Migração das pastas de imagens do layout antigo ("{nome} - {cpf}" e "{cpf}")
+para o layout por CPF (image_index.patient_dir).
+
+Cada pasta é migrada assim, sob o advisory lock de imagens do paciente:
+  1. cada arquivo ganha um hard link (ou cópia) no destino;
+  2. os caminhos em `imagens` passam a apontar para o destino (commit);
+  3. os arquivos antigos são apagados e a pasta vazia é removida.
+Leitores sempre encontram um arquivo válido, e a migração pode ser interrompida
+e reiniciada em qualquer ponto: arquivos que já estão no destino são reaproveitados.
+
+A migração usa uma conexão própria, fora do pool das requisições: ela segura o
+advisory lock da migração e também faz o trabalho de cada pasta.
+"""
+import logging
+import os
+import shutil
+import threading
+
+import psycopg2
+
+import image_index
+import thumbnails
+
+logger = logging.getLogger('clinica.storage_migration')
+
+# Chave do advisory lock que garante um único worker migrando por vez
+MIGRATION_LOCK_KEY = 7302
+
+
+def _link_or_copy(source, target):
+    if os.path.exists(target):
+        if os.path.getsize(target) == os.path.getsize(source):
+            return
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Sistemas de arquivos sem hard link (ou dispositivos diferentes)
+        tmp_path = f"{target}.migracao.tmp"
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+
+
+def migrate_folder(conn, base_folder, cpf, relative_folder):
+    """Migra uma pasta antiga usando `conn`. Retorna a quantidade de arquivos movidos."""
+    source_folder = os.path.join(base_folder, relative_folder)
+    target_relative = image_index.patient_dir(cpf)
+    target_folder = os.path.join(base_folder, target_relative)
+    os.makedirs(target_folder, exist_ok=True)
+
+    migrated = []
+    cursor = conn.cursor()
+    try:
+        image_index.lock_patient_images(cursor, cpf)
+        for entry in os.scandir(source_folder):
+            # Temporários (.tmp) de gravações interrompidas ficam para trás
+            if not entry.is_file() or not entry.name.endswith('.png'):
+                continue
+            _link_or_copy(entry.path, os.path.join(target_folder, entry.name))
+            migrated.append(entry.path)
+            if thumbnails.is_thumbnail(entry.name):
+                continue
+            raw = entry.name[:-len('.png')]
+            try:
+                epoch = image_index.image_epoch_ms(raw)
+            except ValueError:
+                continue
+            cursor.execute("""
+                UPDATE imagens
+                SET caminho_arquivo = %s
+                WHERE id_paciente = %s AND epoch_insercao = %s AND caminho_arquivo = %s
+            """, (os.path.join(target_relative, entry.name), cpf, epoch,
+                  os.path.join(relative_folder, entry.name)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    # Depois do commit ninguém mais lê os caminhos antigos
+    for path in migrated:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    try:
+        os.rmdir(source_folder)
+    except OSError:
+        # Pasta com arquivos não reconhecidos: fica para análise manual
+        pass
+    return len(migrated)
+
+
+def migrate_legacy_folders(conn, base_folder, stop_event=None):
+    """Migra todas as pastas antigas. Retorna (pastas, arquivos) migrados."""
+    folders = files = 0
+    legacy = [
+        (cpf, relative_folder)
+        for cpf, relative_folder, new_layout in image_index.iter_patient_folders(base_folder)
+        if not new_layout
+    ]
+    for cpf, relative_folder in legacy:
+        if stop_event is not None and stop_event.is_set():
+            break
+        try:
+            files += migrate_folder(conn, base_folder, cpf, relative_folder)
+            folders += 1
+        except Exception:
+            logger.exception("Erro ao migrar pasta '%s'", relative_folder)
+    return folders, files
+
+
+def run_exclusive(db_config, base_folder, stop_event=None):
+    """
+    Executa a migração se nenhum outro processo estiver executando.
+    Retorna (pastas, arquivos) ou None se outro worker já está migrando.
+    """
+    # Conexão dedicada: não ocupa slots do pool (com DB_POOL_MAX=1, segurar o lock
+    # numa conexão do pool e pedir outra para cada pasta travaria).
+    conn = psycopg2.connect(**db_config)
+    try:
+        cursor = conn.cursor()
+        # O lock é de sessão: continua valendo depois dos commits de cada pasta
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        locked = cursor.fetchone()[0]
+        conn.commit()
+        if not locked:
+            return None
+        try:
+            return migrate_legacy_folders(conn, base_folder, stop_event)
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+            cursor.close()
+    finally:
+        conn.close()
+
+
+def start_background(db_config, base_folder):
+    """Roda a migração em uma thread daemon. Retorna o Event que a interrompe."""
+    stop_event = threading.Event()
+
+    def run():
+        try:
+            result = run_exclusive(db_config, base_folder, stop_event)
+            if result:
+                logger.info('Migração de pastas de imagens: %d pastas, %d arquivos', *result)
+        except Exception:
+            logger.exception('Erro na migração de pastas de imagens')
+
+    threading.Thread(target=run, name='storage-migration', daemon=True).start()
+    return stop_event
@@ -0,0 +1,76 @@
+"""
+Fixtures dos testes: cada sessão cria um banco descartável no servidor configurado
+(DB_HOST, DB_PORT, DB_USER, DB_PASSWORD), aplica Database/init_novo.sql e o apaga no
+final. Sem servidor acessível, os testes que precisam do banco são ignorados.
+"""
+import os
+import sys
+import uuid
+
+import psycopg2
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from main import create_app, load_config, shutdown_app  # noqa: E402
+
+SCHEMA_SQL = os.path.join(BACKEND_DIR, '..', 'Database', 'init_novo.sql')
+
+
+def _admin_connection(db_config):
+    conn = psycopg2.connect(**{**db_config, 'dbname': 'postgres'})
+    conn.autocommit = True
+    return conn
+
+
+@pytest.fixture(scope='session')
+def db_config():
+    base = load_config()['DB_CONFIG']
+    try:
+        admin = _admin_connection(base)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'PostgreSQL indisponível: {e}')
+    config = {**base, 'dbname': f'clinica_test_{uuid.uuid4().hex[:8]}'}
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE {config['dbname']}")
+    try:
+        conn = psycopg2.connect(**config)
+        with conn, conn.cursor() as cursor, open(SCHEMA_SQL, encoding='utf-8') as f:
+            cursor.execute(f.read())
+        conn.close()
+        yield config
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {config['dbname']} WITH (FORCE)")
+        admin.close()
+
+
+@pytest.fixture
+def app(db_config, tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DB_CONFIG': db_config,
+        'CACHE_OPTIONS': {'backend': 'none'},
+        'IMAGE_STORAGE_MIGRATION': False,
+        'IMAGE_BASE_FOLDER': str(tmp_path / 'images'),
+    })
+    yield app
+    shutdown_app(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def conn(db_config):
+    """Conexão direta para preparar e conferir dados; apaga os pacientes no final."""
+    conn = psycopg2.connect(**db_config)
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM paciente")
+    conn.commit()
+    conn.close()
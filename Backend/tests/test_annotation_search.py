@@ -0,0 +1,36 @@
+CPF = '12345678901'
+
+
+def test_busca_por_radical_com_nome_do_paciente(client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')
+        """, (CPF,))
+        cursor.execute("""
+            INSERT INTO informacao_tratamentos (id_paciente, epoch_criacao, numero_dente, data, anotacao, face_dente)
+            VALUES (%s, 1, 11, '2024-03-01', 'Endodontia concluída', 'M, D'),
+                   (%s, 2, 12, '2024-03-02', 'Limpeza', 'V')
+        """, (CPF, CPF))
+    conn.commit()
+
+    response = client.get('/anotacoes/busca?q=endodontias')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [(r['cpf'], r['nome'], r['tooth']) for r in body['resultados']] == [(CPF, 'Ana', 11)]
+    assert body['next_offset'] is None
+
+
+def test_busca_filtra_por_face(client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')
+        """, (CPF,))
+        cursor.execute("""
+            INSERT INTO informacao_tratamentos (id_paciente, epoch_criacao, numero_dente, data, anotacao, face_dente)
+            VALUES (%s, 1, 11, '2024-03-01', 'Restauração em resina', 'M, D')
+        """, (CPF,))
+    conn.commit()
+
+    assert len(client.get('/anotacoes/busca?q=resina&face=d').get_json()['resultados']) == 1
+    assert client.get('/anotacoes/busca?q=resina&face=V').get_json()['resultados'] == []
@@ -0,0 +1,109 @@
+from datetime import date
+from decimal import Decimal
+
+import budget_summary
+
+CPF = '12345678901'
+
+# Totais recalculados das tabelas de origem, lado a lado com orcamento_resumo
+_COMPARE = """
+    SELECT o.id, r.total_itens, r.quantidade_itens, r.total_pago, r.ultimo_pagamento,
+           (SELECT COALESCE(SUM(preco), 0) FROM orcamento_itens WHERE id_orcamento = o.id),
+           (SELECT COUNT(*)::int FROM orcamento_itens WHERE id_orcamento = o.id),
+           (SELECT COALESCE(SUM(valor_parcela), 0) FROM pagamentos WHERE id_orcamento = o.id),
+           (SELECT MAX(data_pagamento) FROM pagamentos WHERE id_orcamento = o.id)
+    FROM orcamentos o
+    LEFT JOIN orcamento_resumo r ON r.id_orcamento = o.id
+    ORDER BY o.id
+"""
+
+
+def _assert_summary_matches(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(_COMPARE)
+        rows = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM orcamento_resumo WHERE id_orcamento NOT IN (SELECT id FROM orcamentos)")
+        orphans = cursor.fetchone()[0]
+    conn.commit()
+    for orcamento_id, *values in rows:
+        stored, expected = values[:4], values[4:]
+        assert stored == expected, f'orçamento {orcamento_id}: {stored} != {expected}'
+    assert orphans == 0
+    assert budget_summary.check(conn) == []
+
+
+def test_triggers_mantem_resumo_igual_as_somas(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+        cursor.execute("""
+            INSERT INTO orcamentos (id_paciente, data_orcamento)
+            VALUES (%s, '2024-01-10'), (%s, '2024-03-01') RETURNING id
+        """, (CPF, CPF))
+        first, second = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    _assert_summary_matches(conn)
+
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO orcamento_itens (id_orcamento, data_item, preco)
+            VALUES (%(a)s, '2024-01-10', 300.50), (%(a)s, '2024-01-10', 99.50), (%(b)s, '2024-03-01', 50)
+            RETURNING id
+        """, {'a': first, 'b': second})
+        item_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            INSERT INTO pagamentos (id_orcamento, data_pagamento, valor_parcela)
+            VALUES (%(a)s, '2024-02-01', 100), (%(a)s, '2024-03-01', 50), (%(b)s, '2024-03-05', 20)
+            RETURNING id
+        """, {'a': first, 'b': second})
+        payment_ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    _assert_summary_matches(conn)
+
+    # Atualizações: preço, valor e data, e mudança de orçamento
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE orcamento_itens SET preco = 250 WHERE id = %s", (item_ids[0],))
+        cursor.execute("UPDATE orcamento_itens SET id_orcamento = %s WHERE id = %s", (second, item_ids[1]))
+        cursor.execute("UPDATE pagamentos SET valor_parcela = 75, data_pagamento = '2024-04-01' WHERE id = %s",
+                       (payment_ids[0],))
+        cursor.execute("UPDATE pagamentos SET id_orcamento = %s WHERE id = %s", (second, payment_ids[1]))
+    conn.commit()
+    _assert_summary_matches(conn)
+
+    # Exclusões: o último pagamento sai e ultimo_pagamento volta para o anterior
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM pagamentos WHERE id = %s", (payment_ids[0],))
+        cursor.execute("DELETE FROM orcamento_itens WHERE id = %s", (item_ids[2],))
+    conn.commit()
+    _assert_summary_matches(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT total_itens, total_pago, ultimo_pagamento FROM orcamento_resumo WHERE id_orcamento = %s",
+                       (second,))
+        assert cursor.fetchone() == (Decimal('99.50'), Decimal('70.00'), date(2024, 3, 5))
+    conn.commit()
+
+    # Orçamento apagado (itens e pagamentos em cascata) não deixa resumo para trás
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM orcamentos WHERE id = %s", (second,))
+    conn.commit()
+    _assert_summary_matches(conn)
+
+
+def test_listagem_usa_resumo(client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+        cursor.execute("INSERT INTO orcamentos (id_paciente, data_orcamento) VALUES (%s, '2024-01-10') RETURNING id",
+                       (CPF,))
+        orcamento_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO orcamento_itens (id_orcamento, data_item, preco) VALUES (%s, '2024-01-10', 300)",
+                       (orcamento_id,))
+        cursor.execute("""
+            INSERT INTO pagamentos (id_orcamento, data_pagamento, valor_parcela) VALUES (%s, '2024-02-01', 120)
+        """, (orcamento_id,))
+        cursor.execute("UPDATE pagamentos SET valor_parcela = 100 WHERE id_orcamento = %s", (orcamento_id,))
+    conn.commit()
+
+    [orcamento] = client.get(f'/paciente/{CPF}/orcamentos').get_json()
+
+    assert (orcamento['total'], orcamento['pago'], orcamento['saldo']) == (300.0, 100.0, 200.0)
@@ -0,0 +1,29 @@
+import db
+from main import create_app, shutdown_app
+
+
+def _create_app(db_config, tmp_path):
+    return create_app({
+        'TESTING': True,
+        'DB_CONFIG': db_config,
+        'CACHE_OPTIONS': {'backend': 'none'},
+        'IMAGE_STORAGE_MIGRATION': False,
+        'IMAGE_BASE_FOLDER': str(tmp_path / 'images'),
+    })
+
+
+def test_observers_sao_da_aplicacao(db_config, tmp_path):
+    first, second = _create_app(db_config, tmp_path), _create_app(db_config, tmp_path)
+    seen = []
+    db.add_query_observer(first, lambda cursor, query, vars, duration, error: seen.append(query))
+    try:
+        assert second.test_client().get('/pacientes').status_code == 200
+        assert seen == []
+        assert first.test_client().get('/pacientes').status_code == 200
+        assert seen
+    finally:
+        shutdown_app(first)
+        shutdown_app(second)
+
+    assert first.extensions['db_query_observers'] == []
+    assert second.extensions['db_query_observers'] == []
@@ -0,0 +1,95 @@
+import base64
+import os
+
+import pytest
+
+import image_index
+import thumbnails
+
+CPF = '12345678901'
+TIMESTAMP = '2025-02-28T16:26:29.545Z'
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+def _image_count(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM imagens WHERE id_paciente = %s", (CPF,))
+        count = cursor.fetchone()[0]
+    conn.rollback()
+    return count
+
+
+def test_salva_e_apaga_imagem(app, client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+    conn.commit()
+
+    response = client.post('/save_image', json={
+        'cpf': CPF, 'timestamp': TIMESTAMP,
+        'image': 'data:image/png;base64,' + base64.b64encode(PNG).decode(),
+    })
+    assert response.status_code == 200
+    filepath = os.path.join(app.config['IMAGE_BASE_FOLDER'], image_index.patient_dir(CPF),
+                            response.get_json()['filename'])
+    assert os.path.isfile(filepath)
+    assert _image_count(conn) == 1
+
+    response = client.delete('/delete_image', query_string={'cpf': CPF, 'timestamp_iso': TIMESTAMP})
+    assert response.status_code == 200
+    assert not os.path.exists(filepath)
+    assert os.listdir(os.path.dirname(filepath)) == []
+    assert _image_count(conn) == 0
+
+
+def test_paciente_ou_imagem_inexistente(client):
+    image = 'data:image/png;base64,' + base64.b64encode(PNG).decode()
+    assert client.post('/save_image', json={'cpf': CPF, 'image': image}).status_code == 404
+    assert client.put('/update_image', json={
+        'cpf': CPF, 'image': image, 'timestamp_iso': TIMESTAMP}).status_code == 404
+    assert client.delete('/delete_image', query_string={
+        'cpf': CPF, 'timestamp_iso': TIMESTAMP}).status_code == 404
+
+
+class _FailingCommit:
+    """Conexão cujo commit falha, para conferir o que fica no disco."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return self.conn.cursor(*args, **kwargs)
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def commit(self):
+        raise RuntimeError('commit falhou')
+
+
+def test_commit_com_erro_preserva_arquivo(app, conn):
+    from main import store_image
+
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+    conn.commit()
+    raw = TIMESTAMP.replace(':', '-')
+    relative_path = os.path.join(image_index.patient_dir(CPF), f'{raw}.png')
+    filepath = os.path.join(app.config['IMAGE_BASE_FOLDER'], relative_path)
+    write = lambda content: (lambda f: f.write(content))
+
+    with app.app_context():
+        # Gravação nova: nenhum arquivo sem linha em `imagens`
+        with pytest.raises(RuntimeError):
+            store_image(_FailingCommit(conn), CPF, raw, relative_path, write(PNG))
+        assert os.listdir(os.path.dirname(filepath)) == []
+
+        # Atualização: o arquivo anterior continua lá
+        store_image(conn, CPF, raw, relative_path, write(PNG))
+        with pytest.raises(RuntimeError):
+            store_image(_FailingCommit(conn), CPF, raw, relative_path, write(PNG + b'novo'))
+        with open(filepath, 'rb') as f:
+            assert f.read() == PNG
+        names = [name for name in os.listdir(os.path.dirname(filepath)) if not thumbnails.is_thumbnail(name)]
+        assert names == [f'{raw}.png']
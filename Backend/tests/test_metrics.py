@@ -0,0 +1,12 @@
+def test_metrics_exige_admin_token(client, monkeypatch):
+    monkeypatch.delenv('ADMIN_TOKEN', raising=False)
+    assert client.get('/metrics').status_code == 404
+
+    monkeypatch.setenv('ADMIN_TOKEN', 'segredo')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'X-Admin-Token': 'errado'}).status_code == 401
+
+    for headers in ({'X-Admin-Token': 'segredo'}, {'Authorization': 'Bearer segredo'}):
+        response = client.get('/metrics', headers=headers)
+        assert response.status_code == 200
+        assert 'http_requests_total' in response.get_data(as_text=True)
@@ -0,0 +1,46 @@
+import io
+
+CSV_OK = 'cpf,nome,data_nascimento\n123.456.789-01,Ana,01/02/1990\n999,Bruno,1985-05-05\n'
+
+
+def test_importa_csv_e_relata_linhas_invalidas(client, conn):
+    response = client.post('/pacientes/import?format=csv', data=CSV_OK.encode('utf-8'))
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['inserted'], body['invalid']) == (1, 1)
+    assert body['errors'] == [{'linha': 3, 'cpf': '999', 'erro': 'CPF inválido'}]
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT nome, data_nascimento::text FROM paciente WHERE cpf = '12345678901'")
+        assert cursor.fetchone() == ('Ana', '1990-02-01')
+
+
+def test_csv_sem_colunas_obrigatorias_responde_400(client, conn):
+    response = client.post('/pacientes/import?format=csv', data=b'cpf,telefone\n12345678901,1199\n')
+
+    assert response.status_code == 400
+    assert 'nome' in response.get_json()['error']
+    assert 'data_nascimento' in response.get_json()['error']
+
+
+def test_utf8_invalido_no_meio_do_arquivo_responde_400(client, conn):
+    # Bem depois do primeiro bloco lido pelo TextIOWrapper: o erro só aparece durante o COPY
+    linhas = ''.join(f'{i:011d},Paciente {i},1990-01-01\n' for i in range(1, 2001))
+    body = ('cpf,nome,data_nascimento\n' + linhas).encode('utf-8') + b'12345678902,Jo\xe3o,1990-01-01\n'
+    response = client.post('/pacientes/import?format=csv', data=body)
+
+    assert response.status_code == 400
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM paciente")
+        assert cursor.fetchone()[0] == 0
+
+
+def test_cli_csv_sem_colunas_obrigatorias(app, tmp_path):
+    path = tmp_path / 'pacientes.csv'
+    path.write_text('cpf,telefone\n12345678901,1199\n', encoding='utf-8')
+
+    result = app.test_cli_runner().invoke(args=['import-patients', str(path)])
+
+    assert result.exit_code == 1
+    assert 'Colunas obrigatórias ausentes' in result.output
+    assert result.exception is None or isinstance(result.exception, SystemExit)
@@ -0,0 +1,52 @@
+import pytest
+
+import async_db
+
+CPF = '12345678901'
+
+
+@pytest.mark.skipif(not async_db.available(), reason='asyncpg não está instalado')
+def test_resumo_soma_orcamentos(client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')
+        """, (CPF,))
+        cursor.execute("""
+            INSERT INTO orcamentos (id_paciente, data_orcamento) VALUES (%s, '2024-01-10') RETURNING id
+        """, (CPF,))
+        orcamento_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO orcamento_itens (id_orcamento, data_item, preco) VALUES (%s, '2024-01-10', 300.50)
+        """, (orcamento_id,))
+        cursor.execute("""
+            INSERT INTO pagamentos (id_orcamento, data_pagamento, valor_parcela) VALUES (%s, '2024-02-01', 100)
+        """, (orcamento_id,))
+    conn.commit()
+
+    response = client.get(f'/paciente/{CPF}/resumo')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['paciente']['cpf'] == CPF
+    assert body['orcamentos'] == [{
+        'id': orcamento_id, 'data_orcamento': '2024-01-10', 'quantidade_itens': 1,
+        'total': 300.5, 'pago': 100.0, 'saldo': 200.5,
+    }]
+
+
+@pytest.mark.skipif(not async_db.available(), reason='asyncpg não está instalado')
+def test_resumo_paciente_inexistente(client):
+    assert client.get('/paciente/00000000000/resumo').status_code == 404
+
+
+@pytest.mark.skipif(not async_db.available(), reason='asyncpg não está instalado')
+def test_resumo_aceita_cpf_formatado(client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+    conn.commit()
+
+    response = client.get('/paciente/123.456.789-01/resumo')
+
+    assert response.status_code == 200
+    assert response.get_json()['paciente']['cpf'] == CPF
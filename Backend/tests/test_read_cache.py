@@ -0,0 +1,76 @@
+import pytest
+
+from main import create_app, shutdown_app
+from read_cache import LocalBackend
+
+CPF = '12345678901'
+
+
+@pytest.fixture
+def make_app(db_config, tmp_path):
+    """Cria apps com cache local, como workers diferentes do gunicorn."""
+    apps = []
+
+    def factory():
+        app = create_app({
+            'TESTING': True,
+            'DB_CONFIG': db_config,
+            'CACHE_OPTIONS': {'backend': 'local', 'max_entries': 16, 'ttl': 60},
+            'IMAGE_STORAGE_MIGRATION': False,
+            'IMAGE_BASE_FOLDER': str(tmp_path / 'images'),
+        })
+        apps.append(app)
+        return app.test_client()
+
+    yield factory
+    for app in apps:
+        shutdown_app(app)
+
+
+def _update_name(client, name):
+    response = client.put(f'/pacientes/{CPF}', json={'nome': name, 'dataNascimento': '1990-01-01'})
+    assert response.status_code == 200
+
+
+def test_escrita_nunca_serve_corpo_antigo(make_app, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+    conn.commit()
+    worker_a, worker_b = make_app(), make_app()
+
+    assert worker_a.get(f'/paciente/{CPF}').headers['X-Cache'] == 'MISS'
+    cached = worker_a.get(f'/paciente/{CPF}')
+    assert cached.headers['X-Cache'] == 'HIT'
+    assert cached.get_json()['name'] == 'Ana'
+
+    # Escrita no mesmo worker
+    _update_name(worker_a, 'Bia')
+    response = worker_a.get(f'/paciente/{CPF}')
+    assert response.get_json()['name'] == 'Bia'
+    assert worker_a.get(f'/paciente/{CPF}').headers['X-Cache'] == 'HIT'
+
+    # Escrita em outro worker: o cache local de A não foi invalidado
+    _update_name(worker_b, 'Carla')
+    response = worker_a.get(f'/paciente/{CPF}')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['name'] == 'Carla'
+
+    # Com o ETag novo, 304; com o antigo, o corpo novo
+    _update_name(worker_b, 'Dora')
+    etag = worker_b.get(f'/paciente/{CPF}').headers['ETag']
+    assert worker_a.get(f'/paciente/{CPF}', headers={'If-None-Match': etag}).status_code == 304
+    response = worker_a.get(f'/paciente/{CPF}', headers={'If-None-Match': cached.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Dora'
+
+
+def test_geracoes_limitadas_nao_voltam_atras():
+    backend = LocalBackend(max_entries=2)
+    backend.bump(['a'])
+    [generation] = backend.generations(['a'])
+    backend.bump(['b', 'c', 'd'])
+
+    assert len(backend._generations) == 2
+    assert backend.generations(['a'])[0] >= generation
+    assert backend.generations(['novo'])[0] >= generation
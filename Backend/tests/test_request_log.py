@@ -0,0 +1,32 @@
+import logging
+
+import request_log
+from main import create_app, shutdown_app
+
+
+def _create_app(db_config, tmp_path):
+    return create_app({
+        'TESTING': True,
+        'DB_CONFIG': db_config,
+        'CACHE_OPTIONS': {'backend': 'none'},
+        'IMAGE_STORAGE_MIGRATION': False,
+        'IMAGE_BASE_FOLDER': str(tmp_path / 'images'),
+    })
+
+
+def test_listener_unico_e_parado_no_shutdown(db_config, tmp_path):
+    first, second = _create_app(db_config, tmp_path), _create_app(db_config, tmp_path)
+    listener = first.extensions['request_log_listener']
+    try:
+        assert second.extensions['request_log_listener'] is listener
+        assert len(logging.getLogger('clinica').handlers) == 1
+    finally:
+        shutdown_app(first)
+    # A outra aplicação continua registrando
+    assert listener._thread is not None
+    assert len(logging.getLogger('clinica').handlers) == 1
+
+    shutdown_app(second)
+    assert listener._thread is None
+    assert logging.getLogger('clinica').handlers == []
+    assert request_log._installed is None
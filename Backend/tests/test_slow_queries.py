@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from slow_queries import to_prepared
+
+CPF = '12345678901'
+
+
+def test_to_prepared_numera_marcadores():
+    assert to_prepared("SELECT %s, %s WHERE a LIKE 'x%%'", (1, 2)) == (
+        "SELECT $1, $2 WHERE a LIKE 'x%'", [1, 2])
+    assert to_prepared("SELECT %(a)s, %(b)s, %(a)s", {'a': 1, 'b': 2}) == ("SELECT $1, $2, $1", [1, 2])
+    assert to_prepared("SELECT 5 % 2", None) == ("SELECT 5 % 2", [])
+
+
+@pytest.fixture
+def slow_env(monkeypatch):
+    # Toda consulta é lenta e todas ganham EXPLAIN
+    monkeypatch.setenv('SLOW_QUERY_MS', '0.000001')
+    monkeypatch.setenv('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', '1')
+    monkeypatch.delenv('ADMIN_TOKEN', raising=False)
+    return monkeypatch
+
+
+def _wait_for_plan(app, sql_fragment):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        for entry in app.extensions['slow_query_log'].entries():
+            if sql_fragment in entry['sql'] and (entry['plan'] or entry['explain_error']):
+                return entry
+        time.sleep(0.05)
+    raise AssertionError('EXPLAIN não terminou')
+
+
+def test_plano_nao_expoe_parametros(slow_env, app, client, conn):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+    conn.commit()
+
+    assert client.get(f'/pacientes/{CPF}').status_code == 200
+    entry = _wait_for_plan(app, 'FROM paciente WHERE cpf')
+
+    assert entry['explain_error'] is None
+    assert '$1' in entry['plan']
+    assert CPF not in entry['plan']
+
+    assert client.get('/admin/slow-queries').status_code == 404
+    slow_env.setenv('ADMIN_TOKEN', 'segredo')
+    assert client.get('/admin/slow-queries').status_code == 401
+    response = client.get('/admin/slow-queries', headers={'X-Admin-Token': 'segredo'})
+    assert response.status_code == 200
+    assert CPF not in response.get_data(as_text=True)
@@ -0,0 +1,47 @@
+import os
+
+import db
+import image_index
+from main import create_app, shutdown_app
+
+CPF = '12345678901'
+RAW = '2025-02-28T16-26-29.545Z'
+
+
+def test_migracao_nao_usa_o_pool(db_config, conn, tmp_path):
+    base_folder = tmp_path / 'images'
+    legacy = base_folder / f'Ana - {CPF}'
+    legacy.mkdir(parents=True)
+    (legacy / f'{RAW}.png').write_bytes(b'png')
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO paciente (cpf, nome, data_nascimento) VALUES (%s, 'Ana', '1990-01-01')",
+                       (CPF,))
+        cursor.execute("""
+            INSERT INTO imagens (id_paciente, epoch_insercao, caminho_arquivo) VALUES (%s, %s, %s)
+        """, (CPF, image_index.image_epoch_ms(RAW), os.path.join(legacy.name, f'{RAW}.png')))
+    conn.commit()
+
+    app = create_app({
+        'TESTING': True,
+        'DB_CONFIG': db_config,
+        'DB_POOL_OPTIONS': {'minconn': 1, 'maxconn': 1, 'timeout': 1},
+        'CACHE_OPTIONS': {'backend': 'none'},
+        'IMAGE_STORAGE_MIGRATION': False,
+        'IMAGE_BASE_FOLDER': str(base_folder),
+    })
+    try:
+        # Com o único slot do pool ocupado a migração ainda precisa terminar
+        with app.app_context(), db.get_pool(app).connection():
+            result = app.test_cli_runner().invoke(args=['migrate-image-storage'])
+    finally:
+        shutdown_app(app)
+
+    assert result.exit_code == 0, result.output
+    assert 'Pastas migradas: 1  Arquivos: 1' in result.output
+    target = os.path.join(image_index.patient_dir(CPF), f'{RAW}.png')
+    assert (base_folder / target).is_file()
+    assert not legacy.exists()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT caminho_arquivo FROM imagens WHERE id_paciente = %s", (CPF,))
+        assert cursor.fetchone()[0] == target
+    conn.rollback()
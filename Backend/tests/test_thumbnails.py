@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+
+import pytest
+
+import thumbnails
+
+pytestmark = pytest.mark.skipif(not thumbnails.available(), reason='Pillow não está instalado')
+
+
+def _wait_failed(future):
+    """Espera a falha e o callback que a registra (roda depois de result() acordar)."""
+    with pytest.raises(Exception):
+        future.result(5)
+    deadline = time.monotonic() + 5
+    while thumbnails._in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_nao_reagenda_imagem_na_fila(tmp_path, monkeypatch):
+    filepath = str(tmp_path / '2025-02-28T16-26-29.545Z.png')
+    open(filepath, 'wb').close()
+    release = threading.Event()
+    calls = []
+
+    def slow_generate(path):
+        calls.append(path)
+        release.wait(5)
+
+    monkeypatch.setattr(thumbnails, 'generate_thumbnail', slow_generate)
+    first = thumbnails.schedule(filepath)
+    assert thumbnails.schedule(filepath) is first
+    release.set()
+    first.result(5)
+    assert calls == [filepath]
+
+
+def test_nao_reagenda_imagem_que_falhou(tmp_path):
+    filepath = str(tmp_path / '2025-02-28T16-26-29.545Z.png')
+    with open(filepath, 'wb') as f:
+        f.write(b'nao e png')
+
+    _wait_failed(thumbnails.schedule(filepath))
+    assert thumbnails.schedule(filepath) is None
+
+    # Arquivo regravado: nova tentativa
+    stat = os.stat(filepath)
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    retry = thumbnails.schedule(filepath)
+    assert retry is not None
+    _wait_failed(retry)
@@ -0,0 +1,154 @@
+"""
+Miniaturas das imagens de odontograma.
+
+Cada imagem "{timestamp}.png" ganha uma miniatura "{timestamp}.thumb.png" na
+mesma pasta. A geração roda em um pool de threads para não bloquear a
+requisição que salvou a imagem. Pillow é opcional: sem ele, nenhuma
+miniatura é gerada e quem serve as imagens cai para o arquivo original.
+
+`schedule` não enfileira de novo uma imagem que já está na fila nem uma que já
+falhou: ambas são identificadas por (caminho, mtime), então regravar o arquivo
+libera uma nova tentativa.
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - depende do ambiente
+    Image = None
+
+logger = logging.getLogger('clinica.thumbnails')
+
+THUMB_SUFFIX = '.thumb.png'
+THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE', 320))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+# Quantas falhas são lembradas (as mais antigas são esquecidas e podem ser tentadas de novo)
+MAX_REMEMBERED_FAILURES = 10000
+
+_executor = None
+_lock = threading.Lock()
+_in_flight = {}                 # (caminho, mtime) -> future
+_failed = OrderedDict()         # (caminho, mtime) das imagens que não puderam ser lidas
+
+
+def available():
+    return Image is not None
+
+
+def is_thumbnail(filename):
+    return filename.endswith(THUMB_SUFFIX)
+
+
+def thumbnail_path(filepath):
+    """Caminho da miniatura de um arquivo "{timestamp}.png"."""
+    return filepath[:-len('.png')] + THUMB_SUFFIX
+
+
+def generate_thumbnail(filepath):
+    """Gera (ou regenera) a miniatura de `filepath`. Retorna o caminho dela."""
+    if Image is None:
+        raise RuntimeError('Pillow não está instalado')
+    target = thumbnail_path(filepath)
+    tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        with Image.open(filepath) as image:
+            image.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+            image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+    return _executor
+
+
+def _finish(key, future):
+    error = future.exception()
+    with _lock:
+        _in_flight.pop(key, None)
+        if error is not None:
+            _failed[key] = True
+            while len(_failed) > MAX_REMEMBERED_FAILURES:
+                _failed.popitem(last=False)
+    if error is not None:
+        logger.error('Erro ao gerar miniatura', exc_info=error)
+
+
+def schedule(filepath):
+    """
+    Agenda a geração da miniatura em segundo plano (no-op sem Pillow). Retorna o
+    future, o já agendado para a mesma versão do arquivo, ou None se ela já falhou.
+    """
+    if Image is None:
+        return None
+    try:
+        key = (filepath, os.stat(filepath).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if key in _failed:
+            return None
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        future = _get_executor().submit(generate_thumbnail, filepath)
+        _in_flight[key] = future
+    future.add_done_callback(lambda done: _finish(key, done))
+    return future
+
+
+def shutdown(wait=True):
+    """Encerra o pool de threads, esperando as miniaturas já agendadas."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def remove(filepath):
+    try:
+        os.remove(thumbnail_path(filepath))
+    except FileNotFoundError:
+        pass
+
+
+def iter_originals(base_folder):
+    """Todas as imagens originais sob `base_folder`."""
+    for root, _, files in os.walk(base_folder):
+        for filename in files:
+            if filename.endswith('.png') and not is_thumbnail(filename):
+                yield os.path.join(root, filename)
+
+
+def generate_all(base_folder, force=False, workers=None):
+    """
+    Gera as miniaturas que faltam (ou todas, com `force`) usando o pool de threads.
+    Retorna (geradas, com erro).
+    """
+    if Image is None:
+        raise RuntimeError('Pillow não está instalado')
+    pending = [
+        filepath for filepath in iter_originals(base_folder)
+        if force or not os.path.exists(thumbnail_path(filepath))
+    ]
+    generated = failed = 0
+    with ThreadPoolExecutor(max_workers=workers or THUMBNAIL_WORKERS) as executor:
+        futures = [executor.submit(generate_thumbnail, filepath) for filepath in pending]
+        for future in futures:
+            if future.exception() is None:
+                generated += 1
+            else:
+                failed += 1
+                logger.error('Erro ao gerar miniatura', exc_info=future.exception())
+    return generated, failed
@@ -10,6 +10,9 @@ CREATE TABLE IF NOT EXISTS paciente (
     convenio VARCHAR(50)
 );
 
+-- Índice para a paginação por (nome, cpf) da listagem de pacientes
+CREATE INDEX IF NOT EXISTS idx_paciente_nome_cpf ON paciente (nome, cpf);
+
 -- ===============================
 -- TABELA INFORMACAO_TRATAMENTOS
 -- ===============================
@@ -20,10 +23,21 @@ CREATE TABLE IF NOT EXISTS informacao_tratamentos (
     data DATE NOT NULL,
     anotacao TEXT,
     face_dente VARCHAR(50) DEFAULT 'Não se aplica',
+    -- Mantida pelo trigger informacao_tratamentos_tsv_trg (busca textual)
+    anotacao_tsv TSVECTOR,
     PRIMARY KEY (id_paciente, epoch_criacao),
     FOREIGN KEY (id_paciente) REFERENCES paciente (cpf) ON DELETE CASCADE
 );
 
+-- Anotações do paciente ordenadas por data (GET /paciente/<cpf>)
+CREATE INDEX IF NOT EXISTS idx_informacao_tratamentos_paciente_data
+    ON informacao_tratamentos (id_paciente, data DESC);
+
+-- Estado do odontograma (GET /paciente/<cpf>/odontograma): filtra as linhas do paciente;
+-- a ordenação por (dente, face, data) ainda é feita sobre as faces expandidas
+CREATE INDEX IF NOT EXISTS idx_informacao_tratamentos_odontograma
+    ON informacao_tratamentos (id_paciente, numero_dente, data DESC, epoch_criacao DESC);
+
 -- ===============================
 -- TABELA IMAGENS
 -- ===============================
@@ -32,6 +46,9 @@ CREATE TABLE IF NOT EXISTS imagens (
     epoch_insercao BIGINT NOT NULL,
     tipo_imagem VARCHAR(20),
     caminho_arquivo TEXT NOT NULL,
+    tamanho_bytes BIGINT,
+    largura INT,
+    altura INT,
     PRIMARY KEY (id_paciente, epoch_insercao),
     FOREIGN KEY (id_paciente) REFERENCES paciente (cpf) ON DELETE CASCADE
 );
@@ -46,6 +63,11 @@ CREATE TABLE IF NOT EXISTS orcamentos (
     FOREIGN KEY (id_paciente) REFERENCES paciente (cpf) ON DELETE CASCADE
 );
 
+-- Orçamentos do paciente na ordem da listagem e filtro por data do relatório de recebíveis
+CREATE INDEX IF NOT EXISTS idx_orcamentos_paciente_data
+    ON orcamentos (id_paciente, data_orcamento DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orcamentos_data ON orcamentos (data_orcamento);
+
 -- ===============================
 -- TABELA ORCAMENTO_ITENS
 -- ===============================
@@ -58,6 +80,9 @@ CREATE TABLE IF NOT EXISTS orcamento_itens (
     FOREIGN KEY (id_orcamento) REFERENCES orcamentos (id) ON DELETE CASCADE
 );
 
+-- Itens de um conjunto de orçamentos (id_orcamento = ANY(...)) e exclusão em cascata
+CREATE INDEX IF NOT EXISTS idx_orcamento_itens_orcamento ON orcamento_itens (id_orcamento, id);
+
 -- ===============================
 -- TABELA PAGAMENTOS
 -- ===============================
@@ -69,3 +94,203 @@ CREATE TABLE IF NOT EXISTS pagamentos (
     meio_pagamento VARCHAR(50),
     FOREIGN KEY (id_orcamento) REFERENCES orcamentos (id) ON DELETE CASCADE
 );
+
+-- Pagamentos de um orçamento, do mais recente ao mais antigo
+CREATE INDEX IF NOT EXISTS idx_pagamentos_orcamento_data
+    ON pagamentos (id_orcamento, data_pagamento DESC);
+
+-- ===============================
+-- VERSÃO DOS DADOS DO PACIENTE
+-- ===============================
+-- Incrementada por triggers a cada alteração no paciente, nas anotações, orçamentos,
+-- itens e pagamentos. O backend usa a versão como ETag das leituras do paciente.
+-- Os valores vêm de uma sequência global: um paciente apagado e recadastrado nunca
+-- repete uma versão antiga.
+CREATE SEQUENCE IF NOT EXISTS paciente_versao_seq;
+
+CREATE TABLE IF NOT EXISTS paciente_versao (
+    id_paciente VARCHAR(11) PRIMARY KEY,
+    versao BIGINT NOT NULL,
+    FOREIGN KEY (id_paciente) REFERENCES paciente (cpf) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION incrementa_versao_paciente(p_cpf VARCHAR) RETURNS void AS $$
+BEGIN
+    -- O paciente pode já ter sido apagado (exclusão em cascata dos orçamentos/anotações)
+    INSERT INTO paciente_versao (id_paciente, versao)
+    SELECT p_cpf, nextval('paciente_versao_seq')
+    WHERE EXISTS (SELECT 1 FROM paciente WHERE cpf = p_cpf)
+    ON CONFLICT (id_paciente) DO UPDATE SET versao = EXCLUDED.versao;
+END;
+$$ LANGUAGE plpgsql;
+
+-- paciente: chave em cpf
+CREATE OR REPLACE FUNCTION versao_paciente_trg() RETURNS trigger AS $$
+BEGIN
+    PERFORM incrementa_versao_paciente(NEW.cpf);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- informacao_tratamentos e orcamentos: chave em id_paciente
+CREATE OR REPLACE FUNCTION versao_paciente_filho_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM incrementa_versao_paciente(OLD.id_paciente);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id_paciente IS DISTINCT FROM OLD.id_paciente) THEN
+        PERFORM incrementa_versao_paciente(NEW.id_paciente);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- orcamento_itens e pagamentos: paciente encontrado pelo orçamento
+CREATE OR REPLACE FUNCTION versao_paciente_orcamento_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM incrementa_versao_paciente(o.id_paciente) FROM orcamentos o WHERE o.id = OLD.id_orcamento;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id_orcamento IS DISTINCT FROM OLD.id_orcamento) THEN
+        PERFORM incrementa_versao_paciente(o.id_paciente) FROM orcamentos o WHERE o.id = NEW.id_orcamento;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER paciente_versao_trg
+    AFTER INSERT OR UPDATE ON paciente
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_trg();
+
+CREATE OR REPLACE TRIGGER informacao_tratamentos_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON informacao_tratamentos
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_filho_trg();
+
+CREATE OR REPLACE TRIGGER orcamentos_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON orcamentos
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_filho_trg();
+
+CREATE OR REPLACE TRIGGER orcamento_itens_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON orcamento_itens
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_orcamento_trg();
+
+CREATE OR REPLACE TRIGGER pagamentos_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON pagamentos
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_orcamento_trg();
+
+-- ===============================
+-- RESUMO DOS ORÇAMENTOS
+-- ===============================
+-- Total e quantidade de itens, total pago e data do último pagamento de cada orçamento,
+-- mantidos por triggers em orcamentos, orcamento_itens e pagamentos. As leituras de
+-- totais consultam uma linha por orçamento em vez de somar itens e pagamentos.
+-- As atualizações são incrementais (UPDATE ... SET total = total + delta): escritas
+-- concorrentes no mesmo orçamento esperam o lock da linha e nenhuma soma se perde.
+CREATE TABLE IF NOT EXISTS orcamento_resumo (
+    id_orcamento INT PRIMARY KEY,
+    total_itens NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    quantidade_itens INT NOT NULL DEFAULT 0,
+    total_pago NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    ultimo_pagamento DATE,
+    FOREIGN KEY (id_orcamento) REFERENCES orcamentos (id) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION orcamento_resumo_orcamento_trg() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO orcamento_resumo (id_orcamento) VALUES (NEW.id)
+    ON CONFLICT (id_orcamento) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orcamento_resumo_itens_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.id_orcamento = OLD.id_orcamento THEN
+        IF NEW.preco IS DISTINCT FROM OLD.preco THEN
+            UPDATE orcamento_resumo SET total_itens = total_itens + NEW.preco - OLD.preco
+            WHERE id_orcamento = NEW.id_orcamento;
+        END IF;
+        RETURN NULL;
+    END IF;
+    -- Na exclusão em cascata de um orçamento o resumo já pode ter sido apagado
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE orcamento_resumo
+        SET total_itens = total_itens - OLD.preco, quantidade_itens = quantidade_itens - 1
+        WHERE id_orcamento = OLD.id_orcamento;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO orcamento_resumo AS r (id_orcamento, total_itens, quantidade_itens)
+        VALUES (NEW.id_orcamento, NEW.preco, 1)
+        ON CONFLICT (id_orcamento) DO UPDATE
+        SET total_itens = r.total_itens + EXCLUDED.total_itens,
+            quantidade_itens = r.quantidade_itens + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orcamento_resumo_pagamentos_trg() RETURNS trigger AS $$
+BEGIN
+    -- Em triggers AFTER a consulta a pagamentos já enxerga a linha alterada/removida
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE orcamento_resumo
+        SET total_pago = total_pago - OLD.valor_parcela,
+            ultimo_pagamento = (SELECT max(data_pagamento) FROM pagamentos
+                                WHERE id_orcamento = OLD.id_orcamento)
+        WHERE id_orcamento = OLD.id_orcamento;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO orcamento_resumo AS r (id_orcamento, total_pago, ultimo_pagamento)
+        VALUES (NEW.id_orcamento, NEW.valor_parcela, NEW.data_pagamento)
+        ON CONFLICT (id_orcamento) DO UPDATE
+        SET total_pago = r.total_pago + EXCLUDED.total_pago,
+            ultimo_pagamento = GREATEST(r.ultimo_pagamento, EXCLUDED.ultimo_pagamento);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER orcamentos_resumo_trg
+    AFTER INSERT ON orcamentos
+    FOR EACH ROW EXECUTE FUNCTION orcamento_resumo_orcamento_trg();
+
+CREATE OR REPLACE TRIGGER orcamento_itens_resumo_trg
+    AFTER INSERT OR UPDATE OR DELETE ON orcamento_itens
+    FOR EACH ROW EXECUTE FUNCTION orcamento_resumo_itens_trg();
+
+CREATE OR REPLACE TRIGGER pagamentos_resumo_trg
+    AFTER INSERT OR UPDATE OR DELETE ON pagamentos
+    FOR EACH ROW EXECUTE FUNCTION orcamento_resumo_pagamentos_trg();
+
+-- ===============================
+-- BUSCA TEXTUAL NAS ANOTAÇÕES
+-- ===============================
+-- Configuração pt_unaccent: a portuguesa com os acentos removidos antes do stemming,
+-- então "restauracao" encontra "Restaurações" e "endodontia" encontra "endodôntia".
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese);
+        ALTER TEXT SEARCH CONFIGURATION pt_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+    END IF;
+END;
+$$;
+
+-- anotacao_tsv acompanha anotacao: recalculado por trigger em cada INSERT/UPDATE da anotação
+CREATE OR REPLACE FUNCTION anotacao_tsv_trg() RETURNS trigger AS $$
+BEGIN
+    NEW.anotacao_tsv := to_tsvector('pt_unaccent', coalesce(NEW.anotacao, ''));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER informacao_tratamentos_tsv_trg
+    BEFORE INSERT OR UPDATE OF anotacao ON informacao_tratamentos
+    FOR EACH ROW EXECUTE FUNCTION anotacao_tsv_trg();
+
+-- Busca por termos (anotacao_tsv @@ consulta)
+CREATE INDEX IF NOT EXISTS idx_informacao_tratamentos_tsv
+    ON informacao_tratamentos USING GIN (anotacao_tsv);
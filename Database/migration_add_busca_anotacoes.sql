@@ -0,0 +1,51 @@
+-- Migration para a busca textual nas anotações (GET /anotacoes/busca)
+-- Requer PostgreSQL 14+ e a extensão unaccent (incluída na imagem oficial do PostgreSQL)
+-- O preenchimento roda em uma transação, com o trigger de versão desligado: o conteúdo
+-- das anotações não muda, então as versões (ETags) dos pacientes não precisam mudar.
+-- O índice GIN é criado depois, com CONCURRENTLY, fora da transação.
+
+BEGIN;
+
+ALTER TABLE informacao_tratamentos ADD COLUMN IF NOT EXISTS anotacao_tsv TSVECTOR;
+
+-- ===============================
+-- BUSCA TEXTUAL NAS ANOTAÇÕES
+-- ===============================
+-- Configuração pt_unaccent: a portuguesa com os acentos removidos antes do stemming,
+-- então "restauracao" encontra "Restaurações" e "endodontia" encontra "endodôntia".
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese);
+        ALTER TEXT SEARCH CONFIGURATION pt_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+    END IF;
+END;
+$$;
+
+-- anotacao_tsv acompanha anotacao: recalculado por trigger em cada INSERT/UPDATE da anotação
+CREATE OR REPLACE FUNCTION anotacao_tsv_trg() RETURNS trigger AS $$
+BEGIN
+    NEW.anotacao_tsv := to_tsvector('pt_unaccent', coalesce(NEW.anotacao, ''));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER informacao_tratamentos_tsv_trg
+    BEFORE INSERT OR UPDATE OF anotacao ON informacao_tratamentos
+    FOR EACH ROW EXECUTE FUNCTION anotacao_tsv_trg();
+
+ALTER TABLE informacao_tratamentos DISABLE TRIGGER informacao_tratamentos_versao_trg;
+UPDATE informacao_tratamentos
+SET anotacao_tsv = to_tsvector('pt_unaccent', coalesce(anotacao, ''))
+WHERE anotacao_tsv IS NULL;
+ALTER TABLE informacao_tratamentos ENABLE TRIGGER informacao_tratamentos_versao_trg;
+
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informacao_tratamentos_tsv
+    ON informacao_tratamentos USING GIN (anotacao_tsv);
+
+ANALYZE informacao_tratamentos;
@@ -0,0 +1,11 @@
+-- Migration para indexar as imagens dos pacientes na tabela imagens
+-- O backend passa a listar e localizar imagens por esta tabela em vez de varrer as pastas.
+-- Depois de aplicar, preencha a tabela com: flask --app main reconcile-images
+
+-- Bancos criados com init.sql restringiam tipo_imagem a ('foto', 'rx', 'ficha')
+ALTER TABLE imagens DROP CONSTRAINT IF EXISTS imagens_tipo_imagem_check;
+
+-- Metadados usados pelo manifesto de imagens (evita abrir os arquivos)
+ALTER TABLE imagens ADD COLUMN IF NOT EXISTS tamanho_bytes BIGINT;
+ALTER TABLE imagens ADD COLUMN IF NOT EXISTS largura INT;
+ALTER TABLE imagens ADD COLUMN IF NOT EXISTS altura INT;
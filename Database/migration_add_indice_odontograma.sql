@@ -0,0 +1,8 @@
+-- Migration para o índice do estado do odontograma (GET /paciente/<cpf>/odontograma)
+-- Filtra as anotações do paciente para o estado do odontograma. As faces são expandidas
+-- com regexp_split_to_table, então o DISTINCT ON (dente, face) ainda ordena todas as
+-- linhas expandidas; o índice só mantém essa ordenação restrita a um paciente.
+-- CONCURRENTLY não pode rodar dentro de uma transação (execute o arquivo com psql, sem BEGIN).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informacao_tratamentos_odontograma
+    ON informacao_tratamentos (id_paciente, numero_dente, data DESC, epoch_criacao DESC);
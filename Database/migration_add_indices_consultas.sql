@@ -0,0 +1,23 @@
+-- Migration para os índices das consultas por paciente e por orçamento
+-- Sem eles, buscar anotações, orçamentos, itens e pagamentos de um paciente varre
+-- as tabelas inteiras. CONCURRENTLY não bloqueia escritas durante a criação, mas não
+-- pode rodar dentro de uma transação (execute o arquivo com psql, sem BEGIN).
+-- Se a criação de um índice for interrompida, ele fica inválido: apague-o com
+-- DROP INDEX e rode o arquivo de novo.
+-- Conferência dos planos: python Backend/check_query_plans.py
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informacao_tratamentos_paciente_data
+    ON informacao_tratamentos (id_paciente, data DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orcamentos_paciente_data
+    ON orcamentos (id_paciente, data_orcamento DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orcamentos_data ON orcamentos (data_orcamento);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orcamento_itens_orcamento
+    ON orcamento_itens (id_orcamento, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pagamentos_orcamento_data
+    ON pagamentos (id_orcamento, data_pagamento DESC);
+
+ANALYZE informacao_tratamentos, orcamentos, orcamento_itens, pagamentos;
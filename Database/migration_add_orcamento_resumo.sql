@@ -0,0 +1,100 @@
+-- Migration para a tabela orcamento_resumo (totais de itens e pagamentos por orçamento)
+-- Requer PostgreSQL 14+ (CREATE OR REPLACE TRIGGER)
+-- Roda em uma transação: os triggers bloqueiam escritas nas tabelas até o commit, então
+-- nenhuma alteração escapa entre a criação dos triggers e o preenchimento inicial.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS orcamento_resumo (
+    id_orcamento INT PRIMARY KEY,
+    total_itens NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    quantidade_itens INT NOT NULL DEFAULT 0,
+    total_pago NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    ultimo_pagamento DATE,
+    FOREIGN KEY (id_orcamento) REFERENCES orcamentos (id) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION orcamento_resumo_orcamento_trg() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO orcamento_resumo (id_orcamento) VALUES (NEW.id)
+    ON CONFLICT (id_orcamento) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orcamento_resumo_itens_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.id_orcamento = OLD.id_orcamento THEN
+        IF NEW.preco IS DISTINCT FROM OLD.preco THEN
+            UPDATE orcamento_resumo SET total_itens = total_itens + NEW.preco - OLD.preco
+            WHERE id_orcamento = NEW.id_orcamento;
+        END IF;
+        RETURN NULL;
+    END IF;
+    -- Na exclusão em cascata de um orçamento o resumo já pode ter sido apagado
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE orcamento_resumo
+        SET total_itens = total_itens - OLD.preco, quantidade_itens = quantidade_itens - 1
+        WHERE id_orcamento = OLD.id_orcamento;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO orcamento_resumo AS r (id_orcamento, total_itens, quantidade_itens)
+        VALUES (NEW.id_orcamento, NEW.preco, 1)
+        ON CONFLICT (id_orcamento) DO UPDATE
+        SET total_itens = r.total_itens + EXCLUDED.total_itens,
+            quantidade_itens = r.quantidade_itens + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orcamento_resumo_pagamentos_trg() RETURNS trigger AS $$
+BEGIN
+    -- Em triggers AFTER a consulta a pagamentos já enxerga a linha alterada/removida
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE orcamento_resumo
+        SET total_pago = total_pago - OLD.valor_parcela,
+            ultimo_pagamento = (SELECT max(data_pagamento) FROM pagamentos
+                                WHERE id_orcamento = OLD.id_orcamento)
+        WHERE id_orcamento = OLD.id_orcamento;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO orcamento_resumo AS r (id_orcamento, total_pago, ultimo_pagamento)
+        VALUES (NEW.id_orcamento, NEW.valor_parcela, NEW.data_pagamento)
+        ON CONFLICT (id_orcamento) DO UPDATE
+        SET total_pago = r.total_pago + EXCLUDED.total_pago,
+            ultimo_pagamento = GREATEST(r.ultimo_pagamento, EXCLUDED.ultimo_pagamento);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER orcamentos_resumo_trg
+    AFTER INSERT ON orcamentos
+    FOR EACH ROW EXECUTE FUNCTION orcamento_resumo_orcamento_trg();
+
+CREATE OR REPLACE TRIGGER orcamento_itens_resumo_trg
+    AFTER INSERT OR UPDATE OR DELETE ON orcamento_itens
+    FOR EACH ROW EXECUTE FUNCTION orcamento_resumo_itens_trg();
+
+CREATE OR REPLACE TRIGGER pagamentos_resumo_trg
+    AFTER INSERT OR UPDATE OR DELETE ON pagamentos
+    FOR EACH ROW EXECUTE FUNCTION orcamento_resumo_pagamentos_trg();
+
+-- Preenche o resumo dos orçamentos já existentes
+INSERT INTO orcamento_resumo (id_orcamento, total_itens, quantidade_itens, total_pago, ultimo_pagamento)
+SELECT o.id, COALESCE(i.total, 0), COALESCE(i.quantidade, 0), COALESCE(p.pago, 0), p.ultimo
+FROM orcamentos o
+LEFT JOIN (
+    SELECT id_orcamento, SUM(preco) AS total, COUNT(*) AS quantidade
+    FROM orcamento_itens GROUP BY id_orcamento
+) i ON i.id_orcamento = o.id
+LEFT JOIN (
+    SELECT id_orcamento, SUM(valor_parcela) AS pago, MAX(data_pagamento) AS ultimo
+    FROM pagamentos GROUP BY id_orcamento
+) p ON p.id_orcamento = o.id
+ON CONFLICT (id_orcamento) DO UPDATE
+SET total_itens = EXCLUDED.total_itens, quantidade_itens = EXCLUDED.quantidade_itens,
+    total_pago = EXCLUDED.total_pago, ultimo_pagamento = EXCLUDED.ultimo_pagamento;
+
+COMMIT;
@@ -0,0 +1,5 @@
+-- Migration para adicionar o índice usado na paginação da listagem de pacientes
+-- GET /pacientes?limit=...&cursor=... ordena por (nome, cpf) e filtra com
+-- (nome, cpf) > (cursor), o que vira uma varredura de intervalo neste índice
+
+CREATE INDEX IF NOT EXISTS idx_paciente_nome_cpf ON paciente (nome, cpf);
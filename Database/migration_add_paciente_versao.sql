@@ -0,0 +1,80 @@
+-- Migration para a versão por paciente usada nos ETags das leituras do paciente
+-- (GET /paciente/<cpf>, /paciente/<cpf>/orcamentos e /paciente/<cpf>/orcamentos/descricoes)
+-- Requer PostgreSQL 14+ (CREATE OR REPLACE TRIGGER)
+
+CREATE SEQUENCE IF NOT EXISTS paciente_versao_seq;
+
+CREATE TABLE IF NOT EXISTS paciente_versao (
+    id_paciente VARCHAR(11) PRIMARY KEY,
+    versao BIGINT NOT NULL,
+    FOREIGN KEY (id_paciente) REFERENCES paciente (cpf) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION incrementa_versao_paciente(p_cpf VARCHAR) RETURNS void AS $$
+BEGIN
+    -- O paciente pode já ter sido apagado (exclusão em cascata dos orçamentos/anotações)
+    INSERT INTO paciente_versao (id_paciente, versao)
+    SELECT p_cpf, nextval('paciente_versao_seq')
+    WHERE EXISTS (SELECT 1 FROM paciente WHERE cpf = p_cpf)
+    ON CONFLICT (id_paciente) DO UPDATE SET versao = EXCLUDED.versao;
+END;
+$$ LANGUAGE plpgsql;
+
+-- paciente: chave em cpf
+CREATE OR REPLACE FUNCTION versao_paciente_trg() RETURNS trigger AS $$
+BEGIN
+    PERFORM incrementa_versao_paciente(NEW.cpf);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- informacao_tratamentos e orcamentos: chave em id_paciente
+CREATE OR REPLACE FUNCTION versao_paciente_filho_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM incrementa_versao_paciente(OLD.id_paciente);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id_paciente IS DISTINCT FROM OLD.id_paciente) THEN
+        PERFORM incrementa_versao_paciente(NEW.id_paciente);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- orcamento_itens e pagamentos: paciente encontrado pelo orçamento
+CREATE OR REPLACE FUNCTION versao_paciente_orcamento_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM incrementa_versao_paciente(o.id_paciente) FROM orcamentos o WHERE o.id = OLD.id_orcamento;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id_orcamento IS DISTINCT FROM OLD.id_orcamento) THEN
+        PERFORM incrementa_versao_paciente(o.id_paciente) FROM orcamentos o WHERE o.id = NEW.id_orcamento;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER paciente_versao_trg
+    AFTER INSERT OR UPDATE ON paciente
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_trg();
+
+CREATE OR REPLACE TRIGGER informacao_tratamentos_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON informacao_tratamentos
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_filho_trg();
+
+CREATE OR REPLACE TRIGGER orcamentos_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON orcamentos
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_filho_trg();
+
+CREATE OR REPLACE TRIGGER orcamento_itens_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON orcamento_itens
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_orcamento_trg();
+
+CREATE OR REPLACE TRIGGER pagamentos_versao_trg
+    AFTER INSERT OR UPDATE OR DELETE ON pagamentos
+    FOR EACH ROW EXECUTE FUNCTION versao_paciente_orcamento_trg();
+
+-- Pacientes já cadastrados começam com uma versão
+INSERT INTO paciente_versao (id_paciente, versao)
+SELECT cpf, nextval('paciente_versao_seq') FROM paciente
+ON CONFLICT (id_paciente) DO NOTHING;
@@ -18,7 +18,7 @@ export function PatientList() {
   useEffect(() => {
     const fetchPatients = async () => {
       try {
-        const response = await fetch(`${API_URL}/pacientes`);
+        const response = await fetch(`${API_URL}/pacientes?fields=cpf,nome,telefone`);
         if (response.ok) {
           const data = await response.json();
           setPatients(data);
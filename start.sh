@@ -110,9 +110,16 @@ cleanup() {
 trap cleanup SIGINT SIGTERM
 
 # Iniciar Backend em background
+# Com --producao (ou BACKEND_PRODUCAO=1) o backend roda no Gunicorn (vários processos
+# e threads, ver Backend/gunicorn.conf.py); sem ele, no servidor de desenvolvimento do Flask.
 cd Backend
 source odonto/bin/activate
-python main.py > ../backend.log 2>&1 &
+if [ "$1" = "--producao" ] || [ "$BACKEND_PRODUCAO" = "1" ]; then
+    echo "Backend em modo produção (Gunicorn)."
+    gunicorn -c gunicorn.conf.py wsgi:app > ../backend.log 2>&1 &
+else
+    python main.py > ../backend.log 2>&1 &
+fi
 BACKEND_PID=$!
 cd ..
 